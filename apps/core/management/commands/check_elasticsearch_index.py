@@ -0,0 +1,32 @@
+import json
+from django.core.management.base import BaseCommand
+from apps.projects.consistency import check_index_consistency
+
+
+class Command(BaseCommand):
+    help = ('Compare documents of the ElasticSearch index with projects in the database, print differences '
+            'as JSON lines and the summary as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Update only fields which differ, create missing and delete orphaned documents')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--output', help='File to write differences to instead of the standard output')
+
+    def handle(self, *args, **kwargs):
+        output = open(kwargs['output'], 'w') if kwargs['output'] else None
+
+        def report(drift):
+            line = json.dumps({'project_id': drift.project_id, 'kind': drift.kind, 'fields': drift.fields})
+            if output:
+                output.write(line + '\n')
+            else:
+                self.stdout.write(line)
+
+        try:
+            summary = check_index_consistency(repair=kwargs['repair'], chunk_size=kwargs['chunk_size'],
+                                              report=report)
+        finally:
+            if output:
+                output.close()
+        self.stdout.write(json.dumps(summary._asdict()))
@@ -0,0 +1,10 @@
+import json
+from django.core.management.base import BaseCommand
+from apps.projects.indexing import get_index_outbox_stats
+
+
+class Command(BaseCommand):
+    help = 'Print the number of projects waiting to be indexed and the age of the oldest one in seconds as JSON'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write(json.dumps(get_index_outbox_stats()))
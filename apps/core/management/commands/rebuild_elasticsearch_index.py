@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.projects.utils import es, rebuild_elastic_index, get_alias_indices, IndexRebuildError, READ_ALIAS
+
+
+class Command(BaseCommand):
+    help = 'Build a new version of ElasticSearch index and switch aliases to it without downtime'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of projects fetched from database and sent in one bulk request')
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Number of threads sending bulk requests in parallel')
+        parser.add_argument('--delete-previous', action='store_true',
+                            help='Delete the index the aliases pointed to before the rebuild')
+
+    def handle(self, *args, **kwargs):
+        previous_indices = get_alias_indices(READ_ALIAS)
+        try:
+            index_name, stats = rebuild_elastic_index(chunk_size=kwargs['chunk_size'],
+                                                      thread_count=kwargs['threads'])
+        except IndexRebuildError as error:
+            raise CommandError(f'{error}. Aliases still point to {", ".join(previous_indices) or "no index"}, '
+                               f'{error.index_name} is kept for inspection')
+        self.stdout.write(f'Indexed {stats.indexed} projects into {index_name} in {stats.seconds:.1f}s')
+        self.stdout.write(self.style.SUCCESS(f'Aliases now point to {index_name}'))
+
+        if kwargs['delete_previous']:
+            for previous_index in previous_indices:
+                es.indices.delete(index=previous_index)
+                self.stdout.write(f'Deleted {previous_index}')
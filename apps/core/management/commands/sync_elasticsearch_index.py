@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from apps.projects.delta import sync_index_delta
+
+
+class Command(BaseCommand):
+    help = 'Reindex projects changed since the last synchronization and delete documents of deleted projects'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--range-size', type=int, default=None,
+                            help='Width of ranges of ids, which numbers of projects and documents are compared')
+
+    def handle(self, *args, **kwargs):
+        stats = sync_index_delta(range_size=kwargs['range_size'])
+        if stats is None:
+            self.stdout.write(self.style.ERROR('Another synchronization is running'))
+            return
+        since = stats.since.isoformat() if stats.since else 'the first synchronization'
+        self.stdout.write(f'Reindexed {stats.reindexed} projects changed since {since}, '
+                          f'indexed {stats.missing} missing and deleted {stats.deleted} documents '
+                          f'in {stats.seconds:.1f}s')
@@ -1,9 +1,30 @@
 from django.core.management.base import BaseCommand
-from apps.projects.utils import update_elastic_index
+from apps.projects.utils import update_elastic_index, bulk_update_elastic_index
 
 
 class Command(BaseCommand):
     help = 'Create or update ElasticSearch index'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--bulk', action='store_true',
+                            help='Reindex all projects into the live index with the bulk API, its refresh interval '
+                                 'is kept. Use rebuild_elasticsearch_index to load a new index with refresh disabled')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of projects fetched from database and sent in one bulk request')
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Number of threads sending bulk requests in parallel')
+
     def handle(self, *args, **kwargs):
-        update_elastic_index()
+        if not kwargs['bulk']:
+            update_elastic_index()
+            return
+
+        stats = bulk_update_elastic_index(chunk_size=kwargs['chunk_size'], thread_count=kwargs['threads'])
+        docs_per_second = stats.indexed / stats.seconds if stats.seconds else 0
+        self.stdout.write(f'Indexed {stats.indexed} projects in {stats.seconds:.1f}s ({docs_per_second:.0f} docs/sec)')
+        if stats.failed:
+            self.stdout.write(self.style.ERROR(f'Failed to index {stats.failed} projects'))
+            for error in stats.errors:
+                self.stdout.write(self.style.ERROR(f'  {error}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No failures'))
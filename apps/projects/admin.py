@@ -3,7 +3,7 @@ from import_export import resources
 from import_export.fields import Field
 from import_export.admin import ImportExportActionModelAdmin
 from import_export.widgets import ManyToManyWidget
-from .models import Industry, Technology, Project, CSVFile, Set, SetSharedLink
+from .models import Industry, Technology, Project, IndexOutboxEntry, CSVFile, Set, SetSharedLink
 from .forms import CustomImportForm, CustomConfirmImportForm
 
 
@@ -78,29 +78,6 @@ class ProjectResource(resources.ModelResource):
         instance.author_id = self.author
         return instance
 
-    def save_instance(self, instance, using_transactions=True, dry_run=False):
-        """
-        Takes care of saving the object to the database.
-        Objects can be created in bulk if ``use_bulk`` is enabled.
-        """
-        self.before_save_instance(instance, using_transactions, dry_run)
-        if self._meta.use_bulk:
-            if instance.pk:
-                self.update_instances.append(instance)
-            else:
-                self.create_instances.append(instance)
-        else:
-            if not using_transactions and dry_run:
-                # we don't have transactions and we want to do a dry_run
-                pass
-            else:
-                instance.save(refresh_index=False, dry_index_update=dry_run)
-        self.after_save_instance(instance, using_transactions, dry_run)
-
-    def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
-        from .utils import refresh_elastic_index
-        refresh_elastic_index()
-
 
 @admin.register(Project)
 class ProjectAdmin(ImportExportActionModelAdmin):
@@ -137,6 +114,14 @@ class ProjectAdmin(ImportExportActionModelAdmin):
         return rk
 
 
+@admin.register(IndexOutboxEntry)
+class IndexOutboxEntryAdmin(admin.ModelAdmin):
+    list_display = ("id", "project_id", "created_at")
+    list_display_links = ("id",)
+    search_fields = ("project_id",)
+    list_per_page = 25
+
+
 @admin.register(CSVFile)
 class CSVFileAdmin(admin.ModelAdmin):
     list_display = ("id", "author", "created_at")
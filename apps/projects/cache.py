@@ -0,0 +1,155 @@
+"""
+Cache of project search results.
+
+Keys contain a version of the searched corpus: the version of the author's projects for the private tab
+and the version of all public projects for the public tab, which is shared by all users.
+Versions are bumped after changed projects are indexed, so entries of the previous version are never read again
+and expire on their own. Changes indexed without waiting for refresh are searchable only after the next refresh
+of the index, results cached until then expire with it.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+
+def get_search_cache():
+    return caches['search']
+
+
+PUBLIC_VERSION_KEY = 'projects:public:version'
+UNREFRESHED_UNTIL_KEY = 'projects:unrefreshed:until'
+
+
+def get_author_version_key(author_id) -> str:
+    return f'projects:author:{author_id}:version'
+
+
+def get_version(key) -> int:
+    cache = get_search_cache()
+    version = cache.get(key)
+    if version is None:
+        # a lost version key starts from the current time, so it does not return to an already used version
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    cache = get_search_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+
+
+def get_author_version(author_id) -> int:
+    return get_version(get_author_version_key(author_id))
+
+
+def bump_author_versions(author_ids):
+    for author_id in author_ids:
+        bump_version(get_author_version_key(author_id))
+
+
+def bump_public_version():
+    bump_version(PUBLIC_VERSION_KEY)
+
+
+def mark_unrefreshed(seconds: float):
+    """Results cached within `seconds` may miss changes which are indexed but not searchable yet"""
+    get_search_cache().set(UNREFRESHED_UNTIL_KEY, time.time() + seconds, timeout=math.ceil(seconds))
+
+
+def get_cache_timeout(timeout: int = None) -> int:
+    """`timeout` or SEARCH_CACHE_TIMEOUT, shortened to expire by the refresh of not yet searchable changes"""
+    timeout = timeout or settings.SEARCH_CACHE_TIMEOUT
+    unrefreshed_until = get_search_cache().get(UNREFRESHED_UNTIL_KEY)
+    if unrefreshed_until is not None:
+        timeout = max(1, min(timeout, math.ceil(unrefreshed_until - time.time())))
+    return timeout
+
+
+def normalize_search_params(tab: str, page: int, industries: list[int], technologies: list[int],
+                            search_text: str = None, search_after: list = None) -> dict:
+    """Search parameters which return the same results are normalized to the same dict"""
+    return {
+        'tab': tab,
+        'page': page,
+        'industries': sorted(set(industries)),
+        'technologies': sorted(set(technologies)),
+        'search': ' '.join((search_text or '').lower().split()),
+        'search_after': search_after,
+    }
+
+
+def get_search_key(scope: str, version: int, params: dict) -> str:
+    params_hash = hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return f'projects:search:{scope}:{version}:{params_hash}'
+
+
+def get_private_search_key(author_id, params: dict) -> str:
+    return get_search_key(f'author:{author_id}', get_author_version(author_id), params)
+
+
+def get_public_search_key(params: dict) -> str:
+    return get_search_key('public', get_version(PUBLIC_VERSION_KEY), params)
+
+
+def cached_search(key: str, search, timeout: int = None):
+    """
+    Returns cached result of the search or runs `search()` and caches its result for `timeout` seconds,
+    SEARCH_CACHE_TIMEOUT by default, or until the next refresh if indexed changes are not searchable yet.
+    On a cache miss only one request runs the search, others wait for its result up to
+    SEARCH_CACHE_LOCK_TIMEOUT seconds and run the search themselves if it does not appear
+    """
+    cache = get_search_cache()
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, timeout=settings.SEARCH_CACHE_LOCK_TIMEOUT):
+        try:
+            result = search()
+            cache.set(key, result, timeout=get_cache_timeout(timeout))
+        finally:
+            cache.delete(lock_key)
+        return result
+
+    deadline = time.monotonic() + settings.SEARCH_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        result = cache.get(key)
+        if result is not None:
+            return result
+    return search()
+
+
+async def acached_search(key: str, search):
+    """`cached_search` of the async views, `search()` returns an awaitable. The cache is used from a thread"""
+    cache = get_search_cache()
+    result = await sync_to_async(cache.get)(key)
+    if result is not None:
+        return result
+
+    lock_key = f'{key}:lock'
+    if await sync_to_async(cache.add)(lock_key, 1, timeout=settings.SEARCH_CACHE_LOCK_TIMEOUT):
+        try:
+            result = await search()
+            await sync_to_async(cache.set)(key, result, timeout=await sync_to_async(get_cache_timeout)())
+        finally:
+            await sync_to_async(cache.delete)(lock_key)
+        return result
+
+    deadline = time.monotonic() + settings.SEARCH_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        result = await sync_to_async(cache.get)(key)
+        if result is not None:
+            return result
+    return await search()
@@ -0,0 +1,96 @@
+"""
+ElasticSearch client of the process.
+
+The client is created on first use, not when modules are imported, so management commands and
+workers which never search do not connect. A forked process (gunicorn or Celery prefork worker)
+drops the client inherited from the parent and creates its own, connections of a pool are never
+shared between processes. The pool of each process keeps up to ELASTICSEARCH_MAXSIZE connections
+per node, which should be the number of threads sending requests in one worker
+"""
+import asyncio
+import os
+import threading
+import weakref
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from elasticsearch import Elasticsearch
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client_options(urls) -> dict:
+    options = dict(
+        hosts=urls,
+        timeout=settings.ELASTICSEARCH_TIMEOUT,
+        max_retries=settings.ELASTICSEARCH_MAX_RETRIES,
+        retry_on_timeout=True,
+        maxsize=settings.ELASTICSEARCH_MAXSIZE,
+        http_compress=settings.ELASTICSEARCH_HTTP_COMPRESS,
+    )
+    if settings.ELASTICSEARCH_SNIFF:
+        # nodes of the cluster are discovered from the configured ones and refreshed when a node fails
+        options.update(sniff_on_start=True, sniff_on_connection_fail=True, sniffer_timeout=60)
+    return options
+
+
+def create_client(urls=None):
+    """
+    A `memory://` URL selects the in-process engine, for tests and benchmarks without a cluster.
+    Its indices are not shared between processes, so documents indexed by the Celery worker would never
+    be searched by web workers: it requires ELASTICSEARCH_ASYNC_INDEXING to be off
+    """
+    urls = urls or settings.ELASTICSEARCH_URLS
+    if urls[0].startswith('memory://'):
+        if settings.ELASTICSEARCH_ASYNC_INDEXING:
+            raise ImproperlyConfigured('The memory:// search engine keeps indices in one process, '
+                                       'it can not be used with ELASTICSEARCH_ASYNC_INDEXING')
+        from .search.memory import MemoryElasticsearch
+        return MemoryElasticsearch()
+    return Elasticsearch(**get_client_options(urls))
+
+
+def create_async_client(urls=None):
+    urls = urls or settings.ELASTICSEARCH_URLS
+    if urls[0].startswith('memory://'):
+        from .search.memory import AsyncMemoryElasticsearch
+        return AsyncMemoryElasticsearch(get_client())
+    # available only if aiohttp is installed
+    from elasticsearch import AsyncElasticsearch
+    return AsyncElasticsearch(**get_client_options(urls))
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+
+def get_async_client():
+    """Client of the async views. Connections of aiohttp belong to an event loop, each loop has its own client"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = create_async_client()
+    return client
+
+
+def reset_client():
+    """Forgets clients without closing them, connections of the parent process must stay open"""
+    global _client
+    _client = None
+    _async_clients.clear()
+
+
+os.register_at_fork(after_in_child=reset_client)
+
+
+class LazyClient:
+    """Stands for the client of the current process in module attributes, e.g. `utils.es`"""
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
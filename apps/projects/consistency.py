@@ -0,0 +1,154 @@
+"""
+Consistency check of the search index against the database.
+
+Projects are streamed from the database ordered by id in keyset chunks, and documents are streamed from
+the index sorted by `project_id` with `search_after`. Both streams are compared in a merge join, so memory
+does not grow with the number of projects. Each difference is reported as it is found.
+
+The repair sends partial updates with only the fields which differ. Documents are updated on condition
+that they have not been written since they were read, so a newer write of the outbox is not overwritten
+"""
+from collections import Counter, namedtuple
+from time import perf_counter
+from elasticsearch.helpers import BulkIndexError
+from .documents import dump_source, iter_document_sources
+from .utils import es, WRITE_ALIAS, ensure_index, get_indexable_projects, send_bulk_actions
+
+# compared field -> fields of the document which are derived from it and updated together
+CHECKED_FIELDS = {
+    'updated_at': ('updated_at',),
+    'is_private': ('is_private',),
+    'industries': ('industries', 'industry_list', 'industries_facet'),
+    'technologies': ('technologies', 'technology_list', 'technologies_facet'),
+}
+
+MISSING, ORPHANED, DIFFERENT = 'missing', 'orphaned', 'different'
+
+# `fields` are names of CHECKED_FIELDS which differ, `hit` is the indexed document
+Drift = namedtuple('Drift', ['project_id', 'kind', 'fields', 'hit'])
+ConsistencyReport = namedtuple('ConsistencyReport', [
+    'projects', 'documents', 'missing', 'orphaned', 'different', 'fields', 'repaired', 'seconds',
+])
+
+
+def iter_index_hits(index_name=WRITE_ALIAS, chunk_size=1000):
+    """Yields documents of the index with the checked fields, ordered by project id"""
+    body = {
+        'size': chunk_size,
+        '_source': ['project_id', *CHECKED_FIELDS],
+        'sort': [{'project_id': {'order': 'asc'}}],
+        'seq_no_primary_term': True,
+        'track_total_hits': False,
+    }
+    while True:
+        hits = es.search(index=index_name, body=body)['hits']['hits']
+        yield from hits
+        if len(hits) < chunk_size:
+            break
+        body['search_after'] = hits[-1]['sort']
+
+
+def normalize(field, value):
+    if field in ('industries', 'technologies'):
+        return sorted(str(obj_id) for obj_id in value or [])
+    return value
+
+
+def get_different_fields(source: dict, indexed: dict) -> list[str]:
+    return [field for field in CHECKED_FIELDS
+            if normalize(field, source[field]) != normalize(field, indexed.get(field))]
+
+
+def iter_drift(projects, hits):
+    """
+    Merge join of `(project_id, source)` pairs of the database and of hits of the index, both ordered by id.
+    Yields projects which documents are missing, documents of projects which do not exist and documents
+    which differ from the database
+    """
+    project, hit = next(projects, None), next(hits, None)
+    while project is not None or hit is not None:
+        hit_id = int(hit['_id']) if hit is not None else None
+        if hit is None or (project is not None and project[0] < hit_id):
+            yield Drift(project[0], MISSING, list(CHECKED_FIELDS), None)
+            project = next(projects, None)
+        elif project is None or hit_id < project[0]:
+            yield Drift(hit_id, ORPHANED, [], hit)
+            hit = next(hits, None)
+        else:
+            if fields := get_different_fields(project[1], hit['_source']):
+                yield Drift(hit_id, DIFFERENT, fields, hit)
+            project, hit = next(projects, None), next(hits, None)
+
+
+def get_repair_actions(drifts: list[Drift], index_name=WRITE_ALIAS):
+    """
+    Actions of the bulk API repairing the documents. Projects are read again, the database may have changed
+    since the check. Missing documents are created unless they have been indexed meanwhile
+    """
+    project_ids = [drift.project_id for drift in drifts if drift.kind != ORPHANED]
+    sources = dict(iter_document_sources(get_indexable_projects().filter(id__in=project_ids)))
+    for drift in drifts:
+        action = {'_index': index_name, '_id': drift.project_id}
+        if drift.hit is not None:
+            action.update(if_seq_no=drift.hit['_seq_no'], if_primary_term=drift.hit['_primary_term'])
+        source = sources.get(drift.project_id)
+        if drift.kind == ORPHANED:
+            yield {'_op_type': 'delete', **action}
+        elif source is None:
+            # deleted since the check, the outbox deletes its document
+            continue
+        elif drift.kind == MISSING:
+            yield {'_op_type': 'create', '_source': dump_source(source), **action}
+        elif fields := get_different_fields(source, drift.hit['_source']):
+            doc = {name: source[name] for field in fields for name in CHECKED_FIELDS[field]}
+            yield {'_op_type': 'update', 'doc': doc, **action}
+
+
+def repair_drift(drifts: list[Drift], index_name=WRITE_ALIAS) -> int:
+    """Returns the number of sent repairs. Documents which have changed since the check are skipped"""
+    actions = list(get_repair_actions(drifts, index_name))
+    errors = send_bulk_actions(actions, index_name=index_name)
+    if errors:
+        raise BulkIndexError(f'{len(errors)} document(s) failed to repair.', errors)
+    return len(actions)
+
+
+def check_index_consistency(index_name=WRITE_ALIAS, repair=False, chunk_size=1000, report=None):
+    """
+    Compares the index with the database and returns the summary. `report` is called with each difference.
+    With `repair`, differences are repaired in batches of `chunk_size` while the check goes on
+    """
+    ensure_index()
+    started_at = perf_counter()
+    counts, fields, repaired, batch = Counter(), Counter(), 0, []
+
+    def count_projects(rows):
+        for row in rows:
+            counts['projects'] += 1
+            yield row
+
+    def count_documents(hits):
+        for hit in hits:
+            counts['documents'] += 1
+            yield hit
+
+    projects = count_projects(iter_document_sources(get_indexable_projects(), chunk_size))
+    hits = count_documents(iter_index_hits(index_name, chunk_size))
+    for drift in iter_drift(projects, hits):
+        counts[drift.kind] += 1
+        if drift.kind == DIFFERENT:
+            fields.update(drift.fields)
+        if report is not None:
+            report(drift)
+        if repair:
+            batch.append(drift)
+            if len(batch) == chunk_size:
+                repaired += repair_drift(batch, index_name)
+                batch = []
+    if repair and batch:
+        repaired += repair_drift(batch, index_name)
+    return ConsistencyReport(
+        projects=counts['projects'], documents=counts['documents'], missing=counts[MISSING],
+        orphaned=counts[ORPHANED], different=counts[DIFFERENT], fields=dict(fields), repaired=repaired,
+        seconds=perf_counter() - started_at,
+    )
@@ -0,0 +1,169 @@
+"""
+Incremental synchronization of the index with the database, which repairs documents of changes the index outbox
+has missed, without reindexing all projects.
+
+Projects changed since the high-water mark of `updated_at`, kept in `_meta` of the index, are reindexed.
+Changes of relations and of industries and technologies touch `updated_at` of their projects too.
+Deleted projects and projects missing in the index are found by comparing numbers of projects and documents
+in ranges of ids with one grouped query and one histogram aggregation. Only ranges where the numbers differ
+are compared id by id.
+
+Documents are written on condition that they have not changed since their sequence numbers were read before
+the projects, so a newer document written by the outbox meanwhile is not overwritten by an older state
+"""
+from collections import namedtuple
+from datetime import datetime
+from time import perf_counter
+from typing import Optional
+from django.conf import settings
+from django.db.models import Count, F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from elasticsearch.helpers import BulkIndexError, scan
+from .cache import bump_author_versions, bump_public_version, get_search_cache
+from .documents import dump_source, iter_document_sources
+from .utils import (
+    es, WRITE_ALIAS, REINDEX_REPLAY_MARGIN, ensure_index, get_indexable_projects, send_bulk_actions,
+)
+
+WATERMARK_META_KEY = 'delta_synced_until'
+DELTA_SYNC_LOCK_KEY = 'projects:delta-sync:lock'
+
+DeltaSyncStats = namedtuple('DeltaSyncStats', ['since', 'reindexed', 'deleted', 'missing', 'seconds'])
+
+
+def get_index_meta(index_name=WRITE_ALIAS) -> dict:
+    for mapping in es.indices.get_mapping(index=index_name).values():
+        return mapping['mappings'].get('_meta', {})
+    return {}
+
+
+def get_watermark(index_name=WRITE_ALIAS) -> Optional[datetime]:
+    value = get_index_meta(index_name).get(WATERMARK_META_KEY)
+    return parse_datetime(value) if value else None
+
+
+def set_watermark(value: datetime, index_name=WRITE_ALIAS):
+    # `_meta` is replaced as a whole, other keys are written back
+    meta = {**get_index_meta(index_name), WATERMARK_META_KEY: value.isoformat()}
+    es.indices.put_mapping(index=index_name, body={'_meta': meta})
+
+
+def get_db_range_counts(range_size: int) -> dict[int, int]:
+    """Numbers of indexable projects by the start of the range of ids"""
+    rows = get_indexable_projects().order_by().annotate(range_number=F('id') / range_size).values(
+        'range_number').annotate(count=Count('id')).values_list('range_number', 'count')
+    return {range_number * range_size: count for range_number, count in rows}
+
+
+def get_index_range_counts(range_size: int, index_name=WRITE_ALIAS) -> dict[int, int]:
+    result = es.search(index=index_name, body={
+        'size': 0,
+        'aggs': {'ranges': {'histogram': {'field': 'project_id', 'interval': range_size, 'min_doc_count': 1}}},
+    })
+    return {int(bucket['key']): bucket['doc_count'] for bucket in result['aggregations']['ranges']['buckets']}
+
+
+def get_index_authors(start: int, end: int, index_name=WRITE_ALIAS) -> dict[int, int]:
+    """Authors of documents with ids from `start` to `end` (excluded) by project id"""
+    documents = scan(es, index=index_name, query={
+        'query': {'range': {'project_id': {'gte': start, 'lt': end}}},
+        '_source': ['author'],
+        'sort': ['_doc'],
+    })
+    return {int(document['_id']): document['_source'].get('author') for document in documents}
+
+
+def find_range_differences(range_size: int, index_name=WRITE_ALIAS):
+    """
+    Returns ids of projects missing in the index and ids of documents of deleted projects with their authors.
+    A range where one project was deleted and another one is missing has the same numbers and is not compared
+    """
+    db_counts = get_db_range_counts(range_size)
+    index_counts = get_index_range_counts(range_size, index_name)
+    missing_ids, deleted_authors = set(), {}
+    for start in sorted(set(db_counts) | set(index_counts)):
+        if db_counts.get(start, 0) == index_counts.get(start, 0):
+            continue
+        end = start + range_size
+        project_ids = set(get_indexable_projects().filter(id__gte=start, id__lt=end).values_list('id', flat=True))
+        index_authors = get_index_authors(start, end, index_name)
+        missing_ids |= project_ids - set(index_authors)
+        deleted_authors.update(
+            (project_id, author_id) for project_id, author_id in index_authors.items() if project_id not in project_ids)
+    return missing_ids, deleted_authors
+
+
+def get_indexed_seq_nos(project_ids, index_name=WRITE_ALIAS) -> dict[int, tuple[int, int]]:
+    """Sequence numbers and primary terms of documents of the projects by project id"""
+    result = es.search(index=index_name, body={
+        'size': len(project_ids),
+        'query': {'ids': {'values': [str(project_id) for project_id in project_ids]}},
+        '_source': False,
+        'seq_no_primary_term': True,
+    })
+    return {int(hit['_id']): (hit['_seq_no'], hit['_primary_term']) for hit in result['hits']['hits']}
+
+
+def get_sync_actions(project_ids, index_name=WRITE_ALIAS):
+    """
+    Actions of the bulk API writing documents of the projects. A document which exists is replaced or deleted
+    only if it has not been written since it was read, a missing one is created unless it has been meanwhile
+    """
+    seq_nos = get_indexed_seq_nos(project_ids, index_name)
+    sources = dict(iter_document_sources(get_indexable_projects().filter(id__in=project_ids)))
+    for project_id in project_ids:
+        action = {'_index': index_name, '_id': project_id}
+        if project_id in seq_nos:
+            action.update(if_seq_no=seq_nos[project_id][0], if_primary_term=seq_nos[project_id][1])
+        source = sources.get(project_id)
+        if source is None:
+            if project_id in seq_nos:
+                yield {'_op_type': 'delete', **action}
+        else:
+            op_type = 'index' if project_id in seq_nos else 'create'
+            yield {'_op_type': op_type, '_source': dump_source(source), **action}
+
+
+def sync_index_documents(project_ids, index_name=WRITE_ALIAS):
+    """Writes documents of the projects, the ones written by others since they were read are skipped"""
+    errors = send_bulk_actions(get_sync_actions(project_ids, index_name), index_name=index_name)
+    if errors:
+        raise BulkIndexError(f'{len(errors)} document(s) failed to synchronize.', errors)
+
+
+def sync_index_delta(range_size=None, chunk_size=500) -> Optional[DeltaSyncStats]:
+    """
+    Reindexes projects changed since the watermark of the index, indexes missing ones and deletes documents
+    of deleted projects. Cached search results are invalidated if anything has changed.
+    Returns None if another synchronization is running
+    """
+    range_size = range_size or settings.ELASTICSEARCH_DELTA_RANGE_SIZE
+    cache = get_search_cache()
+    if not cache.add(DELTA_SYNC_LOCK_KEY, 1, timeout=settings.ELASTICSEARCH_DELTA_SYNC_LOCK_TIMEOUT):
+        return None
+    try:
+        ensure_index()
+        started_at, timer = timezone.now(), perf_counter()
+        watermark = get_watermark()
+        since = watermark - REINDEX_REPLAY_MARGIN if watermark else None
+
+        changed = []
+        if since is not None:
+            # transactions may commit after `updated_at` was set, changes close to the watermark are synced again
+            changed = list(get_indexable_projects().filter(updated_at__gte=since).values_list('id', 'author_id'))
+        missing_ids, deleted_authors = find_range_differences(range_size)
+        project_ids = sorted({project_id for project_id, _ in changed} | missing_ids | set(deleted_authors))
+        for start in range(0, len(project_ids), chunk_size):
+            sync_index_documents(project_ids[start:start + chunk_size])
+        set_watermark(started_at)
+
+        author_ids = {author_id for _, author_id in changed} | set(filter(None, deleted_authors.values()))
+        author_ids |= set(get_indexable_projects().filter(id__in=missing_ids).values_list('author_id', flat=True))
+        if project_ids:
+            bump_author_versions(author_ids)
+            bump_public_version()
+        return DeltaSyncStats(since=since, reindexed=len(changed), deleted=len(deleted_authors),
+                              missing=len(missing_ids), seconds=perf_counter() - timer)
+    finally:
+        cache.delete(DELTA_SYNC_LOCK_KEY)
@@ -0,0 +1,91 @@
+"""
+Documents of projects in the search index.
+
+Documents of many projects are built with a fixed number of queries per chunk: one for fields of projects
+and one per relation, which rows are grouped by project in memory. Documents are serialized once,
+either into a JSON string which the bulk helpers send as is, or into a bulk request body in bytes
+"""
+import json
+from django.db.models import QuerySet
+from .loaders import get_related_values
+from .models import Project, DOCUMENT_VERSION, get_facet_key
+
+SOURCE_FIELDS = ('id', 'title', 'description', 'author_id', 'is_private', 'url', 'url_is_active', 'updated_at')
+
+
+def build_source(project: dict, industries, technologies) -> dict:
+    """
+    Document of the project from values of SOURCE_FIELDS and its industries and technologies,
+    which can be model instances or FacetValue
+    """
+    return {
+        'doc_version': DOCUMENT_VERSION,
+        'title': project['title'],
+        'description': project['description'],
+        'author': project['author_id'],
+        'project_id': project['id'],
+        'is_private': project['is_private'],
+        'url': project['url'],
+        'url_is_active': project['url_is_active'],
+        # compared with the database by `apps.projects.consistency`
+        'updated_at': project['updated_at'].isoformat(),
+        'industries': [industry.id for industry in industries],
+        'technologies': [technology.id for technology in technologies],
+        # titles let the listing show industries and technologies without database queries
+        'industry_list': [{'id': industry.id, 'title': industry.title} for industry in industries],
+        'technology_list': [{'id': technology.id, 'title': technology.title} for technology in technologies],
+        'industries_facet': [get_facet_key(industry) for industry in industries],
+        'technologies_facet': [get_facet_key(technology) for technology in technologies],
+    }
+
+
+def dump_source(source: dict) -> str:
+    return json.dumps(source, ensure_ascii=False, separators=(',', ':'))
+
+
+def iter_document_sources(projects, chunk_size=1000):
+    """
+    Yields ids and documents of projects of the queryset or the list of ids, ordered by id.
+    Projects are fetched as values in chunks with a keyset condition on id, three queries per chunk
+    """
+    if not isinstance(projects, QuerySet):
+        projects = Project.objects.filter(id__in=list(projects))
+    rows = projects.order_by('id').values(*SOURCE_FIELDS)
+    last_id = 0
+    while True:
+        chunk = list(rows.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+        project_ids = [row['id'] for row in chunk]
+        industries = get_related_values('industries', project_ids)
+        technologies = get_related_values('technologies', project_ids)
+        for row in chunk:
+            yield row['id'], build_source(row, industries[row['id']], technologies[row['id']])
+        if len(chunk) < chunk_size:
+            break
+        last_id = project_ids[-1]
+
+
+def get_bulk_body(projects, index_name, project_ids=(), versions=None) -> bytes:
+    """
+    Body of a bulk request indexing documents of `projects`. Documents of `project_ids` which are not
+    among `projects` are deleted. If `versions` are given, documents are written with external versions
+    """
+    lines = []
+
+    def add_action(op_type, project_id):
+        action = {'_index': index_name, '_id': project_id}
+        if versions:
+            action.update(version=versions[project_id], version_type='external_gte')
+        lines.append(dump_source({op_type: action}))
+
+    indexed_ids = set()
+    for project_id, source in iter_document_sources(projects):
+        add_action('index', project_id)
+        lines.append(dump_source(source))
+        indexed_ids.add(project_id)
+    for project_id in project_ids:
+        if project_id not in indexed_ids:
+            add_action('delete', project_id)
+    lines.append('')
+    return '\n'.join(lines).encode('utf-8')
@@ -0,0 +1,110 @@
+"""
+Concurrent steps of one request.
+
+Independent database lookups of a request, e.g. relations of several projects or facet counts, are submitted
+to a thread pool shared by the process. Each request may run at most PROJECTS_REQUEST_PARALLEL_QUERIES
+of them at once, so a single request can not take all threads. Durations of steps are reported in
+the `Server-Timing` header by `ServerTimingMiddleware`.
+
+Steps run in the calling thread if the pool is disabled, inside a transaction, whose uncommitted rows
+other connections do not see, or within another step. Each thread of the pool has its own database connection,
+which is reused by its next steps for CONN_MAX_AGE seconds, with CONN_MAX_AGE 0 every step connects again
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from time import perf_counter
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+_pool = None
+_pool_lock = threading.Lock()
+_step_thread = threading.local()
+
+_current_executor = ContextVar('request_executor', default=None)
+
+
+def get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=settings.PROJECTS_QUERY_THREADS,
+                                           thread_name_prefix='request-step')
+    return _pool
+
+
+def reset_pool():
+    """Threads are not copied into a forked process, it creates its own pool"""
+    global _pool
+    _pool = None
+
+
+os.register_at_fork(after_in_child=reset_pool)
+
+
+def run_step(fn, args, kwargs):
+    """Connections of pool threads are reused according to CONN_MAX_AGE, like connections of requests"""
+    _step_thread.active = True
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+        _step_thread.active = False
+
+
+class RequestExecutor:
+    def __init__(self, max_parallel: int = None):
+        self.semaphore = threading.BoundedSemaphore(max_parallel or settings.PROJECTS_REQUEST_PARALLEL_QUERIES)
+        # (name, milliseconds) of finished steps
+        self.timings = []
+
+    def can_run_in_thread(self) -> bool:
+        return (settings.PROJECTS_QUERY_THREADS > 0 and not connection.in_atomic_block
+                and not getattr(_step_thread, 'active', False))
+
+    @contextmanager
+    def timed(self, name: str):
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, (perf_counter() - started_at) * 1000))
+
+    def run(self, name: str, fn, *args, **kwargs):
+        with self.timed(name):
+            return fn(*args, **kwargs)
+
+    def submit(self, name: str, fn, *args, **kwargs) -> Future:
+        """Starts `fn` in a thread of the pool, waits while the request already runs the maximum of steps"""
+        if not self.can_run_in_thread():
+            future = Future()
+            try:
+                future.set_result(self.run(name, fn, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self.semaphore.acquire()
+        # steps see the executor of the request, nested steps are timed too
+        future = get_pool().submit(copy_context().run, self.run, name, run_step, fn, args, kwargs)
+        future.add_done_callback(lambda _: self.semaphore.release())
+        return future
+
+    @contextmanager
+    def activate(self):
+        token = _current_executor.set(self)
+        try:
+            yield self
+        finally:
+            _current_executor.reset(token)
+
+    def get_server_timing(self) -> str:
+        return ', '.join(f'{name};dur={duration:.1f}' for name, duration in self.timings)
+
+
+def get_request_executor() -> RequestExecutor:
+    """Executor of the current request, a new one outside of requests, e.g. in Celery tasks"""
+    return _current_executor.get() or RequestExecutor()
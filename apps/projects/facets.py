@@ -0,0 +1,108 @@
+"""
+Facets of the projects search.
+
+Selected facet values filter hits through `post_filter`, so aggregations run over the base query only.
+Each facet has a filter aggregation, which applies selections of all other facets but not its own one,
+and a nested aggregation with its own selection to count projects already in the result.
+
+Facets of the listing are loaded after its projects and show the top `size` values. Selected values are
+counted by their own aggregation, so they are shown even if they are not among the top values
+"""
+from collections import namedtuple
+
+FACET_SIZE = 1000
+
+FacetValue = namedtuple('FacetValue', ['id', 'title'])
+
+
+class Facet:
+    """Facet filtering by ids in `field` and aggregating `id|title` keys of `<field>_facet`"""
+
+    def __init__(self, name: str, field: str, selected_ids: list[int], size: int = FACET_SIZE):
+        self.name = name
+        self.field = field
+        self.selected_ids = selected_ids
+        self.size = size
+
+    @property
+    def selection_filter(self) -> dict:
+        return {"terms": {self.field: self.selected_ids}}
+
+    @property
+    def fetch_size(self) -> int:
+        # selected values may be among the top values, one other value more than the size tells
+        # whether the facet has more values
+        return self.size + len(self.selected_ids) + 1
+
+    def get_terms_agg(self, size: int = None) -> dict:
+        return {"terms": {"field": f'{self.field}_facet', "size": size + 1 if size else self.fetch_size}}
+
+    def get_selected_values_agg(self) -> dict:
+        # keys of values are `id|title`
+        selected_ids = '|'.join(str(obj_id) for obj_id in self.selected_ids)
+        return {"terms": {"field": f'{self.field}_facet', "include": f'({selected_ids})\\|.*',
+                          "size": len(self.selected_ids)}}
+
+
+def get_post_filter(facets: list[Facet]) -> dict:
+    return {"bool": {"must": [facet.selection_filter for facet in facets if facet.selected_ids]}}
+
+
+def get_facet_aggs(facets: list[Facet], names: list[str] = None) -> dict:
+    """Aggregations of facets with `names`, of all facets by default"""
+    aggs = {}
+    for facet in facets:
+        if names is not None and facet.name not in names:
+            continue
+        other_filters = [other.selection_filter for other in facets if other is not facet and other.selected_ids]
+        facet_aggs = {"values": facet.get_terms_agg()}
+        if facet.selected_ids:
+            facet_aggs["selected_values"] = facet.get_selected_values_agg()
+            # projects in the result are counted for all values, numbers of other values would be wrong otherwise
+            facet_aggs["selected"] = {"filter": facet.selection_filter,
+                                      "aggs": {"values": facet.get_terms_agg(FACET_SIZE)}}
+        aggs[facet.name] = {"filter": {"bool": {"must": other_filters}}, "aggs": facet_aggs}
+    return aggs
+
+
+def get_bucket_counts(terms: dict) -> dict[FacetValue, int]:
+    counts = {}
+    for bucket in terms['buckets']:
+        obj_id, title = bucket['key'].split('|', 1)
+        counts[FacetValue(int(obj_id), title)] = bucket['doc_count']
+    return counts
+
+
+def merge_facet_counts(facet: Facet, counts: dict[FacetValue, int],
+                       in_result: dict[FacetValue, int]) -> list[list[FacetValue, int]]:
+    """
+    Returns list of [value, doc_count] pairs of the facet from numbers of projects having each value
+    and matching selections of other facets (`counts`) and of these projects already in the result (`in_result`).
+    Selected values go first with number of projects having them, then other values in descending order
+    of number of projects they would add to the result
+    """
+    selected_ids = set(facet.selected_ids)
+    if selected_ids:
+        counts = {
+            value: count if value.id in selected_ids else count - in_result.get(value, 0)
+            for value, count in counts.items()
+        }
+    facet_counts = [[value, count] for value, count in counts.items()]
+    return sorted(facet_counts, key=lambda x: (x[0].id in selected_ids, x[1]), reverse=True)
+
+
+def get_facet_counts(aggregations: dict, facet: Facet) -> list[list[FacetValue, int]]:
+    aggregation = aggregations[facet.name]
+    counts, in_result = get_bucket_counts(aggregation['values']), {}
+    if facet.selected_ids:
+        counts.update(get_bucket_counts(aggregation['selected_values']))
+        in_result = get_bucket_counts(aggregation['selected']['values'])
+    return merge_facet_counts(facet, counts, in_result)
+
+
+def limit_facet_values(facet: Facet, facet_counts: list) -> tuple[list, bool]:
+    """Selected values and up to `size` other values of the facet, and whether the facet has more values"""
+    selected_ids = set(facet.selected_ids)
+    selected = [item for item in facet_counts if item[0].id in selected_ids]
+    others = [item for item in facet_counts if item[0].id not in selected_ids]
+    return selected + others[:facet.size], len(others) > facet.size
@@ -0,0 +1,67 @@
+"""
+Projects of the search listing built from the `_source` of hits instead of database rows.
+
+Documents of an older DOCUMENT_VERSION lack fields needed to render a project, such projects are loaded
+from the database with one query
+"""
+from .facets import FacetValue
+from .executor import get_request_executor
+from .loaders import attach_related_values, submit_related_values
+from .models import Project, DOCUMENT_VERSION
+
+# fields of the document used to render a project
+HIT_SOURCE_FIELDS = [
+    'doc_version', 'project_id', 'title', 'description', 'author', 'is_private', 'url', 'url_is_active',
+    'industry_list', 'technology_list',
+]
+
+
+class ProjectHit:
+    """Read-only project of the listing with the attributes `project.html` uses"""
+    __slots__ = ('id', 'title', 'description', 'author_id', 'is_private', 'url', 'url_is_active',
+                 'industry_list', 'technology_list')
+    # only original projects are indexed
+    is_original = True
+
+    def __init__(self, source: dict):
+        self.id = source['project_id']
+        self.title = source['title']
+        self.description = source['description']
+        self.author_id = source['author']
+        self.is_private = source['is_private']
+        self.url = source['url']
+        self.url_is_active = source['url_is_active']
+        self.industry_list = [FacetValue(item['id'], item['title']) for item in source['industry_list']]
+        self.technology_list = [FacetValue(item['id'], item['title']) for item in source['technology_list']]
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return f"{self.title}"
+
+
+def is_stale(source: dict) -> bool:
+    return source.get('doc_version') != DOCUMENT_VERSION
+
+
+def get_projects_from_hits(hits: list) -> list:
+    """
+    Returns projects in the order of hits, loading from the database only projects with stale documents.
+    Stale projects and their relations are looked up at the same time
+    """
+    stale_ids = [int(hit['_id']) for hit in hits if is_stale(hit['_source'])]
+    stale_projects = {}
+    if stale_ids:
+        lookup = get_request_executor().submit('stale-projects', Project.objects.in_bulk, stale_ids)
+        relations = submit_related_values(stale_ids)
+        stale_projects = lookup.result()
+        attach_related_values(list(stale_projects.values()), relations)
+    projects = []
+    for hit in hits:
+        if not is_stale(hit['_source']):
+            projects.append(ProjectHit(hit['_source']))
+        elif int(hit['_id']) in stale_projects:
+            projects.append(stale_projects[int(hit['_id'])])
+    return projects
@@ -0,0 +1,210 @@
+import logging
+from functools import wraps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from elasticsearch.exceptions import ElasticsearchException
+from .models import Project, IndexOutboxEntry
+
+
+logger = logging.getLogger(__name__)
+
+# set while a processing task is waiting in the queue, so each commit does not add another one.
+# It expires after the interval of the periodic task, which processes the outbox anyway
+OUTBOX_TASK_QUEUED_KEY = 'projects:outbox:queued'
+OUTBOX_TASK_QUEUED_TIMEOUT = 60
+
+
+class IndexingBuffer:
+    """
+    Ids of projects changed within one database transaction. Each project gets an outbox entry
+    in this transaction and the outbox is processed once on commit
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        # savepoints which were active when the outbox entry was added, by project id and `was_public`
+        self.entry_savepoints = {}
+        # savepoints which were active when `updated_at` of the project was set, by project id
+        self.updated_savepoints = {}
+        self.refresh = False
+
+    def is_active(self, savepoint_ids, added_in) -> bool:
+        # changes made in a savepoint are gone after a rollback to it, the savepoint is not active anymore
+        return added_in is not None and savepoint_ids[:len(added_in)] == added_in
+
+    def add(self, project_ids, author_id=None, was_public=False):
+        savepoint_ids = tuple(self.connection.savepoint_ids)
+        new_ids = []
+        for project_id in set(project_ids):
+            if not self.is_active(savepoint_ids, self.entry_savepoints.get((project_id, was_public))):
+                new_ids.append(project_id)
+                self.entry_savepoints[(project_id, was_public)] = savepoint_ids
+        IndexOutboxEntry.objects.using(self.connection.alias).bulk_create([
+            IndexOutboxEntry(project_id=project_id, author_id=author_id, was_public=was_public)
+            for project_id in new_ids
+        ])
+
+    def mark_updated(self, project_ids):
+        savepoint_ids = tuple(self.connection.savepoint_ids)
+        for project_id in project_ids:
+            self.updated_savepoints[project_id] = savepoint_ids
+
+    def touch(self, project_ids):
+        savepoint_ids = tuple(self.connection.savepoint_ids)
+        stale_ids = [project_id for project_id in set(project_ids)
+                     if not self.is_active(savepoint_ids, self.updated_savepoints.get(project_id))]
+        if stale_ids:
+            Project.objects.using(self.connection.alias).filter(id__in=stale_ids).update(updated_at=timezone.now())
+            self.mark_updated(stale_ids)
+
+    def flush(self):
+        project_ids = {project_id for project_id, _ in self.entry_savepoints}
+        self.entry_savepoints = {}
+        if project_ids:
+            schedule_outbox_processing(project_ids, refresh=self.refresh)
+
+
+def get_pending_buffer(connection) -> IndexingBuffer:
+    """
+    Returns the buffer of the current transaction. A new buffer is started when the flush of the previous one
+    is not scheduled anymore: it has been executed on commit or discarded on rollback
+    """
+    buffer = getattr(connection, 'projects_indexing_buffer', None)
+    if buffer is None or not any(callback[1] == buffer.flush for callback in connection.run_on_commit):
+        buffer = IndexingBuffer(connection)
+        connection.projects_indexing_buffer = buffer
+        transaction.on_commit(buffer.flush, using=connection.alias)
+    return buffer
+
+
+def index_on_commit(project_ids, author_id=None, was_public=False, using=None):
+    """
+    Marks projects as changed. Their documents are updated (or deleted if projects do not exist anymore)
+    after the outermost transaction commits. Nothing is sent if it rolls back.
+    `author_id` and `was_public` are required to invalidate cached search results of the author and
+    of public projects if projects are deleted or made private
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        buffer = IndexingBuffer(connection)
+        buffer.add(project_ids, author_id=author_id, was_public=was_public)
+        buffer.flush()
+        return
+    get_pending_buffer(connection).add(project_ids, author_id=author_id, was_public=was_public)
+
+
+def mark_updated(project_ids, using=None):
+    """Marks projects which `updated_at` has been set by saving them in the current transaction"""
+    connection = transaction.get_connection(using)
+    if connection.in_atomic_block:
+        get_pending_buffer(connection).mark_updated(project_ids)
+
+
+def touch_projects(project_ids, using=None):
+    """
+    Changes which do not save projects move `updated_at`, so the delta synchronization of the index sees them.
+    Projects which have been saved or touched in the current transaction already have a new `updated_at`
+    and are not updated again
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        Project.objects.using(connection.alias).filter(id__in=project_ids).update(updated_at=timezone.now())
+        return
+    get_pending_buffer(connection).touch(project_ids)
+
+
+def schedule_outbox_processing(project_ids, refresh=False):
+    """
+    Sends committed changes to the index. With ELASTICSEARCH_ASYNC_INDEXING changes are sent by the Celery worker,
+    except for requests which need to read their writes: these try to send their own changes right away
+    and leave them to the worker if the index is not available
+    """
+    from .tasks import process_index_outbox_task
+    if not settings.ELASTICSEARCH_ASYNC_INDEXING:
+        drain_index_outbox(project_ids=project_ids, refresh=refresh)
+        return
+    if refresh:
+        try:
+            drain_index_outbox(project_ids=project_ids, refresh=refresh)
+            return
+        except ElasticsearchException:
+            logger.warning('Failed to index projects %s, leaving them to the worker', project_ids, exc_info=True)
+    try:
+        from .cache import get_search_cache
+        if get_search_cache().add(OUTBOX_TASK_QUEUED_KEY, 1, timeout=OUTBOX_TASK_QUEUED_TIMEOUT):
+            process_index_outbox_task.delay()
+    except Exception:
+        # entries stay in the outbox and are processed by the periodic task
+        logger.exception('Failed to schedule processing of the index outbox')
+
+
+def process_index_outbox(project_ids=None, refresh=False, batch_size=None) -> int:
+    """
+    Sends one batch of outbox entries to the index and removes them. Entries locked by other workers are skipped.
+    Entries of one project are sent as one document versioned by the latest entry id, so an older state
+    of the project sent by a concurrent worker can not overwrite a newer one. Cached search results
+    of authors of the projects are invalidated afterwards. Without `refresh` the documents are searchable
+    after the next refresh only, results cached until then expire with it. Returns number of processed entries
+    """
+    from .cache import bump_author_versions, bump_public_version, mark_unrefreshed
+    from .search import get_search_backend
+    from .utils import get_indexable_projects, get_refresh_delay
+    batch_size = batch_size or settings.ELASTICSEARCH_OUTBOX_BATCH_SIZE
+    with transaction.atomic():
+        entries = IndexOutboxEntry.objects.select_for_update(skip_locked=True).order_by('id')
+        if project_ids is not None:
+            entries = entries.filter(project_id__in=project_ids)
+        entries = list(entries.values_list('id', 'project_id', 'author_id', 'was_public')[:batch_size])
+        if not entries:
+            return 0
+
+        versions, author_ids, public_changed = {}, set(), False
+        for entry_id, project_id, author_id, was_public in entries:
+            versions[project_id] = max(entry_id, versions.get(project_id, 0))
+            if author_id:
+                author_ids.add(author_id)
+            public_changed = public_changed or was_public
+        get_search_backend().index_projects(set(versions), refresh=refresh, versions=versions)
+        IndexOutboxEntry.objects.filter(id__in=[entry[0] for entry in entries]).delete()
+        for author_id, is_private in get_indexable_projects().filter(id__in=versions).values_list(
+                'author_id', 'is_private'):
+            author_ids.add(author_id)
+            public_changed = public_changed or not is_private
+    if not refresh:
+        mark_unrefreshed(get_refresh_delay())
+    bump_author_versions(author_ids)
+    if public_changed:
+        bump_public_version()
+    return len(entries)
+
+
+def drain_index_outbox(project_ids=None, refresh=False) -> int:
+    """Processes outbox entries batch by batch until there are no unlocked entries left"""
+    processed = 0
+    while batch_processed := process_index_outbox(project_ids=project_ids, refresh=refresh):
+        processed += batch_processed
+    return processed
+
+
+def get_index_outbox_stats() -> dict:
+    """Number of entries waiting in the outbox and age of the oldest one in seconds"""
+    stats = IndexOutboxEntry.objects.aggregate(depth=Count('id'), oldest=Min('created_at'))
+    lag = (timezone.now() - stats['oldest']).total_seconds() if stats['oldest'] else 0
+    return {'depth': stats['depth'], 'lag': lag}
+
+
+def read_your_writes(view_func):
+    """
+    Runs the view in a transaction. Documents changed by the view are searchable by the time the response
+    is sent, if ELASTICSEARCH_REFRESH_POLICY allows to wait for refresh
+    """
+    @wraps(view_func)
+    def wrapped_view(*args, **kwargs):
+        from .utils import get_refresh_param
+        with transaction.atomic():
+            response = view_func(*args, **kwargs)
+            get_pending_buffer(transaction.get_connection()).refresh = get_refresh_param(read_your_writes=True)
+        return response
+    return wrapped_view
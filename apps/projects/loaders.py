@@ -0,0 +1,48 @@
+from collections import defaultdict
+from .executor import get_request_executor
+from .facets import FacetValue
+from .models import Project
+
+RELATIONS = (('industries', '_industry_list'), ('technologies', '_technology_list'))
+
+
+def get_related_values(field_name: str, project_ids) -> dict[int, list[FacetValue]]:
+    """
+    Ids and titles of industries or technologies of given projects, grouped by project id.
+    Rows of the through table are fetched with one query for all projects
+    """
+    field = Project._meta.get_field(field_name)
+    related_name = field.m2m_reverse_field_name()
+    rows = field.remote_field.through.objects.filter(project_id__in=project_ids).order_by(
+        f'{related_name}_id').values_list('project_id', f'{related_name}_id', f'{related_name}__title')
+    values = defaultdict(list)
+    for project_id, obj_id, title in rows:
+        values[project_id].append(FacetValue(obj_id, title))
+    return values
+
+
+def submit_related_values(project_ids) -> list:
+    """Starts lookups of industries and technologies of projects, which do not depend on each other"""
+    executor = get_request_executor()
+    return [(attr, executor.submit(field_name, get_related_values, field_name, project_ids))
+            for field_name, attr in RELATIONS]
+
+
+def attach_related_values(projects, lookups: list):
+    for attr, lookup in lookups:
+        values = lookup.result()
+        for project in projects:
+            setattr(project, attr, values[project.id])
+    return projects
+
+
+def load_project_relations(projects):
+    """
+    Attaches industries and technologies to projects, which are rendered by `project.html`.
+    Rows of both through tables are fetched with one query per relation for all projects,
+    so the number of queries does not depend on the number of projects
+    """
+    project_ids = {project.id for project in projects}
+    if not project_ids:
+        return projects
+    return attach_related_values(projects, submit_related_values(project_ids))
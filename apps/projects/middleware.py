@@ -0,0 +1,30 @@
+import asyncio
+from .executor import RequestExecutor
+
+
+class ServerTimingMiddleware:
+    """Activates the executor of the request and reports durations of its steps in the `Server-Timing` header"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with RequestExecutor().activate() as executor:
+            response = self.get_response(request)
+        return self.add_server_timing(response, executor)
+
+    async def __acall__(self, request):
+        with RequestExecutor().activate() as executor:
+            response = await self.get_response(request)
+        return self.add_server_timing(response, executor)
+
+    def add_server_timing(self, response, executor: RequestExecutor):
+        if executor.timings:
+            response['Server-Timing'] = executor.get_server_timing()
+        return response
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.8 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0012_rename_opening_counter_setsharedlink_link_open_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexOutboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_id', models.BigIntegerField(db_index=True, verbose_name='Project ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date created')),
+            ],
+            options={
+                'verbose_name_plural': 'Index Outbox Entries',
+            },
+        ),
+    ]
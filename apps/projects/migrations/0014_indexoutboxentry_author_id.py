@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0013_indexoutboxentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexoutboxentry',
+            name='author_id',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Author ID'),
+        ),
+    ]
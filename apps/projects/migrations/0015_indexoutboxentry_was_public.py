@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0014_indexoutboxentry_author_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexoutboxentry',
+            name='was_public',
+            field=models.BooleanField(default=False, verbose_name='Project was public before the change'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.8 on 2026-10-18 05:09
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0015_indexoutboxentry_was_public'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='project',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('title', 'description', config='simple'), name='project_search_vector_idx'),
+        ),
+        # `icontains` lookups compare UPPER(title), Django 3.2 indexes can not combine an expression with an opclass
+        migrations.RunSQL(
+            'CREATE INDEX project_title_trgm_idx ON projects_project USING gin (UPPER(title::text) gin_trgm_ops)',
+            reverse_sql='DROP INDEX project_title_trgm_idx',
+        ),
+    ]
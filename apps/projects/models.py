@@ -1,11 +1,41 @@
-import json
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 from apps.accounts.models import User
 
 
-class Industry(models.Model):
+# version of the document structure, documents of older versions are not used to render projects
+DOCUMENT_VERSION = 2
+
+
+# text searched by the PostgreSQL search backend, has a GIN index with the same expression.
+# Case insensitive matches of the title use the trigram index of UPPER(title) created by migration 0016
+PROJECT_SEARCH_VECTOR = SearchVector('title', 'description', config='simple')
+
+
+def get_facet_key(obj) -> str:
+    """Facet aggregations return id and title of industry or technology in one `id|title` key"""
+    return f'{obj.id}|{obj.title}'
+
+
+class LoadedTitleMixin:
+    """Keeps the title loaded from the database, documents of projects contain it and are updated on renames"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_title = instance.__dict__.get('title')
+        return instance
+
+    @property
+    def title_changed(self) -> bool:
+        # instances which were not loaded or were loaded without the title may have been renamed
+        return getattr(self, '_loaded_title', None) is None or self._loaded_title != self.title
+
+
+class Industry(LoadedTitleMixin, models.Model):
     title = models.CharField(_('Title'), max_length=150)
 
     def __str__(self):
@@ -15,7 +45,7 @@ class Industry(models.Model):
         verbose_name_plural = 'Industries'
 
 
-class Technology(models.Model):
+class Technology(LoadedTitleMixin, models.Model):
     title = models.CharField(_('Title'), max_length=80)
 
     def __str__(self):
@@ -38,38 +68,64 @@ class Project(models.Model):
     is_private = models.BooleanField(_('Project is private'), default=True)
     is_original = models.BooleanField(_('Project is original'), default=True)
 
-    def get_elasticsearch_document(self):
-        doc = {
-            'title': self.title,
-            'description': self.description,
-            'author': self.author.id,
-            'project_id': self.id,
-            'is_private': self.is_private,
-            'industries': list(self.industries.values_list("id", flat=True)),
-            'technologies': list(self.technologies.values_list("id", flat=True)),
-        }
-        return json.dumps(doc)
-
-    def save(self, *args, **kwargs):
-        refresh_index = kwargs.pop('refresh_index', True)
-        # Control admin import csv. Do not create elastic documents if
-        # transaction will rollback (first dry_run import to preview changes)
-        dry_index_update = kwargs.pop('dry_index_update', False)
-
-        self._refresh_index = refresh_index
-        self._dry_index_update = dry_index_update  # to control signal m2m_changed
-
-        super().save(*args, **kwargs)
-
-        if not dry_index_update:
-            from .utils import update_elastic_document
-            update_elastic_document(self, refresh_index=refresh_index)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # visibility of the project before changes, to know if a change affects public projects
+        instance._loaded_is_private = instance.__dict__.get('is_private', True)
+        return instance
+
+    @property
+    def was_public(self) -> bool:
+        return not getattr(self, '_loaded_is_private', True)
+
+    # industries and technologies attached by `load_project_relations`
+    _industry_list = None
+    _technology_list = None
+
+    @property
+    def industry_list(self):
+        return self.industries.all() if self._industry_list is None else self._industry_list
+
+    @property
+    def technology_list(self):
+        return self.technologies.all() if self._technology_list is None else self._technology_list
+
+    def get_elasticsearch_source(self):
+        """Returns document as a dict. Uses prefetched industries and technologies if there are any"""
+        from .documents import SOURCE_FIELDS, build_source
+        values = {field: getattr(self, field) for field in SOURCE_FIELDS}
+        return build_source(values, list(self.industries.all()), list(self.technologies.all()))
+
+    def get_elasticsearch_document(self) -> bytes:
+        from .documents import dump_source
+        return dump_source(self.get_elasticsearch_source()).encode('utf-8')
 
     def __str__(self):
         return f"{self.title}"
 
     class Meta:
         verbose_name_plural = 'Projects'
+        indexes = [
+            GinIndex(PROJECT_SEARCH_VECTOR, name='project_search_vector_idx'),
+        ]
+
+
+class IndexOutboxEntry(models.Model):
+    """
+    Project which document must be updated in the search index. Entries are added in the same transaction
+    as changes of the project and removed once the document is updated
+    """
+    project_id = models.BigIntegerField(_('Project ID'), db_index=True)
+    author_id = models.BigIntegerField(_('Author ID'), null=True, blank=True)
+    was_public = models.BooleanField(_('Project was public before the change'), default=False)
+    created_at = models.DateTimeField(_('Date created'), auto_now_add=True)
+
+    def __str__(self):
+        return f'Project #{self.project_id}'
+
+    class Meta:
+        verbose_name_plural = 'Index Outbox Entries'
 
 
 class CSVFile(models.Model):
@@ -0,0 +1,36 @@
+"""
+Cursor pagination of the projects search.
+
+Deep pages are requested with `search_after` instead of `from`, so their cost does not grow with the page number
+and is not limited by `max_result_window`. The cursor is the sort values of the last hit of the previous page,
+signed so it stays opaque to users
+"""
+from typing import Optional
+from django.core import signing
+
+CURSOR_SALT = 'apps.projects.cursor'
+
+
+def encode_cursor(sort_values: list) -> str:
+    return signing.dumps(sort_values, salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor: str) -> Optional[list]:
+    """Returns sort values of the cursor or None if the cursor is malformed or tampered with"""
+    try:
+        sort_values = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    return sort_values if isinstance(sort_values, list) else None
+
+
+def get_page_hits(result: dict, page_size: int) -> tuple[list, Optional[str]]:
+    """
+    Splits hits of the search, which requested one hit more than the page size, into hits of the page
+    and the cursor of the next page, which is None if the page is the last one
+    """
+    hits = result['hits']['hits']
+    if len(hits) <= page_size:
+        return hits, None
+    hits = hits[:page_size]
+    return hits, encode_cursor(hits[-1]['sort'])
@@ -0,0 +1,19 @@
+"""
+Search of projects. The backend is chosen by PROJECTS_SEARCH_BACKEND: ElasticSearch or PostgreSQL full-text search
+for deployments without a cluster
+"""
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .base import BaseSearchBackend, ProjectSearch, SearchResult
+
+__all__ = ['BaseSearchBackend', 'ProjectSearch', 'SearchResult', 'get_search_backend', 'load_search_backend']
+
+
+@lru_cache(maxsize=None)
+def load_search_backend(path: str) -> BaseSearchBackend:
+    return import_string(path)()
+
+
+def get_search_backend() -> BaseSearchBackend:
+    return load_search_backend(settings.PROJECTS_SEARCH_BACKEND)
@@ -0,0 +1,65 @@
+from collections import namedtuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# `projects` are objects `project.html` can render, `facets` are [value, doc_count] pairs by facet name
+SearchResult = namedtuple('SearchResult', ['total', 'projects', 'facets', 'next_cursor'])
+
+
+class ProjectSearch:
+    """
+    Parameters of the projects search, independent of the backend. Public projects are searched if `public`
+    is set, projects of the author otherwise. Pages after the first ones are requested by `search_after`,
+    the project id of the last project of the previous page
+    """
+
+    def __init__(self, public: bool = False, author_id: int = None, facets: list = (), search_text: str = None,
+                 page: int = 1, search_after: list = None, page_size: int = None, with_facets: bool = True):
+        self.public = public
+        self.author_id = author_id
+        self.facets = facets
+        self.search_text = search_text
+        self.page = page
+        self.search_after = search_after
+        self.page_size = page_size or settings.PAGE_SIZE
+        self.with_facets = with_facets
+
+    @property
+    def offset(self) -> int:
+        return (self.page - 1) * self.page_size
+
+
+class BaseSearchBackend:
+    """Interface of the projects search backends"""
+
+    def index_project(self, project):
+        """Updates document of the project"""
+        raise NotImplementedError
+
+    def index_projects(self, project_ids, refresh=False, versions=None):
+        """
+        Updates documents of the projects in bulk, documents of projects which do not exist anymore
+        or which are not original are deleted. `versions` by project id skip writes older than indexed ones
+        """
+        raise NotImplementedError
+
+    def delete_projects(self, project_ids):
+        raise NotImplementedError
+
+    def search(self, search: ProjectSearch) -> SearchResult:
+        raise NotImplementedError
+
+    def search_facets(self, search: ProjectSearch, names: list[str] = None) -> dict:
+        """Facets of the search with `names`, all of them by default, without its projects"""
+        raise NotImplementedError
+
+    def suggest(self, search: ProjectSearch) -> list[dict]:
+        """
+        Ids and titles of up to `page_size` projects which title has a word starting with `search_text`,
+        for the type-ahead of the search box. Facets and pages are not used
+        """
+        raise NotImplementedError
+
+    async def asearch(self, search: ProjectSearch) -> SearchResult:
+        """Search of the async views. Runs `search` in the thread of the database connection by default"""
+        return await sync_to_async(self.search)(search)
@@ -0,0 +1,129 @@
+from asgiref.sync import sync_to_async
+from elasticsearch.helpers import BulkIndexError
+from apps.projects import utils
+from apps.projects.executor import get_request_executor
+from apps.projects.facets import get_post_filter, get_facet_aggs, get_facet_counts
+from apps.projects.hits import HIT_SOURCE_FIELDS, get_projects_from_hits, is_stale
+from apps.projects.pagination import get_page_hits
+from .base import BaseSearchBackend, ProjectSearch, SearchResult
+
+
+class ElasticsearchBackend(BaseSearchBackend):
+    def index_project(self, project):
+        utils.update_elastic_document(project)
+
+    def index_projects(self, project_ids, refresh=False, versions=None):
+        utils.bulk_update_elastic_documents(project_ids, refresh=refresh, versions=versions)
+
+    def delete_projects(self, project_ids):
+        utils.ensure_index()
+        errors = utils.send_bulk_actions([
+            {'_op_type': 'delete', '_index': utils.WRITE_ALIAS, '_id': project_id} for project_id in project_ids
+        ])
+        if errors:
+            raise BulkIndexError(f'{len(errors)} document(s) failed to delete.', errors)
+
+    def get_scope_filter(self, search: ProjectSearch) -> dict:
+        if search.public:
+            return {"term": {"is_private": False}}
+        return {"terms": {"author": [search.author_id]}}
+
+    def get_search_text_query(self, search: ProjectSearch) -> dict:
+        return {
+            "bool": {
+                "should": [
+                    {"match_phrase_prefix": {"title": search.search_text}},
+                    {"match_phrase_prefix": {"description": search.search_text}}
+                ]
+            }
+        }
+
+    def get_query(self, search: ProjectSearch) -> dict:
+        """
+        ElasticSearch query of projects from the newest one. Requests one project more than the page size
+        to find out whether there is a next page
+        """
+        query = {
+            "size": search.page_size + 1,
+            "_source": HIT_SOURCE_FIELDS,
+            "sort": [
+                {"project_id": {"order": "desc"}}
+            ],
+            "query": {
+                "bool": {
+                    "must": [self.get_scope_filter(search)]
+                }
+            },
+            "post_filter": get_post_filter(search.facets),
+        }
+        if search.search_text:
+            query['query']['bool']['must'].append(self.get_search_text_query(search))
+        if search.with_facets:
+            query.update(aggs=get_facet_aggs(search.facets))
+        if search.search_after is not None:
+            query.update(search_after=search.search_after)
+        else:
+            query.update({"from": search.offset})
+        return query
+
+    def get_suggest_query(self, search: ProjectSearch) -> dict:
+        """Titles matching the search text by relevance. Prefixes of title terms are indexed, totals are not counted"""
+        return {
+            "size": search.page_size,
+            "_source": ["project_id", "title"],
+            "track_total_hits": False,
+            "query": {
+                "bool": {
+                    "filter": [self.get_scope_filter(search)],
+                    "must": [{"match_phrase_prefix": {"title": search.search_text}}],
+                }
+            },
+        }
+
+    def suggest(self, search: ProjectSearch) -> list[dict]:
+        result = get_request_executor().run('elasticsearch', utils.search_docs, self.get_suggest_query(search))
+        return [{'id': hit['_source']['project_id'], 'title': hit['_source']['title']}
+                for hit in result['hits']['hits']]
+
+    def get_facets_query(self, search: ProjectSearch, names: list[str] = None) -> dict:
+        """Aggregations of the facets without hits. Selections of facets are applied by filters of aggregations"""
+        query = {
+            "size": 0,
+            "track_total_hits": False,
+            "query": {
+                "bool": {
+                    "must": [self.get_scope_filter(search)]
+                }
+            },
+            "aggs": get_facet_aggs(search.facets, names),
+        }
+        if search.search_text:
+            query['query']['bool']['must'].append(self.get_search_text_query(search))
+        return query
+
+    def get_facets(self, search: ProjectSearch, result: dict, names: list[str] = None) -> dict:
+        if not search.with_facets:
+            return {}
+        return {facet.name: get_facet_counts(result['aggregations'], facet) for facet in search.facets
+                if names is None or facet.name in names}
+
+    def search_facets(self, search: ProjectSearch, names: list[str] = None) -> dict:
+        result = get_request_executor().run('elasticsearch', utils.search_docs, self.get_facets_query(search, names))
+        return self.get_facets(search, result, names)
+
+    def search(self, search: ProjectSearch) -> SearchResult:
+        result = get_request_executor().run('elasticsearch', utils.search_docs, self.get_query(search))
+        hits, next_cursor = get_page_hits(result, search.page_size)
+        return SearchResult(result['hits']['total']['value'], get_projects_from_hits(hits),
+                            self.get_facets(search, result), next_cursor)
+
+    async def asearch(self, search: ProjectSearch) -> SearchResult:
+        with get_request_executor().timed('elasticsearch'):
+            result = await utils.async_search_docs(self.get_query(search))
+        hits, next_cursor = get_page_hits(result, search.page_size)
+        if any(is_stale(hit['_source']) for hit in hits):
+            # projects with stale documents are loaded from the database
+            projects = await sync_to_async(get_projects_from_hits)(hits)
+        else:
+            projects = get_projects_from_hits(hits)
+        return SearchResult(result['hits']['total']['value'], projects, self.get_facets(search, result), next_cursor)
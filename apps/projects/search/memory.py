@@ -0,0 +1,758 @@
+"""
+In-process engine compatible with the part of the ElasticSearch client API this project uses, for tests
+and benchmarks without a cluster. It is selected by a `memory://` URL in ELASTICSEARCH_URLS. Indices live
+in the memory of one process, so they are not shared with other workers or with the Celery worker,
+see `apps.projects.client.create_client`.
+
+Each index keeps an inverted index per mapped field: term -> bitmap of documents, a Python int where bit N
+is set for the document with ordinal N. A written document keeps the ordinal of its previous version and
+ordinals of deleted documents are reused, so bitmaps do not grow with the number of writes.
+Queries and filters are AND/OR/NOT of bitmaps and terms aggregations count bits of the intersection
+of the term bitmap with the matching documents. Text fields are split into
+lowercase words, their word positions are kept to check phrases. Written documents are searchable right away,
+`refresh` does nothing
+"""
+import bisect
+import fnmatch
+import functools
+import heapq
+import itertools
+import json
+import re
+import threading
+import uuid
+from elasticsearch.exceptions import NotFoundError, RequestError
+from elasticsearch.serializer import JSONSerializer
+
+TEXT_TYPES = {'text'}
+TERM_TYPES = {'keyword', 'boolean', 'long', 'integer', 'short', 'byte'}
+SEARCH_BODY_FIELDS = (
+    'query', 'post_filter', 'aggs', 'aggregations', 'sort', '_source', 'search_after', 'seq_no_primary_term',
+)
+
+
+def popcount(bitmap: int) -> int:
+    return bin(bitmap).count('1')
+
+
+def iter_bits(bitmap: int):
+    """Yields ordinals of documents set in the bitmap in ascending order"""
+    # one pass over the binary representation, clearing bits one by one copies the whole int each time
+    return (ordinal for ordinal, bit in enumerate(reversed(bin(bitmap)[2:])) if bit == '1')
+
+
+def analyze(text) -> list[str]:
+    return re.findall(r'\w+', str(text).lower())
+
+
+def to_terms(value, field_type: str) -> list[str]:
+    """Terms of a keyword, boolean or numeric value the way they are compared and returned as bucket keys"""
+    values = value if isinstance(value, list) else [value]
+    terms = []
+    for item in values:
+        if item is None:
+            continue
+        if field_type == 'boolean':
+            terms.append('true' if item in (True, 'true') else 'false')
+        elif field_type == 'keyword':
+            terms.append(str(item))
+        else:
+            terms.append(str(int(item)))
+    return terms
+
+
+def index_not_found(index_name):
+    return NotFoundError(404, 'index_not_found_exception', {
+        'error': {'type': 'index_not_found_exception', 'reason': 'no such index', 'index': index_name},
+        'status': 404,
+    })
+
+
+def unsupported(what):
+    return RequestError(400, 'parsing_exception', {'error': {'type': 'parsing_exception', 'reason': what}})
+
+
+class MemoryIndex:
+    def __init__(self, name: str, mappings: dict = None, settings: dict = None):
+        self.name = name
+        self.mappings = {'properties': {}}
+        self.mappings['properties'].update((mappings or {}).get('properties', {}))
+        if '_meta' in (mappings or {}):
+            self.mappings['_meta'] = mappings['_meta']
+        self.settings = settings or {}
+        self.aliases = set()
+        self.ordinals = itertools.count()
+        # ordinals of deleted documents, the lowest one is reused first
+        self.free_ordinals = []
+        self.live = 0
+        # by document ordinal
+        self.sources = {}
+        self.doc_ids = {}
+        self.doc_terms = {}
+        self.doc_tokens = {}
+        # by document id
+        self.id_ordinals = {}
+        self.versions = {}
+        self.seq_nos = {}
+        # sequence numbers of writes, the primary term is always 1
+        self.seq_no_counter = itertools.count()
+        # field -> term -> bitmap
+        self.inverted = {}
+        self.sorted_terms = {}
+
+    def get_field_type(self, field):
+        field_mapping = self.mappings['properties'].get(field, {})
+        if field_mapping.get('enabled', True) is False:
+            return None
+        return field_mapping.get('type')
+
+    def add_term(self, field, term, ordinal):
+        postings = self.inverted.setdefault(field, {})
+        if term not in postings:
+            self.sorted_terms.pop(field, None)
+        postings[term] = postings.get(term, 0) | (1 << ordinal)
+
+    def put(self, doc_id: str, source: dict):
+        ordinal = self.id_ordinals.get(doc_id)
+        if ordinal is not None:
+            self.unset(ordinal)
+        elif self.free_ordinals:
+            ordinal = heapq.heappop(self.free_ordinals)
+        else:
+            ordinal = next(self.ordinals)
+        terms, tokens = [], {}
+        for field, value in source.items():
+            field_type = self.get_field_type(field)
+            if field_type in TEXT_TYPES:
+                tokens[field] = analyze(value) if value is not None else []
+                terms += [(field, token) for token in set(tokens[field])]
+            elif field_type in TERM_TYPES:
+                terms += [(field, term) for term in to_terms(value, field_type)]
+        for field, term in terms:
+            self.add_term(field, term, ordinal)
+        self.sources[ordinal] = source
+        self.doc_ids[ordinal] = doc_id
+        self.doc_terms[ordinal] = terms
+        self.doc_tokens[ordinal] = tokens
+        self.id_ordinals[doc_id] = ordinal
+        self.live |= 1 << ordinal
+
+    def unset(self, ordinal: int):
+        mask = ~(1 << ordinal)
+        for field, term in self.doc_terms.pop(ordinal):
+            self.inverted[field][term] &= mask
+        self.live &= mask
+        del self.sources[ordinal], self.doc_ids[ordinal], self.doc_tokens[ordinal]
+
+    def remove(self, doc_id: str) -> bool:
+        ordinal = self.id_ordinals.pop(doc_id, None)
+        if ordinal is None:
+            return False
+        self.unset(ordinal)
+        heapq.heappush(self.free_ordinals, ordinal)
+        return True
+
+    def reindex(self):
+        """Indexes stored documents again after the mapping has changed"""
+        documents = [(self.doc_ids[ordinal], self.sources[ordinal]) for ordinal in sorted(self.sources)]
+        self.live, self.ordinals, self.free_ordinals = 0, itertools.count(), []
+        self.sources, self.doc_ids, self.doc_terms, self.doc_tokens, self.id_ordinals = {}, {}, {}, {}, {}
+        self.inverted, self.sorted_terms = {}, {}
+        for doc_id, source in documents:
+            self.put(doc_id, source)
+
+    def get_term_bitmap(self, field, value) -> int:
+        field_type = self.get_field_type(field) or 'keyword'
+        postings = self.inverted.get(field, {})
+        bitmap = 0
+        for term in to_terms(value, 'keyword' if field_type in TEXT_TYPES else field_type):
+            bitmap |= postings.get(term, 0)
+        return bitmap
+
+    def get_prefix_bitmap(self, field, prefix) -> int:
+        if field not in self.sorted_terms:
+            self.sorted_terms[field] = sorted(self.inverted.get(field, {}))
+        terms = self.sorted_terms[field]
+        postings = self.inverted.get(field, {})
+        bitmap = 0
+        for term in terms[bisect.bisect_left(terms, prefix):]:
+            if not term.startswith(prefix):
+                break
+            bitmap |= postings[term]
+        return bitmap
+
+    def match_phrase_prefix(self, field, text) -> int:
+        words = analyze(text)
+        if not words:
+            return 0
+        postings = self.inverted.get(field, {})
+        candidates = self.get_prefix_bitmap(field, words[-1]) & self.live
+        for word in words[:-1]:
+            candidates &= postings.get(word, 0)
+        if len(words) == 1:
+            return candidates
+
+        matched = 0
+        for ordinal in iter_bits(candidates):
+            tokens = self.doc_tokens[ordinal].get(field, [])
+            for start in range(len(tokens) - len(words) + 1):
+                if tokens[start:start + len(words) - 1] == words[:-1] \
+                        and tokens[start + len(words) - 1].startswith(words[-1]):
+                    matched |= 1 << ordinal
+                    break
+        return matched
+
+    def evaluate(self, query: dict) -> int:
+        """Returns bitmap of live documents matching the query"""
+        if not query:
+            return self.live
+        (query_type, params), = query.items()
+        if query_type == 'match_all':
+            return self.live
+        if query_type == 'bool':
+            return self.evaluate_bool(params)
+        if query_type == 'term':
+            (field, value), = params.items()
+            value = value['value'] if isinstance(value, dict) else value
+            return self.get_term_bitmap(field, value) & self.live
+        if query_type == 'terms':
+            (field, values), = params.items()
+            return self.get_term_bitmap(field, list(values)) & self.live
+        if query_type == 'ids':
+            return self.get_ids_bitmap(params['values'])
+        if query_type == 'range':
+            (field, bounds), = params.items()
+            return self.get_range_bitmap(field, bounds) & self.live
+        if query_type == 'match_phrase_prefix':
+            (field, text), = params.items()
+            return self.match_phrase_prefix(field, text['query'] if isinstance(text, dict) else text)
+        raise unsupported(f'query [{query_type}] is not supported by the in-memory engine')
+
+    def evaluate_bool(self, params: dict) -> int:
+        def as_list(clauses):
+            return clauses if isinstance(clauses, list) else [clauses]
+
+        bitmap = self.live
+        for clause in as_list(params.get('must', [])) + as_list(params.get('filter', [])):
+            bitmap &= self.evaluate(clause)
+        should = as_list(params.get('should', []))
+        if should:
+            matches_any = 0
+            for clause in should:
+                matches_any |= self.evaluate(clause)
+            # without must and filter clauses at least one should clause has to match
+            if 'minimum_should_match' in params or not (params.get('must') or params.get('filter')):
+                bitmap &= matches_any
+        for clause in as_list(params.get('must_not', [])):
+            bitmap &= ~self.evaluate(clause)
+        return bitmap
+
+    def get_range_bitmap(self, field, bounds: dict) -> int:
+        """Documents with a value of the numeric field within `gt`, `gte`, `lt` and `lte` bounds"""
+        checks = {'gt': int.__gt__, 'gte': int.__ge__, 'lt': int.__lt__, 'lte': int.__le__}
+        bitmap = 0
+        for term, term_bitmap in self.inverted.get(field, {}).items():
+            if all(checks[name](int(term), int(bound)) for name, bound in bounds.items() if name in checks):
+                bitmap |= term_bitmap
+        return bitmap
+
+    def get_ids_bitmap(self, doc_ids) -> int:
+        bitmap = 0
+        for doc_id in doc_ids:
+            ordinal = self.id_ordinals.get(str(doc_id))
+            if ordinal is not None:
+                bitmap |= 1 << ordinal
+        return bitmap
+
+    def aggregate(self, aggs: dict, bitmap: int) -> dict:
+        results = {}
+        for name, spec in aggs.items():
+            sub_aggs = spec.get('aggs') or spec.get('aggregations') or {}
+            if 'terms' in spec:
+                results[name] = self.aggregate_terms(spec['terms'], sub_aggs, bitmap)
+                continue
+            if 'histogram' in spec:
+                results[name] = self.aggregate_histogram(spec['histogram'], sub_aggs, bitmap)
+                continue
+            if 'filter' in spec:
+                agg_bitmap = bitmap & self.evaluate(spec['filter'])
+            elif 'global' in spec:
+                agg_bitmap = self.live
+            else:
+                raise unsupported(f'aggregation [{name}] is not supported by the in-memory engine')
+            results[name] = {'doc_count': popcount(agg_bitmap), **self.aggregate(sub_aggs, agg_bitmap)}
+        return results
+
+    def aggregate_histogram(self, params: dict, sub_aggs: dict, bitmap: int) -> dict:
+        """Buckets of a numeric field by `interval`, only buckets with documents are returned"""
+        interval = int(params['interval'])
+        bucket_bitmaps = {}
+        for term, term_bitmap in self.inverted.get(params['field'], {}).items():
+            term_bitmap &= bitmap
+            if term_bitmap:
+                key = int(term) // interval * interval
+                bucket_bitmaps[key] = bucket_bitmaps.get(key, 0) | term_bitmap
+        min_doc_count = params.get('min_doc_count', 0)
+        return {'buckets': [
+            {'key': key, 'doc_count': popcount(bucket_bitmap), **self.aggregate(sub_aggs, bucket_bitmap)}
+            for key, bucket_bitmap in sorted(bucket_bitmaps.items()) if popcount(bucket_bitmap) >= min_doc_count
+        ]}
+
+    def aggregate_terms(self, params: dict, sub_aggs: dict, bitmap: int) -> dict:
+        field_type = self.get_field_type(params['field'])
+        include = params.get('include')
+        counts = []
+        for term, term_bitmap in self.inverted.get(params['field'], {}).items():
+            # `include` is a regular expression matching whole terms or a list of terms
+            if include is not None and not (
+                    term in include if isinstance(include, list) else re.fullmatch(include, term)):
+                continue
+            term_bitmap &= bitmap
+            if term_bitmap:
+                counts.append((term, term_bitmap))
+        counts.sort(key=lambda item: (-popcount(item[1]), item[0]))
+        size = params.get('size', 10)
+        buckets = []
+        for term, term_bitmap in counts[:size]:
+            key = term if field_type in ('keyword', 'boolean') else int(term)
+            bucket = {'key': key, 'doc_count': popcount(term_bitmap), **self.aggregate(sub_aggs, term_bitmap)}
+            if field_type == 'boolean':
+                bucket.update(key=int(term == 'true'), key_as_string=term)
+            buckets.append(bucket)
+        return {
+            'doc_count_error_upper_bound': 0,
+            'sum_other_doc_count': sum(popcount(term_bitmap) for _, term_bitmap in counts[size:]),
+            'buckets': buckets,
+        }
+
+
+def get_sort_fields(sort) -> list[tuple[str, bool]]:
+    """Returns (field, descending) pairs of the sort clause"""
+    fields = []
+    for item in sort if isinstance(sort, list) else [sort]:
+        if isinstance(item, str):
+            fields.append((item, False))
+            continue
+        (field, order), = item.items()
+        order = order.get('order', 'asc') if isinstance(order, dict) else order
+        fields.append((field, order == 'desc'))
+    return fields
+
+
+def filter_source(source: dict, source_filter):
+    if source_filter is None or source_filter is True:
+        return source
+    if isinstance(source_filter, (str, list)):
+        source_filter = {'includes': source_filter}
+    includes = source_filter.get('includes') or source_filter.get('include') or ['*']
+    excludes = source_filter.get('excludes') or source_filter.get('exclude') or []
+    includes = [includes] if isinstance(includes, str) else includes
+    excludes = [excludes] if isinstance(excludes, str) else excludes
+    return {
+        field: value for field, value in source.items()
+        if any(fnmatch.fnmatch(field, pattern) for pattern in includes)
+        and not any(fnmatch.fnmatch(field, pattern) for pattern in excludes)
+    }
+
+
+def merge_aggregations(results: list[dict]) -> dict:
+    """Adds up aggregations computed on each of several indices"""
+    merged = {}
+    for result in results:
+        for name, agg in result.items():
+            if name not in merged:
+                merged[name] = json.loads(json.dumps(agg))
+                continue
+            target = merged[name]
+            if 'buckets' in agg:
+                buckets = {bucket['key']: bucket for bucket in target['buckets']}
+                for bucket in agg['buckets']:
+                    if bucket['key'] in buckets:
+                        buckets[bucket['key']]['doc_count'] += bucket['doc_count']
+                    else:
+                        target['buckets'].append(bucket)
+                target['buckets'].sort(key=lambda bucket: (-bucket['doc_count'], bucket['key']))
+            else:
+                sub_results = merge_aggregations([
+                    {key: value for key, value in target.items() if isinstance(value, dict)},
+                    {key: value for key, value in agg.items() if isinstance(value, dict)},
+                ])
+                target.update(sub_results, doc_count=target['doc_count'] + agg['doc_count'])
+    return merged
+
+
+@functools.total_ordering
+class Descending:
+    """Sort key of a value in descending order"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value is not None and self.value is not None and other.value < self.value
+
+
+class MemoryTransport:
+    serializer = JSONSerializer()
+
+
+class MemoryIndicesClient:
+    def __init__(self, client: 'MemoryElasticsearch'):
+        self.client = client
+
+    def create(self, index, body=None, **kwargs):
+        with self.client.lock:
+            if index in self.client.indices_by_name:
+                raise RequestError(400, 'resource_already_exists_exception', {
+                    'error': {'type': 'resource_already_exists_exception', 'index': index}})
+            body = body or {}
+            new_index = MemoryIndex(index, body.get('mappings'), body.get('settings'))
+            self.client.indices_by_name[index] = new_index
+            for alias in body.get('aliases', {}):
+                new_index.aliases.add(alias)
+        return {'acknowledged': True, 'shards_acknowledged': True, 'index': index}
+
+    def delete(self, index, ignore=None, **kwargs):
+        with self.client.lock:
+            for index_name in self.client.resolve(index, ignore_missing=ignore and 404 in ignore):
+                del self.client.indices_by_name[index_name]
+        return {'acknowledged': True}
+
+    def exists(self, index, **kwargs) -> bool:
+        return bool(self.client.resolve(index, ignore_missing=True))
+
+    def exists_alias(self, name, index=None, **kwargs) -> bool:
+        return any(name in memory_index.aliases for memory_index in self.client.indices_by_name.values())
+
+    def get_alias(self, name=None, index=None, **kwargs) -> dict:
+        result = {
+            index_name: {'aliases': {alias: {} for alias in memory_index.aliases if name in (None, alias)}}
+            for index_name, memory_index in self.client.indices_by_name.items()
+        }
+        result = {index_name: item for index_name, item in result.items() if item['aliases'] or name is None}
+        if name is not None and not result:
+            raise NotFoundError(404, f'alias [{name}] missing', {'error': f'alias [{name}] missing', 'status': 404})
+        return result
+
+    def get(self, index, **kwargs) -> dict:
+        return {
+            index_name: {
+                'aliases': {alias: {} for alias in self.client.indices_by_name[index_name].aliases},
+                'mappings': self.client.indices_by_name[index_name].mappings,
+                'settings': self.client.indices_by_name[index_name].settings,
+            }
+            for index_name in self.client.resolve(index)
+        }
+
+    def update_aliases(self, body, **kwargs):
+        with self.client.lock:
+            # all actions are validated before any is applied, so the update is atomic
+            actions = []
+            for action in body['actions']:
+                (action_type, params), = action.items()
+                index_names = self.client.resolve(params.get('index') or params.get('indices'))
+                actions.append((action_type, index_names, params.get('alias')))
+            for action_type, index_names, alias in actions:
+                for index_name in index_names:
+                    aliases = self.client.indices_by_name[index_name].aliases
+                    if action_type == 'add':
+                        aliases.add(alias)
+                    elif action_type == 'remove':
+                        aliases.discard(alias)
+                    elif action_type == 'remove_index':
+                        del self.client.indices_by_name[index_name]
+        return {'acknowledged': True}
+
+    def refresh(self, index=None, **kwargs):
+        self.client.resolve(index or '*', ignore_missing=kwargs.get('ignore_unavailable'))
+        return {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+    def get_mapping(self, index, **kwargs) -> dict:
+        return {name: {'mappings': self.client.indices_by_name[name].mappings} for name in self.client.resolve(index)}
+
+    def put_mapping(self, body, index, **kwargs):
+        with self.client.lock:
+            for index_name in self.client.resolve(index):
+                memory_index = self.client.indices_by_name[index_name]
+                if '_meta' in body:
+                    memory_index.mappings['_meta'] = body['_meta']
+                if body.get('properties'):
+                    memory_index.mappings['properties'].update(body['properties'])
+                    memory_index.reindex()
+        return {'acknowledged': True}
+
+    def get_settings(self, index, **kwargs) -> dict:
+        return {name: {'settings': self.client.indices_by_name[name].settings} for name in self.client.resolve(index)}
+
+    def put_settings(self, body, index, **kwargs):
+        with self.client.lock:
+            for index_name in self.client.resolve(index):
+                for key, value in body.get('index', body).items():
+                    self.client.indices_by_name[index_name].settings.setdefault('index', {})[key] = value
+        return {'acknowledged': True}
+
+
+class MemoryElasticsearch:
+    """Client of the in-memory engine with the same methods and responses as `Elasticsearch`"""
+
+    def __init__(self):
+        self.indices_by_name = {}
+        self.scrolls = {}
+        # bulk requests are sent from several threads by `parallel_bulk`
+        self.lock = threading.RLock()
+        self.indices = MemoryIndicesClient(self)
+        self.transport = MemoryTransport()
+
+    def resolve(self, target, ignore_missing=False) -> list[str]:
+        """Names of indices of comma separated index names, aliases and wildcard patterns"""
+        names = []
+        for part in target.split(',') if isinstance(target, str) else target:
+            if '*' in part:
+                names += [name for name in self.indices_by_name if fnmatch.fnmatch(name, part)]
+            elif part in self.indices_by_name:
+                names.append(part)
+            else:
+                aliased = [name for name, memory_index in self.indices_by_name.items() if part in memory_index.aliases]
+                if not aliased and not ignore_missing:
+                    raise index_not_found(part)
+                names += aliased
+        return list(dict.fromkeys(names))
+
+    def get_write_index(self, target: str, require_alias=False) -> MemoryIndex:
+        if target in self.indices_by_name and not require_alias:
+            return self.indices_by_name[target]
+        names = [name for name, memory_index in self.indices_by_name.items() if target in memory_index.aliases]
+        if len(names) == 1:
+            return self.indices_by_name[names[0]]
+        if names or require_alias:
+            raise index_not_found(target)
+        # like automatic index creation of ElasticSearch, without the dynamic mapping
+        self.indices_by_name[target] = MemoryIndex(target)
+        return self.indices_by_name[target]
+
+    def write(self, op_type, index, doc_id, source=None, version=None, version_type=None,
+              require_alias=False, if_seq_no=None, if_primary_term=None) -> dict:
+        """
+        Applies one write and returns its result in the format of items of the bulk response.
+        The source of `update` is the partial document of the update action
+        """
+        try:
+            memory_index = self.get_write_index(index, require_alias=require_alias)
+        except NotFoundError as error:
+            return {'_index': index, '_id': doc_id, 'status': 404, 'error': error.info['error']}
+        result = {'_index': memory_index.name, '_id': doc_id, '_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+        current_ordinal = memory_index.id_ordinals.get(doc_id)
+        if if_seq_no is not None and (memory_index.seq_nos.get(doc_id) != if_seq_no or if_primary_term != 1):
+            return {**result, 'status': 409, 'error': {
+                'type': 'version_conflict_engine_exception',
+                'reason': f'[{doc_id}]: version conflict, required seqNo [{if_seq_no}], '
+                          f'current document has seqNo [{memory_index.seq_nos.get(doc_id)}]',
+            }}
+        if op_type == 'update':
+            if current_ordinal is None:
+                return {**result, 'status': 404, 'error': {
+                    'type': 'document_missing_exception', 'reason': f'[_doc][{doc_id}]: document missing',
+                }}
+            source = {**memory_index.sources[current_ordinal], **source['doc']}
+        if version is not None and version_type in ('external', 'external_gte'):
+            current = memory_index.versions.get(doc_id)
+            if current is not None and (current > version or (current == version and version_type == 'external')):
+                return {**result, 'status': 409, 'error': {
+                    'type': 'version_conflict_engine_exception',
+                    'reason': f'[{doc_id}]: version conflict, current version [{current}] is higher or equal '
+                              f'to the one provided [{version}]',
+                }}
+            memory_index.versions[doc_id] = version
+        else:
+            memory_index.versions[doc_id] = memory_index.versions.get(doc_id, 0) + 1
+        if op_type == 'create' and current_ordinal is not None:
+            return {**result, 'status': 409, 'error': {'type': 'version_conflict_engine_exception'}}
+        memory_index.seq_nos[doc_id] = next(memory_index.seq_no_counter)
+        result.update(_version=memory_index.versions[doc_id], _seq_no=memory_index.seq_nos[doc_id], _primary_term=1)
+        if op_type == 'delete':
+            found = memory_index.remove(doc_id)
+            return {**result, 'result': 'deleted' if found else 'not_found', 'status': 200 if found else 404}
+        memory_index.put(doc_id, source)
+        created = current_ordinal is None
+        return {**result, 'result': 'created' if created else 'updated', 'status': 201 if created else 200}
+
+    def index(self, index, body=None, document=None, id=None, require_alias=False, version=None,
+              version_type=None, **kwargs) -> dict:
+        source = document if document is not None else body
+        source = json.loads(source) if isinstance(source, (str, bytes)) else source
+        with self.lock:
+            result = self.write('index', index, str(id or uuid.uuid4().hex), source, version=version,
+                                version_type=version_type, require_alias=require_alias)
+        if result['status'] == 404:
+            raise index_not_found(index)
+        return result
+
+    def delete(self, index, id, ignore=None, **kwargs) -> dict:
+        with self.lock:
+            result = self.write('delete', index, str(id), version=kwargs.get('version'),
+                                version_type=kwargs.get('version_type'))
+        if result['status'] == 404 and not (ignore and 404 in ignore):
+            raise NotFoundError(404, result.get('result', 'not_found'), result)
+        return result
+
+    def get(self, index, id, **kwargs) -> dict:
+        for index_name in self.resolve(index):
+            memory_index = self.indices_by_name[index_name]
+            ordinal = memory_index.id_ordinals.get(str(id))
+            if ordinal is not None:
+                return {'_index': index_name, '_id': str(id), 'found': True,
+                        '_version': memory_index.versions.get(str(id)), '_seq_no': memory_index.seq_nos[str(id)],
+                        '_primary_term': 1, '_source': memory_index.sources[ordinal]}
+        raise NotFoundError(404, 'not_found', {'_index': index, '_id': str(id), 'found': False})
+
+    def bulk(self, body, index=None, require_alias=False, **kwargs) -> dict:
+        if isinstance(body, bytes):
+            body = body.decode()
+        lines = body.splitlines() if isinstance(body, str) else list(body)
+        lines = [json.loads(line) if isinstance(line, (str, bytes)) else line for line in lines if line]
+        items = []
+        with self.lock:
+            position = 0
+            while position < len(lines):
+                (op_type, meta), = lines[position].items()
+                position += 1
+                source = None
+                if op_type != 'delete':
+                    source = lines[position]
+                    position += 1
+                    if op_type == 'update' and 'doc' not in source:
+                        raise unsupported('only updates with a partial `doc` are supported by the in-memory engine')
+                item = self.write(
+                    op_type, meta.get('_index', index), str(meta['_id']), source,
+                    version=meta.get('version', meta.get('_version')),
+                    version_type=meta.get('version_type', meta.get('_version_type')),
+                    require_alias=meta.get('require_alias', require_alias),
+                    if_seq_no=meta.get('if_seq_no'), if_primary_term=meta.get('if_primary_term'),
+                )
+                items.append({op_type: item})
+        return {'took': 0, 'errors': any('error' in item[op] for item in items for op in item), 'items': items}
+
+    def search(self, index=None, body=None, scroll=None, size=None, from_=None, **kwargs) -> dict:
+        body = dict(body or {})
+        # helpers such as `scan` pass fields of the body as keyword arguments
+        body.update({field: kwargs.pop(field) for field in SEARCH_BODY_FIELDS if field in kwargs})
+        if size is not None:
+            body['size'] = size
+        if from_ is not None:
+            body['from'] = from_
+        with self.lock:
+            index_names = self.resolve(index or '*', ignore_missing=bool(kwargs.get('ignore_unavailable')))
+            hits, totals, aggregations = [], 0, []
+            # only hits up to the end of the page are sorted and returned, unless all of them are scrolled
+            limit = None if scroll else body.get('from', 0) + body.get('size', 10)
+            for index_name in index_names:
+                index_hits, total, index_aggregations = self.search_index(
+                    self.indices_by_name[index_name], body, limit)
+                hits += index_hits
+                totals += total
+                aggregations.append(index_aggregations)
+
+        sort_fields = get_sort_fields(body['sort']) if body.get('sort') else []
+        if len(index_names) > 1 and sort_fields:
+            hits.sort(key=lambda hit: self.get_hit_sort_key(hit['sort'], sort_fields))
+        start = 0 if body.get('search_after') else body.get('from', 0)
+        page_size = body.get('size', 10)
+        response = {
+            'took': 0,
+            'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0},
+            'hits': {'total': {'value': totals, 'relation': 'eq'}, 'max_score': None,
+                     'hits': hits[start:start + page_size]},
+        }
+        if body.get('aggs') or body.get('aggregations'):
+            response['aggregations'] = merge_aggregations(aggregations)
+        if scroll:
+            scroll_id = uuid.uuid4().hex
+            self.scrolls[scroll_id] = (hits[start + page_size:], page_size)
+            response['_scroll_id'] = scroll_id
+        return response
+
+    @staticmethod
+    def get_hit_sort_key(values, sort_fields):
+        """Key sorting hits in ascending order, documents without the field go last"""
+        return tuple(
+            (value is None, Descending(value) if descending else value)
+            for value, (_, descending) in zip(values, sort_fields)
+        )
+
+    def search_index(self, memory_index: MemoryIndex, body: dict, limit: int = None):
+        """Returns the first `limit` matching hits of the index in sort order, number of all of them and aggregations"""
+        bitmap = memory_index.evaluate(body.get('query'))
+        aggregations = memory_index.aggregate(body.get('aggs') or body.get('aggregations') or {}, bitmap)
+        if body.get('post_filter'):
+            bitmap &= memory_index.evaluate(body['post_filter'])
+        total = popcount(bitmap)
+
+        sort_fields = get_sort_fields(body['sort']) if body.get('sort') else []
+        hits = []
+        for ordinal in iter_bits(bitmap):
+            source = memory_index.sources[ordinal]
+            values = [ordinal if field == '_doc' else source.get(field) for field, _ in sort_fields]
+            hits.append((values, ordinal))
+        if body.get('search_after'):
+            after = self.get_hit_sort_key(body['search_after'], sort_fields)
+            hits = [hit for hit in hits if self.get_hit_sort_key(hit[0], sort_fields) > after]
+        if sort_fields and limit is not None:
+            hits = heapq.nsmallest(limit, hits, key=lambda hit: self.get_hit_sort_key(hit[0], sort_fields))
+        elif sort_fields:
+            hits.sort(key=lambda hit: self.get_hit_sort_key(hit[0], sort_fields))
+        elif limit is not None:
+            hits = hits[:limit]
+
+        source_filter = body.get('_source')
+        result = []
+        for values, ordinal in hits:
+            hit = {'_index': memory_index.name, '_type': '_doc', '_id': memory_index.doc_ids[ordinal],
+                   '_score': None if sort_fields else 1.0}
+            if body.get('seq_no_primary_term'):
+                doc_id = memory_index.doc_ids[ordinal]
+                hit.update(_seq_no=memory_index.seq_nos[doc_id], _primary_term=1)
+            if source_filter is not False:
+                hit['_source'] = filter_source(memory_index.sources[ordinal], source_filter)
+            if sort_fields:
+                hit['sort'] = values
+            result.append(hit)
+        return result, total, aggregations
+
+    def count(self, index=None, body=None, **kwargs) -> dict:
+        query = (body or {}).get('query', kwargs.get('query'))
+        with self.lock:
+            count = sum(popcount(self.indices_by_name[index_name].evaluate(query))
+                        for index_name in self.resolve(index or '*'))
+        return {'count': count, '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0}}
+
+    def scroll(self, scroll_id=None, body=None, **kwargs) -> dict:
+        scroll_id = scroll_id or body['scroll_id']
+        hits, page_size = self.scrolls.get(scroll_id, ([], 0))
+        self.scrolls[scroll_id] = (hits[page_size:], page_size)
+        return {'_scroll_id': scroll_id, '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0},
+                'hits': {'hits': hits[:page_size]}}
+
+    def clear_scroll(self, scroll_id=None, body=None, **kwargs) -> dict:
+        self.scrolls.pop(scroll_id or (body or {}).get('scroll_id'), None)
+        return {'succeeded': True}
+
+    def ping(self, **kwargs) -> bool:
+        return True
+
+
+class AsyncMemoryElasticsearch:
+    """Searches of the in-process engine for the async views, which run in the event loop without waiting for I/O"""
+
+    def __init__(self, engine: MemoryElasticsearch):
+        self.engine = engine
+
+    async def search(self, **kwargs) -> dict:
+        return self.engine.search(**kwargs)
+
+    async def close(self):
+        pass
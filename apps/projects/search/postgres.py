@@ -0,0 +1,127 @@
+"""
+Search of projects with PostgreSQL full-text search, for deployments without an ElasticSearch cluster.
+The database is the index, so indexing methods do nothing. Text is matched by the GIN index
+of PROJECT_SEARCH_VECTOR and by the trigram index of the title
+"""
+import re
+from django.contrib.postgres.search import SearchQuery
+from django.db.models import Count, Q
+from apps.projects.executor import get_request_executor
+from apps.projects.facets import FACET_SIZE, FacetValue, Facet, merge_facet_counts
+from apps.projects.loaders import load_project_relations
+from apps.projects.models import Project, PROJECT_SEARCH_VECTOR
+from apps.projects.pagination import encode_cursor
+from apps.projects.utils import get_indexable_projects
+from .base import BaseSearchBackend, ProjectSearch, SearchResult
+
+LISTING_FIELDS = ('id', 'title', 'description', 'author', 'is_private', 'is_original', 'url', 'url_is_active')
+
+
+def get_text_filter(search_text: str) -> Q:
+    """
+    Matches words of the text as a phrase with a prefix of the last word, like `match_phrase_prefix`,
+    or a part of the title
+    """
+    words = re.findall(r'\w+', search_text.lower())
+    if not words:
+        return Q()
+    phrase_prefix = SearchQuery(' <-> '.join(words) + ':*', search_type='raw', config='simple')
+    return Q(search_vector=phrase_prefix) | Q(title__icontains=search_text.strip())
+
+
+def filter_by_facets(projects, facets: list[Facet]):
+    for facet in facets:
+        if facet.selected_ids:
+            field = Project._meta.get_field(facet.field)
+            through = field.remote_field.through.objects.filter(**{
+                f'{field.m2m_reverse_field_name()}_id__in': facet.selected_ids,
+            })
+            projects = projects.filter(id__in=through.values('project_id'))
+    return projects
+
+
+def get_facet_value_counts(facet: Facet, projects, size=FACET_SIZE, value_ids=None) -> dict[FacetValue, int]:
+    """
+    Numbers of projects by facet value with one grouped query over the through table,
+    of the top `size` values or of values with `value_ids`
+    """
+    field = Project._meta.get_field(facet.field)
+    related_name = field.m2m_reverse_field_name()
+    rows = field.remote_field.through.objects.filter(project_id__in=projects.values('id'))
+    if value_ids is not None:
+        rows = rows.filter(**{f'{related_name}_id__in': value_ids})
+    rows = rows.values_list(f'{related_name}_id', f'{related_name}__title').annotate(count=Count('id')).order_by(
+        '-count', f'{related_name}_id')[:size]
+    return {FacetValue(obj_id, title): count for obj_id, title, count in rows}
+
+
+class PostgresBackend(BaseSearchBackend):
+    def index_project(self, project):
+        pass
+
+    def index_projects(self, project_ids, refresh=False, versions=None):
+        pass
+
+    def delete_projects(self, project_ids):
+        pass
+
+    def get_queryset(self, search: ProjectSearch):
+        """Projects matching the search before facet selections are applied"""
+        projects = get_indexable_projects()
+        if search.public:
+            projects = projects.filter(is_private=False)
+        else:
+            projects = projects.filter(author_id=search.author_id)
+        if search.search_text:
+            projects = projects.annotate(search_vector=PROJECT_SEARCH_VECTOR).filter(
+                get_text_filter(search.search_text))
+        return projects
+
+    def get_facet(self, search: ProjectSearch, projects, facet: Facet) -> list:
+        others = filter_by_facets(projects, [other for other in search.facets if other is not facet])
+        counts = get_facet_value_counts(facet, others, facet.fetch_size)
+        in_result = {}
+        if facet.selected_ids:
+            counts.update(get_facet_value_counts(facet, others, value_ids=facet.selected_ids))
+            in_result = get_facet_value_counts(facet, filter_by_facets(projects, search.facets))
+        return merge_facet_counts(facet, counts, in_result)
+
+    def submit_facets(self, search: ProjectSearch, projects, names: list[str] = None) -> dict:
+        executor = get_request_executor()
+        return {facet.name: executor.submit(f'facet-{facet.name}', self.get_facet, search, projects, facet)
+                for facet in search.facets if names is None or facet.name in names}
+
+    def search_facets(self, search: ProjectSearch, names: list[str] = None) -> dict:
+        lookups = self.submit_facets(search, self.get_queryset(search), names)
+        return {name: lookup.result() for name, lookup in lookups.items()}
+
+    def suggest(self, search: ProjectSearch) -> list[dict]:
+        """Titles starting with the text or with a word starting with it, matched by the trigram index"""
+        text = search.search_text.strip()
+        projects = self.get_queryset(ProjectSearch(public=search.public, author_id=search.author_id)).filter(
+            Q(title__istartswith=text) | Q(title__icontains=f' {text}'))
+        return [{'id': project_id, 'title': title}
+                for project_id, title in projects.order_by('-id').values_list('id', 'title')[:search.page_size]]
+
+    def get_page(self, search: ProjectSearch, result) -> list:
+        result = result.only(*LISTING_FIELDS).order_by('-id')
+        # one project more than the page size tells whether there is a next page
+        if search.search_after is not None:
+            return list(result.filter(id__lt=search.search_after[0])[:search.page_size + 1])
+        return list(result[search.offset:search.offset + search.page_size + 1])
+
+    def search(self, search: ProjectSearch) -> SearchResult:
+        """The total, the page and counts of each facet do not depend on each other and are queried at once"""
+        executor = get_request_executor()
+        projects = self.get_queryset(search)
+        result = filter_by_facets(projects, search.facets)
+        total = executor.submit('count', result.count)
+        facets = self.submit_facets(search, projects) if search.with_facets else {}
+        page = executor.run('page', self.get_page, search, result)
+        next_cursor = None
+        if len(page) > search.page_size:
+            page = page[:search.page_size]
+            next_cursor = encode_cursor([page[-1].id])
+        load_project_relations(page)
+        facets = {name: lookup.result() for name, lookup in facets.items()}
+        return SearchResult(total.result(), page, facets, next_cursor)
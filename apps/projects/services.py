@@ -1,10 +1,10 @@
 import random
 
+from django.db import transaction
 from faker import Faker
 from .models import Industry, Technology, Project
 from apps.accounts.models import User
 from .demo_data import random_industries, random_technologies
-from .utils import refresh_elastic_index
 
 
 fake = Faker()
@@ -38,6 +38,7 @@ def get_or_create_technologies(technology_names: list[str] = random_technologies
     return technologies
 
 
+@transaction.atomic
 def generate_fake_projects(projects_number: int = 10):
     # generate random industries and technologies if not exist
     industries = get_or_create_industries()
@@ -57,9 +58,8 @@ def generate_fake_projects(projects_number: int = 10):
                 url=generate_fake_field('url'),
                 url_is_active=random.choice([True, False])
             )
-            proj.save(refresh_index=False)
+            proj.save()
         projects.append(proj)
-    refresh_elastic_index()
 
     for project in projects:
         for i in range(random.randint(1, 10)):
@@ -1,21 +1,58 @@
-from django.db.models.signals import post_delete, pre_delete, m2m_changed
-from .models import Project, CSVFile, Set
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from .models import Project, Industry, Technology, CSVFile, Set
+from .indexing import index_on_commit, mark_updated, touch_projects
 from django.dispatch import receiver
 
 
+@receiver(post_save, sender=Project)
+def save_document(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'updated_at' in update_fields:
+        mark_updated([instance.pk])
+    index_on_commit([instance.pk], author_id=instance.author_id, was_public=instance.was_public)
+    instance._loaded_is_private = instance.is_private
+
+
 @receiver(post_delete, sender=Project)
 def delete_document(sender, instance, **kwargs):
-    from .utils import delete_elastic_document
-    delete_elastic_document(instance)
+    index_on_commit([instance.pk], author_id=instance.author_id, was_public=not instance.is_private)
 
 
 @receiver(m2m_changed, sender=Project.industries.through)
 @receiver(m2m_changed, sender=Project.technologies.through)
-def update_document(sender, instance, action, **kwargs):
-    if action == 'post_add':
-        refresh_index = getattr(instance, '_refresh_index', True)
-        dry_index_update = getattr(instance, '_dry_index_update', False)
-        instance.save(refresh_index=refresh_index, dry_index_update=dry_index_update)
+def update_document(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            touch_projects([instance.pk])
+            index_on_commit([instance.pk], author_id=instance.author_id)
+        return
+
+    # relation was changed from the industry or technology side, `pk_set` contains projects' ids
+    if action == 'pre_clear':
+        related_filter = {f'{instance._meta.model_name}_id': instance.pk}
+        instance._cleared_project_ids = list(
+            sender.objects.filter(**related_filter).values_list('project_id', flat=True))
+    elif action == 'post_clear':
+        project_ids = getattr(instance, '_cleared_project_ids', [])
+        touch_projects(project_ids)
+        index_on_commit(project_ids)
+    elif action in ('post_add', 'post_remove'):
+        touch_projects(pk_set)
+        index_on_commit(pk_set)
+
+
+@receiver(post_save, sender=Industry)
+@receiver(post_save, sender=Technology)
+@receiver(pre_delete, sender=Industry)
+@receiver(pre_delete, sender=Technology)
+def update_related_documents(sender, instance, created=False, **kwargs):
+    """Documents contain titles of industries and technologies, they are updated when one is renamed or deleted"""
+    if created or (kwargs['signal'] is post_save and not instance.title_changed):
+        return
+    instance._loaded_title = instance.title
+    related_field = 'industries' if sender is Industry else 'technologies'
+    project_ids = list(Project.objects.filter(**{related_field: instance.pk}).values_list('id', flat=True))
+    touch_projects(project_ids)
+    index_on_commit(project_ids)
 
 
 @receiver(pre_delete, sender=CSVFile)
@@ -0,0 +1,138 @@
+"""
+Coalescing of identical concurrent searches.
+
+Searches with the same index and query body, which run at the same time, are sent once: the first one
+is sent and others wait for its response. Responses are shared, so they must not be modified.
+Within a process concurrent searches wait for each other always. Across processes, if
+SEARCH_SINGLE_FLIGHT_ACROSS_PROCESSES is set, the first process takes a lock in the search cache
+and stores the response for processes which wait for it. A response is only shared with searches
+started while it was in flight, it is not cached for later ones
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import Future
+from django.conf import settings
+from .cache import get_search_cache
+
+# stored instead of the response if the search of another process has failed
+FAILED = 'failed'
+
+
+def get_flight_key(index_name: str, query: dict) -> str:
+    body = json.dumps({'index': index_name, 'query': query}, sort_keys=True, default=str)
+    return f'projects:flight:{hashlib.md5(body.encode()).hexdigest()}'
+
+
+class SingleFlight:
+    """Calls with the same key made by threads of the process while the first one runs get its result"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def run(self, key: str, fn):
+        with self.lock:
+            flight = self.flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self.flights[key] = Future()
+        if not is_leader:
+            return flight.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+
+class AsyncSingleFlight:
+    """`SingleFlight` of coroutines of an event loop, `fn()` returns an awaitable"""
+
+    def __init__(self):
+        self.flights = weakref.WeakKeyDictionary()
+
+    async def run(self, key: str, fn):
+        loop = asyncio.get_running_loop()
+        flights = self.flights.setdefault(loop, {})
+        flight = flights.get(key)
+        if flight is not None:
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                # the first request was cancelled, e.g. its client disconnected
+                return await fn()
+
+        flight = flights[key] = loop.create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # the exception is raised here, waiting coroutines may not retrieve it
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del flights[key]
+
+
+def run_across_processes(key: str, fn):
+    """
+    Runs `fn()` if no other process is running it under the same key, waits for its response otherwise.
+    Waits up to SEARCH_CACHE_LOCK_TIMEOUT seconds and runs `fn()` itself if the response does not appear
+    """
+    cache = get_search_cache()
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, timeout=settings.SEARCH_CACHE_LOCK_TIMEOUT):
+        result = FAILED
+        try:
+            result = fn()
+            return result
+        finally:
+            cache.set(f'{key}:{token}', result, timeout=settings.SEARCH_CACHE_LOCK_TIMEOUT)
+            cache.delete(lock_key)
+
+    leader_token = cache.get(lock_key)
+    deadline = time.monotonic() + settings.SEARCH_CACHE_LOCK_TIMEOUT
+    while leader_token is not None and time.monotonic() < deadline:
+        result = cache.get(f'{key}:{leader_token}')
+        if result is not None:
+            if result == FAILED:
+                break
+            return result
+        time.sleep(0.02)
+    return fn()
+
+
+search_flights = SingleFlight()
+async_search_flights = AsyncSingleFlight()
+
+
+def coalesce_search(index_name: str, query: dict, search):
+    key = get_flight_key(index_name, query)
+    if settings.SEARCH_SINGLE_FLIGHT_ACROSS_PROCESSES:
+        return search_flights.run(key, lambda: run_across_processes(key, search))
+    return search_flights.run(key, search)
+
+
+async def acoalesce_search(index_name: str, query: dict, search):
+    """Searches of async views are coalesced within the event loop only"""
+    return await async_search_flights.run(get_flight_key(index_name, query), search)
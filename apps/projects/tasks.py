@@ -20,3 +20,51 @@ def send_email_to_user(self, mail_subject: str, plain_message: str, send_to: lis
         )
     except smtplib.SMTPException as ex:
         self.retry(exc=ex)
+
+
+@app.task(bind=True, ignore_result=True)
+def process_index_outbox_task(self) -> None:
+    """Celery task to send changed projects from the index outbox to ElasticSearch."""
+    from elasticsearch.exceptions import ElasticsearchException
+    from .cache import get_search_cache
+    from .indexing import OUTBOX_TASK_QUEUED_KEY, drain_index_outbox
+
+    # changes committed from now on are not seen by this run for sure, they queue another task
+    get_search_cache().delete(OUTBOX_TASK_QUEUED_KEY)
+    try:
+        # waiting for refresh does not slow down requests here, and cached search results are invalidated
+        # only when the new documents are searchable
+        drain_index_outbox(refresh='wait_for')
+    except ElasticsearchException as ex:
+        # exponential backoff: 1s, 2s, 4s, 8s, 16s. Entries of a longer outage stay in the outbox
+        # and are processed by the periodic task, so retries do not pile up while the cluster is down
+        self.retry(exc=ex, countdown=2 ** self.request.retries, max_retries=5)
+
+
+@app.task(ignore_result=True)
+def monitor_index_outbox() -> None:
+    """Celery task to report the index outbox depth and lag."""
+    import logging
+    from .indexing import get_index_outbox_stats
+
+    logger = logging.getLogger(__name__)
+    stats = get_index_outbox_stats()
+    if stats['lag'] > settings.ELASTICSEARCH_OUTBOX_LAG_ALERT:
+        logger.error('Index outbox is lagging: %(depth)s entries, the oldest one is %(lag).0fs old', stats)
+    else:
+        logger.info('Index outbox: %(depth)s entries, the oldest one is %(lag).0fs old', stats)
+
+
+@app.task(ignore_result=True)
+def sync_index_delta_task() -> None:
+    """Celery task to reindex projects changed since the last run and remove documents of deleted ones."""
+    import logging
+    from .delta import sync_index_delta
+
+    logger = logging.getLogger(__name__)
+    stats = sync_index_delta()
+    if stats is None:
+        logger.info('Delta synchronization of the index is already running')
+    elif stats.deleted or stats.missing:
+        logger.warning('Delta synchronization: %s changed, %s missing and %s deleted projects since %s',
+                       stats.reindexed, stats.missing, stats.deleted, stats.since)
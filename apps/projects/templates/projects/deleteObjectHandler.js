@@ -1,5 +1,5 @@
 function deleteObjectHandler(className, msg) {
-    $(`.${className}`).click(function (event) {
+    $(document).on('click', `.${className}`, function (event) {
         event.preventDefault();
         let url = $(this).data('delete-url');
         if (confirm(msg) && url) {
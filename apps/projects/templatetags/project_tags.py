@@ -28,8 +28,11 @@ def set_query_parameter(url, param_name, param_value):
     )
     scheme, netloc, path, query_string, fragment = urlsplit(url)
     query_params = parse_qs(query_string)
-    if param_name == 'page':
-        query_params['page'] = [param_value]
+    if param_name in ('page', 'cursor'):
+        # page is either numbered or requested by cursor
+        query_params.pop('page', None)
+        query_params.pop('cursor', None)
+        query_params[param_name] = [param_value]
     elif param_name in query_params:
         if str(param_value) not in query_params[param_name]:
             query_params[param_name] += [param_value]
@@ -1,3 +1,823 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest.mock import patch
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from apps.accounts.models import User
+from elasticsearch.exceptions import ConnectionError as ElasticsearchConnectionError
+from . import delta, utils
+from .cache import (
+    normalize_search_params, get_private_search_key, get_public_search_key, bump_author_versions,
+    bump_public_version, cached_search, get_cache_timeout, get_search_cache, mark_unrefreshed,
+)
+from .client import get_client, reset_client
+from .consistency import check_index_consistency, iter_drift, iter_index_hits, repair_drift
+from .delta import get_watermark, sync_index_delta
+from .documents import get_bulk_body, iter_document_sources
+from .executor import RequestExecutor, get_pool, reset_pool
+from .facets import Facet, get_facet_aggs, get_facet_counts
+from .hits import ProjectHit, get_projects_from_hits
+from .indexing import process_index_outbox, schedule_outbox_processing
+from .loaders import load_project_relations
+from .pagination import encode_cursor, decode_cursor, get_page_hits
+from .search import ProjectSearch, get_search_backend
+from .search.memory import MemoryElasticsearch
+from .search.postgres import PostgresBackend
+from .singleflight import SingleFlight, get_flight_key
+from .views import projects_async
+from .models import Project, Industry, Technology, IndexOutboxEntry
 
-# Create your tests here.
+
+@patch('apps.projects.utils.bulk_update_elastic_documents')
+class IndexOnCommitTests(TestCase):
+    def setUp(self):
+        self.u1 = User.objects.create_user(
+            'demo@mail.com', 'John Doe', 'demo')
+        self.industry = Industry.objects.create(title='Fintech')
+        self.technology = Technology.objects.create(title='Python')
+
+    def test_project_form_is_indexed_once(self, bulk_update):
+        """ Saving project with industries and technologies sends one bulk request."""
+        self.client.force_login(self.u1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('project_create'), {
+                'title': 'Portfolio',
+                'description': 'Portfolio management',
+                'industries': [self.industry.id],
+                'technologies': [self.technology.id],
+                'is_private': True,
+            })
+        project = Project.objects.get(title='Portfolio')
+        bulk_update.assert_called_once()
+        self.assertEqual(bulk_update.call_args.args, ({project.id},))
+        self.assertEqual(bulk_update.call_args.kwargs['refresh'], 'wait_for')
+
+    def test_project_form_does_not_touch_saved_project(self, bulk_update):
+        """ Relations saved with the project do not update `updated_at` again."""
+        self.client.force_login(self.u1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('project_create'), {
+                'title': 'Portfolio',
+                'description': 'Portfolio management',
+                'industries': [self.industry.id],
+                'technologies': [self.technology.id],
+                'is_private': True,
+            })
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "projects_project"')])
+
+    def test_relation_change_touches_project_once(self, bulk_update):
+        # saved without signals, so it is not known as saved in the test transaction
+        Project.objects.bulk_create([Project(title='Portfolio', description='', author=self.u1)])
+        project = Project.objects.get(title='Portfolio')
+        updated_at = project.updated_at
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                project.industries.add(self.industry)
+                project.technologies.add(self.technology)
+        touches = [query for query in queries if query['sql'].startswith('UPDATE "projects_project"')]
+        self.assertEqual(len(touches), 1)
+        project.refresh_from_db()
+        self.assertGreater(project.updated_at, updated_at)
+
+    def test_rolled_back_changes_are_not_indexed(self, bulk_update):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    Project.objects.create(title='Portfolio', description='', author=self.u1)
+                    raise RuntimeError
+        self.assertEqual(callbacks, [])
+        bulk_update.assert_not_called()
+        self.assertFalse(IndexOutboxEntry.objects.exists())
+
+    def test_outbox_entries_are_removed_after_indexing(self, bulk_update):
+        with self.captureOnCommitCallbacks(execute=True):
+            project = Project.objects.create(title='Portfolio', description='', author=self.u1)
+            project.technologies.add(self.technology)
+            self.assertEqual(IndexOutboxEntry.objects.filter(project_id=project.id).count(), 1)
+        self.assertFalse(IndexOutboxEntry.objects.exists())
+
+    def test_failed_indexing_keeps_outbox_entries(self, bulk_update):
+        bulk_update.side_effect = ElasticsearchConnectionError('N/A', 'Connection refused', None)
+        project = Project.objects.create(title='Portfolio', description='', author=self.u1)
+        with self.assertRaises(ElasticsearchConnectionError):
+            process_index_outbox()
+        self.assertTrue(IndexOutboxEntry.objects.filter(project_id=project.id).exists())
+
+    def test_relation_changed_from_industry_side(self, bulk_update):
+        with self.captureOnCommitCallbacks(execute=True):
+            project = Project.objects.create(title='Portfolio', description='', author=self.u1)
+            self.industry.projects_containing_industry.add(project)
+        bulk_update.assert_called_once()
+        self.assertEqual(bulk_update.call_args.args, ({project.id},))
+
+    @override_settings(ELASTICSEARCH_ASYNC_INDEXING=True,
+                       CACHES={'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @patch('apps.projects.tasks.process_index_outbox_task.delay')
+    def test_processing_task_is_queued_once(self, delay, bulk_update):
+        get_search_cache().clear()
+        # two transactions commit before the worker takes the task
+        schedule_outbox_processing({1})
+        schedule_outbox_processing({2})
+        delay.assert_called_once()
+        bulk_update.assert_not_called()
+
+    @patch('apps.projects.signals.index_on_commit')
+    def test_related_documents_are_updated_on_rename_only(self, index_on_commit, bulk_update):
+        project = Project.objects.create(title='Portfolio', description='', author=self.u1)
+        project.industries.add(self.industry)
+        index_on_commit.reset_mock()
+
+        industry = Industry.objects.get(id=self.industry.id)
+        industry.save()
+        index_on_commit.assert_not_called()
+
+        industry.title = 'Finance'
+        industry.save()
+        index_on_commit.assert_called_once_with([project.id])
+        # saved title is the loaded one now
+        industry.save()
+        index_on_commit.assert_called_once()
+
+        industry.delete()
+        self.assertEqual(index_on_commit.call_count, 2)
+
+
+@override_settings(CACHES={'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        get_search_cache().clear()
+
+    def test_normalize_search_params(self):
+        self.assertEqual(
+            normalize_search_params('private', 1, [3, 1, 3], [2], '  Web   Portal '),
+            normalize_search_params('private', 1, [1, 3], [2], 'web portal'),
+        )
+
+    def test_author_version_bump_invalidates_results(self):
+        params = normalize_search_params('private', 1, [], [])
+        key = get_private_search_key(1, params)
+        self.assertEqual(cached_search(key, lambda: {'hits': 1}), {'hits': 1})
+        self.assertEqual(cached_search(key, lambda: {'hits': 2}), {'hits': 1})
+
+        bump_author_versions([1])
+        new_key = get_private_search_key(1, params)
+        self.assertNotEqual(new_key, key)
+        self.assertEqual(cached_search(new_key, lambda: {'hits': 2}), {'hits': 2})
+        # other authors' results are not affected
+        self.assertEqual(get_private_search_key(2, params), get_private_search_key(2, params))
+
+    def test_public_version_bump_invalidates_results(self):
+        params = normalize_search_params('public', 1, [], [])
+        key = get_public_search_key(params)
+        self.assertEqual(cached_search(key, lambda: {'hits': 1}), {'hits': 1})
+        bump_public_version()
+        self.assertNotEqual(get_public_search_key(params), key)
+
+    @override_settings(SEARCH_CACHE_LOCK_TIMEOUT=0)
+    def test_searches_itself_if_locked_search_does_not_finish(self):
+        key = get_public_search_key(normalize_search_params('public', 1, [], []))
+        get_search_cache().add(f'{key}:lock', 1)
+        self.assertEqual(cached_search(key, lambda: {'hits': 1}), {'hits': 1})
+        # result of the search is cached only by the request holding the lock
+        self.assertIsNone(get_search_cache().get(key))
+
+    @override_settings(SEARCH_CACHE_TIMEOUT=300)
+    def test_results_expire_with_refresh_of_unrefreshed_changes(self):
+        self.assertEqual(get_cache_timeout(), 300)
+        mark_unrefreshed(2)
+        self.assertLessEqual(get_cache_timeout(), 2)
+        self.assertEqual(get_cache_timeout(1), 1)
+
+    @override_settings(SEARCH_CACHE_TIMEOUT=300, ELASTICSEARCH_REFRESH_POLICY='interval')
+    def test_refresh_delay_of_intervals(self):
+        for interval, delay in (('30s', 31), ('1.5s', 2.5), ('500ms', 1.5), ('2m', 121), ('-1', 300), ('x', 300)):
+            with self.subTest(interval=interval):
+                with override_settings(ELASTICSEARCH_REFRESH_INTERVAL=interval):
+                    self.assertEqual(utils.get_refresh_delay(), delay)
+
+    @override_settings(SEARCH_CACHE_TIMEOUT=300, ELASTICSEARCH_REFRESH_POLICY='interval',
+                       ELASTICSEARCH_REFRESH_INTERVAL='30s')
+    @patch('apps.projects.utils.bulk_update_elastic_documents')
+    def test_outbox_without_refresh_shortens_cache_timeout(self, bulk_update):
+        author = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        Project.objects.create(title='Portfolio', description='', author=author)
+        process_index_outbox(refresh='wait_for')
+        self.assertEqual(get_cache_timeout(), 300)
+
+        Project.objects.create(title='Crm', description='', author=author)
+        process_index_outbox(refresh=False)
+        self.assertLessEqual(get_cache_timeout(), 31)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.fintech = Industry.objects.create(title='Fintech')
+        self.retail = Industry.objects.create(title='Retail')
+        self.python = Technology.objects.create(title='Python')
+        self.facets = [
+            Facet('industries', 'industries', [self.fintech.id]),
+            Facet('technologies', 'technologies', [self.python.id]),
+        ]
+
+    def test_facet_aggs_exclude_own_selection(self):
+        aggs = get_facet_aggs(self.facets)
+        self.assertEqual(aggs['industries']['filter'],
+                         {"bool": {"must": [{"terms": {"technologies": [self.python.id]}}]}})
+        self.assertEqual(aggs['industries']['aggs']['selected']['filter'], {"terms": {"industries": [self.fintech.id]}})
+
+    def test_facet_counts(self):
+        fintech, retail = f'{self.fintech.id}|Fintech', f'{self.retail.id}|Retail'
+        aggregations = {'industries': {
+            'values': {'buckets': [{'key': retail, 'doc_count': 5}, {'key': fintech, 'doc_count': 3}]},
+            'selected_values': {'buckets': [{'key': fintech, 'doc_count': 3}]},
+            'selected': {'values': {'buckets': [{'key': fintech, 'doc_count': 3}, {'key': retail, 'doc_count': 1}]}},
+        }}
+        with self.assertNumQueries(0):
+            counts = get_facet_counts(aggregations, self.facets[0])
+        self.assertEqual(counts, [[(self.fintech.id, 'Fintech'), 3], [(self.retail.id, 'Retail'), 4]])
+
+    def test_document_contains_titles(self):
+        project = Project.objects.create(title='Portfolio', description='', author=User.objects.create_user(
+            'demo@mail.com', 'John Doe', 'demo'))
+        project.industries.add(self.fintech)
+        source = project.get_elasticsearch_source()
+        self.assertEqual(source['industry_list'], [{'id': self.fintech.id, 'title': 'Fintech'}])
+        self.assertEqual(source['industries_facet'], [f'{self.fintech.id}|Fintech'])
+
+
+class CursorPaginationTests(TestCase):
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor([42])
+        self.assertEqual(decode_cursor(cursor), [42])
+        self.assertIsNone(decode_cursor(cursor[:-1]))
+
+    def test_next_cursor_only_if_there_are_more_hits(self):
+        hits = [{'_id': str(i), 'sort': [i]} for i in (3, 2, 1)]
+        page_hits, cursor = get_page_hits({'hits': {'hits': hits}}, 2)
+        self.assertEqual(page_hits, hits[:2])
+        self.assertEqual(decode_cursor(cursor), [2])
+        self.assertEqual(get_page_hits({'hits': {'hits': hits}}, 3), (hits, None))
+
+
+class ProjectHitTests(TestCase):
+    def setUp(self):
+        self.u1 = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        self.industry = Industry.objects.create(title='Fintech')
+
+    def test_projects_are_built_from_current_documents(self):
+        project = Project.objects.create(title='Portfolio', description='', author=self.u1)
+        project.industries.add(self.industry)
+        stale_project = Project.objects.create(title='Stale', description='', author=self.u1)
+        hits = [
+            {'_id': str(project.id), '_source': project.get_elasticsearch_source()},
+            {'_id': str(stale_project.id), '_source': {'project_id': stale_project.id, 'title': 'Stale'}},
+        ]
+        # only the stale project and its relations are loaded
+        with self.assertNumQueries(3):
+            projects = get_projects_from_hits(hits)
+        self.assertIsInstance(projects[0], ProjectHit)
+        self.assertEqual([industry.title for industry in projects[0].industry_list], ['Fintech'])
+        # stale document is replaced by the database row with prefetched relations
+        self.assertEqual(projects[1], stale_project)
+
+    def test_project_relations_are_loaded_in_two_queries(self):
+        projects = [Project.objects.create(title=f'Project {i}', description='', author=self.u1) for i in range(3)]
+        for project in projects:
+            project.industries.add(self.industry)
+        with self.assertNumQueries(2):
+            load_project_relations(projects)
+            self.assertEqual([[industry.title for industry in p.industry_list] for p in projects], [['Fintech']] * 3)
+            self.assertEqual([list(p.technology_list) for p in projects], [[], [], []])
+
+
+class DocumentTests(TestCase):
+    def setUp(self):
+        self.u1 = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        self.industry = Industry.objects.create(title='Fintech')
+        self.technology = Technology.objects.create(title='Python')
+        self.projects = [Project.objects.create(title=f'Project {i}', description='', author=self.u1)
+                         for i in range(5)]
+        for project in self.projects:
+            project.industries.add(self.industry)
+            project.technologies.add(self.technology)
+
+    def test_documents_are_built_in_fixed_number_of_queries(self):
+        with self.assertNumQueries(3):
+            sources = dict(iter_document_sources([project.id for project in self.projects]))
+        project = self.projects[0]
+        # adding relations has touched `updated_at`
+        project.refresh_from_db()
+        self.assertEqual(sources[project.id], project.get_elasticsearch_source())
+        self.assertEqual(json.loads(project.get_elasticsearch_document()), sources[project.id])
+
+    def test_bulk_body_deletes_missing_projects(self):
+        project = self.projects[0]
+        body = get_bulk_body(Project.objects.filter(id=project.id), 'projects_write',
+                             project_ids=[project.id, 0], versions={project.id: 2, 0: 3})
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(lines[0], {'index': {'_index': 'projects_write', '_id': project.id,
+                                              'version': 2, 'version_type': 'external_gte'}})
+        self.assertEqual(lines[1]['title'], project.title)
+        self.assertEqual(lines[2], {'delete': {'_index': 'projects_write', '_id': 0,
+                                               'version': 3, 'version_type': 'external_gte'}})
+
+
+class PostgresBackendTests(TestCase):
+    def setUp(self):
+        self.u1 = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        self.fintech = Industry.objects.create(title='Fintech')
+        self.retail = Industry.objects.create(title='Retail')
+        for title, industries, is_private in (('Payment portal', [self.fintech], False),
+                                              ('Web shop', [self.fintech, self.retail], False),
+                                              ('Private bank', [self.fintech], True)):
+            project = Project.objects.create(title=title, description='', author=self.u1, is_private=is_private)
+            project.industries.set(industries)
+
+    def get_facets(self, industries=()):
+        return [Facet('industries', 'industries', list(industries)), Facet('technologies', 'technologies', [])]
+
+    def test_public_search_with_facets(self):
+        result = PostgresBackend().search(ProjectSearch(public=True, facets=self.get_facets([self.retail.id])))
+        self.assertEqual(result.total, 1)
+        self.assertEqual([project.title for project in result.projects], ['Web shop'])
+        self.assertEqual(result.facets['industries'],
+                         [[(self.retail.id, 'Retail'), 1], [(self.fintech.id, 'Fintech'), 1]])
+
+    def test_text_search_matches_phrase_prefix(self):
+        search = ProjectSearch(author_id=self.u1.id, facets=self.get_facets(), search_text='payment por')
+        self.assertEqual([project.title for project in PostgresBackend().search(search).projects], ['Payment portal'])
+
+
+class ClientTests(TestCase):
+    def tearDown(self):
+        reset_client()
+
+    def test_client_is_created_once_per_process(self):
+        reset_client()
+        client = get_client()
+        self.assertIsInstance(client, MemoryElasticsearch)
+        self.assertIs(get_client(), client)
+        # a forked process forgets the client of its parent
+        reset_client()
+        self.assertIsNot(get_client(), client)
+
+    @override_settings(ELASTICSEARCH_ASYNC_INDEXING=True)
+    def test_memory_engine_is_not_shared_with_celery_worker(self):
+        reset_client()
+        with self.assertRaises(ImproperlyConfigured):
+            get_client()
+
+
+class AsyncProjectsViewTests(TestCase):
+    def setUp(self):
+        reset_client()
+        utils.reset_index_ready()
+        self.u1 = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        project = Project.objects.create(title='Portfolio', description='', author=self.u1, is_private=False)
+        project.industries.add(Industry.objects.create(title='Fintech'))
+        get_search_backend().index_projects([project.id], refresh=True)
+
+    def tearDown(self):
+        reset_client()
+
+    async def test_public_projects_are_listed(self):
+        request = AsyncRequestFactory().get(reverse('projects_public'))
+        request.user = self.u1
+        response = await projects_async(request)
+        self.assertContains(response, 'Portfolio')
+        self.assertContains(response, 'Fintech')
+
+
+@override_settings(CACHES={'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SuggestTests(TestCase):
+    def setUp(self):
+        reset_client()
+        utils.reset_index_ready()
+        self.u1 = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        self.u2 = User.objects.create_user('other@mail.com', 'Jane Doe', 'other')
+        projects = [Project.objects.create(title=title, description='', author=author, is_private=is_private)
+                    for title, author, is_private in (('Payment portal', self.u1, False),
+                                                      ('Mobile payments', self.u2, False),
+                                                      ('Private payroll', self.u2, True))]
+        get_search_backend().index_projects([project.id for project in projects], refresh=True)
+        self.client.force_login(self.u1)
+
+    def tearDown(self):
+        reset_client()
+        get_search_cache().clear()
+
+    def get_titles(self, url_name, text):
+        response = self.client.get(reverse(url_name), {'search': text})
+        return sorted(suggestion['title'] for suggestion in response.json()['suggestions'])
+
+    def test_titles_are_suggested_by_prefix_within_tab(self):
+        self.assertEqual(self.get_titles('projects_public_suggest', 'PAY'), ['Mobile payments', 'Payment portal'])
+        self.assertEqual(self.get_titles('projects_suggest', 'pay'), ['Payment portal'])
+        self.assertEqual(self.get_titles('projects_suggest', ' '), [])
+
+    def test_suggestions_of_prefix_are_cached(self):
+        self.get_titles('projects_public_suggest', 'pay')
+        with patch('apps.projects.search.elastic.ElasticsearchBackend.suggest') as suggest:
+            self.assertEqual(self.get_titles('projects_public_suggest', 'Pay '), ['Mobile payments', 'Payment portal'])
+        suggest.assert_not_called()
+
+
+@override_settings(CACHES={'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   PROJECTS_FACET_SIZE=1)
+class ProjectsFacetsViewTests(TestCase):
+    def setUp(self):
+        reset_client()
+        utils.reset_index_ready()
+        self.u1 = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        self.fintech = Industry.objects.create(title='Fintech')
+        self.retail = Industry.objects.create(title='Retail')
+        projects = []
+        for industries in ([self.fintech], [self.fintech], [self.retail]):
+            project = Project.objects.create(title='Portfolio', description='', author=self.u1, is_private=False)
+            project.industries.set(industries)
+            projects.append(project)
+        get_search_backend().index_projects([project.id for project in projects], refresh=True)
+        self.client.force_login(self.u1)
+
+    def tearDown(self):
+        reset_client()
+        get_search_cache().clear()
+
+    def test_listing_is_rendered_without_facets(self):
+        response = self.client.get(reverse('projects_public'))
+        self.assertContains(response, 'Portfolio')
+        self.assertNotContains(response, f'id="industries{self.fintech.id}Check"')
+
+    def test_top_values_and_more_url(self):
+        response = self.client.get(reverse('projects_public_facets')).json()
+        self.assertIn('Fintech', response['industries']['html'])
+        self.assertNotIn('Retail', response['industries']['html'])
+
+        response = self.client.get(response['industries']['more_url']).json()
+        self.assertEqual(list(response), ['industries'])
+        self.assertIn('Retail', response['industries']['html'])
+        self.assertIsNone(response['industries']['more_url'])
+
+    def test_more_url_with_selected_value_among_top_values(self):
+        banking = Industry.objects.create(title='Banking')
+        project = Project.objects.create(title='Portfolio', description='', author=self.u1, is_private=False)
+        project.industries.set([banking])
+        get_search_backend().index_projects([project.id], refresh=True)
+        response = self.client.get(reverse('projects_public_facets'), {'industries': [self.fintech.id]}).json()
+        self.assertIn('Fintech', response['industries']['html'])
+        self.assertIsNotNone(response['industries']['more_url'])
+
+    def test_selected_value_outside_top_values_is_shown(self):
+        response = self.client.get(reverse('projects_public_facets'), {'industries': [self.retail.id]}).json()
+        self.assertIn('Fintech', response['industries']['html'])
+        self.assertIn('Retail', response['industries']['html'])
+
+
+class RequestExecutorTests(TestCase):
+    def test_steps_run_inline_within_transaction(self):
+        executor = RequestExecutor()
+        future = executor.submit('count', Project.objects.count)
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(), 0)
+        self.assertEqual([name for name, _ in executor.timings], ['count'])
+
+    def test_server_timing_header(self):
+        reset_client()
+        utils.reset_index_ready()
+        utils.ensure_index()
+        self.client.force_login(User.objects.create_user('demo@mail.com', 'John Doe', 'demo'))
+        response = self.client.get(reverse('projects_public'))
+        self.assertIn('search;dur=', response['Server-Timing'])
+        reset_client()
+
+
+class RequestExecutorThreadTests(TransactionTestCase):
+    """`TestCase` runs tests in a transaction, where steps always run in the calling thread"""
+
+    def setUp(self):
+        reset_pool()
+
+    def tearDown(self):
+        get_pool().submit(connections.close_all).result()
+        get_pool().shutdown()
+        reset_pool()
+
+    def run_steps(self, count: int) -> list:
+        def step():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return threading.get_ident(), connections['default'], connection.connection
+
+        executor = RequestExecutor()
+        return [executor.submit('step', step).result() for _ in range(count)]
+
+    @override_settings(PROJECTS_QUERY_THREADS=1)
+    def test_pool_threads_reuse_connections(self):
+        with patch.dict(connections.databases['default'], CONN_MAX_AGE=60):
+            steps = self.run_steps(3)
+        self.assertNotIn(threading.get_ident(), {thread_id for thread_id, _, _ in steps})
+        self.assertEqual(len({id(raw_connection) for _, _, raw_connection in steps}), 1)
+        self.assertIsNotNone(steps[-1][1].connection)
+
+    @override_settings(PROJECTS_QUERY_THREADS=1)
+    def test_connections_are_closed_after_steps_without_conn_max_age(self):
+        with patch.dict(connections.databases['default'], CONN_MAX_AGE=0):
+            steps = self.run_steps(2)
+        self.assertIsNot(steps[0][2], steps[1][2])
+        self.assertIsNone(steps[-1][1].connection)
+
+
+class SingleFlightTests(TestCase):
+    def test_concurrent_calls_share_one_result(self):
+        flights, started, release, calls = SingleFlight(), threading.Event(), threading.Event(), []
+
+        def search():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'hits': []}
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(flights.run, 'key', search)
+            started.wait(5)
+            followers = [executor.submit(flights.run, 'key', search) for _ in range(3)]
+            time.sleep(0.05)
+            release.set()
+            results = [future.result() for future in [leader] + followers]
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        # finished flight is not reused
+        flights.run('key', search)
+        self.assertEqual(len(calls), 2)
+
+    def test_flight_key_does_not_depend_on_order_of_keys(self):
+        self.assertEqual(get_flight_key('projects_read', {'size': 1, 'from': 0}),
+                         get_flight_key('projects_read', {'from': 0, 'size': 1}))
+        self.assertNotEqual(get_flight_key('projects_read', {'size': 1}), get_flight_key('projects_v1', {'size': 1}))
+
+
+class EnsureIndexTests(TestCase):
+    def setUp(self):
+        reset_client()
+        utils.reset_index_ready()
+
+    def tearDown(self):
+        reset_client()
+        utils.reset_index_ready()
+
+    def test_legacy_index_is_put_behind_aliases(self):
+        utils.es.indices.create(index=utils.LEGACY_INDEX, body={'mappings': {'properties': {
+            'title': {'type': 'text'}, 'project_id': {'type': 'long'},
+        }}})
+        utils.es.index(index=utils.LEGACY_INDEX, id=1, document={'title': 'Portfolio', 'project_id': 1})
+        with self.assertLogs('apps.projects.utils', 'WARNING'):
+            utils.ensure_index()
+        self.assertEqual(utils.get_alias_indices(utils.READ_ALIAS), [utils.LEGACY_INDEX])
+        self.assertEqual(utils.get_alias_indices(utils.WRITE_ALIAS), [utils.LEGACY_INDEX])
+        self.assertEqual(utils.es.count(index=utils.READ_ALIAS)['count'], 1)
+        self.assertEqual(utils.get_latest_index_version(), 0)
+        self.assertIn('industries_facet', utils.es.indices.get_mapping(index=utils.LEGACY_INDEX)[
+            utils.LEGACY_INDEX]['mappings']['properties'])
+
+    def test_index_created_by_another_worker(self):
+        utils.create_index(utils.get_versioned_index_name(1), aliases=(utils.READ_ALIAS, utils.WRITE_ALIAS))
+        # the other worker creates the index after the alias and versions have been checked
+        with patch.object(utils.es.indices, 'exists_alias', side_effect=[False, True]):
+            with patch('apps.projects.utils.get_latest_index_version', return_value=0):
+                utils.ensure_index()
+        self.assertEqual(utils.get_alias_indices(utils.WRITE_ALIAS), [utils.get_versioned_index_name(1)])
+
+
+class RebuildIndexTests(TestCase):
+    def setUp(self):
+        reset_client()
+        utils.reset_index_ready()
+        utils.ensure_index()
+        self.previous_indices = utils.get_alias_indices(utils.READ_ALIAS)
+        author = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        for i in range(2):
+            Project.objects.create(title=f'Project {i}', description='', author=author)
+
+    def tearDown(self):
+        reset_client()
+
+    def test_aliases_are_swapped_to_rebuilt_index(self):
+        index_name, stats = utils.rebuild_elastic_index()
+        self.assertEqual(stats.indexed, 2)
+        self.assertNotIn(index_name, self.previous_indices)
+        self.assertEqual(utils.get_alias_indices(utils.READ_ALIAS), [index_name])
+        self.assertEqual(utils.get_alias_indices(utils.WRITE_ALIAS), [index_name])
+        self.assertEqual(utils.es.count(index=utils.READ_ALIAS)['count'], 2)
+
+    def test_incomplete_index_is_not_swapped(self):
+        with patch('apps.projects.utils.get_bulk_index_actions', side_effect=lambda *args, **kwargs: iter([])):
+            with self.assertRaises(CommandError):
+                call_command('rebuild_elasticsearch_index', '--delete-previous')
+        self.assertEqual(utils.get_alias_indices(utils.READ_ALIAS), self.previous_indices)
+        self.assertTrue(utils.es.indices.exists(index=self.previous_indices[0]))
+        # the incomplete index is kept for inspection
+        self.assertEqual(utils.get_latest_index_version(), 2)
+
+    def test_projects_created_during_rebuild_do_not_fail_it(self):
+        author = User.objects.get(email='demo@mail.com')
+        delete_missing_documents = utils.delete_missing_documents
+
+        def create_project_once(index_name, *args, **kwargs):
+            # created after the replay has read changed projects, written to the current index only
+            if not Project.objects.filter(title='Created').exists():
+                Project.objects.create(title='Created', description='', author=author)
+            return delete_missing_documents(index_name, *args, **kwargs)
+
+        with patch('apps.projects.utils.delete_missing_documents', side_effect=create_project_once):
+            index_name, _ = utils.rebuild_elastic_index()
+        self.assertEqual(utils.get_alias_indices(utils.READ_ALIAS), [index_name])
+        self.assertEqual(utils.es.count(index=index_name)['count'], 3)
+
+    def get_disabled_refresh_indices(self, put_settings):
+        return [call.kwargs['index'] for call in put_settings.call_args_list
+                if call.kwargs['body']['index']['refresh_interval'] == '-1']
+
+    def test_bulk_update_keeps_refresh_of_live_index(self):
+        with patch.object(utils.es.indices, 'put_settings', wraps=utils.es.indices.put_settings) as put_settings:
+            call_command('update_elasticsearch_index', '--bulk', stdout=StringIO())
+        self.assertEqual(self.get_disabled_refresh_indices(put_settings), [])
+        self.assertEqual(utils.get_alias_indices(utils.READ_ALIAS), self.previous_indices)
+        self.assertEqual(utils.es.count(index=utils.READ_ALIAS)['count'], 2)
+
+    def test_rebuild_disables_refresh_of_new_index_only(self):
+        with patch.object(utils.es.indices, 'put_settings', wraps=utils.es.indices.put_settings) as put_settings:
+            index_name, _ = utils.rebuild_elastic_index()
+        # replays after the alias swap write to the live index
+        self.assertEqual(self.get_disabled_refresh_indices(put_settings), [index_name, index_name])
+
+
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        reset_client()
+        utils.reset_index_ready()
+        self.u1 = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        # documents of projects created within the test transaction are not indexed on commit
+        self.projects = [Project.objects.create(title=f'Project {i}', description='', author=self.u1)
+                         for i in range(3)]
+
+    def tearDown(self):
+        reset_client()
+
+    def get_indexed_ids(self):
+        utils.es.indices.refresh(index=utils.WRITE_ALIAS)
+        result = utils.es.search(index=utils.READ_ALIAS, body={'size': 10, '_source': ['project_id']})
+        return sorted(hit['_source']['project_id'] for hit in result['hits']['hits'])
+
+    def test_missing_and_deleted_projects_are_synchronized(self):
+        stats = sync_index_delta(range_size=2)
+        self.assertEqual(stats.missing, 3)
+        self.assertEqual(self.get_indexed_ids(), [project.id for project in self.projects])
+        self.assertIsNotNone(get_watermark())
+
+        self.projects[0].delete()
+        stats = sync_index_delta(range_size=2)
+        self.assertEqual(stats.deleted, 1)
+        self.assertEqual(self.get_indexed_ids(), [project.id for project in self.projects[1:]])
+
+    def test_newer_documents_are_not_overwritten(self):
+        sync_index_delta(range_size=2)
+        project = self.projects[0]
+        Project.objects.filter(id=project.id).update(title='Renamed')
+        get_indexed_seq_nos = delta.get_indexed_seq_nos
+
+        def write_after_read(*args, **kwargs):
+            # the outbox writes a newer state after the sequence numbers are read
+            seq_nos = get_indexed_seq_nos(*args, **kwargs)
+            document = {**utils.es.get(index=utils.WRITE_ALIAS, id=project.id)['_source'], 'title': 'Newer'}
+            utils.es.index(index=utils.WRITE_ALIAS, id=project.id, document=document)
+            return seq_nos
+
+        with patch('apps.projects.delta.get_indexed_seq_nos', side_effect=write_after_read):
+            sync_index_delta(range_size=2)
+        self.assertEqual(utils.es.get(index=utils.WRITE_ALIAS, id=project.id)['_source']['title'], 'Newer')
+        self.assertEqual(utils.es.get(index=utils.WRITE_ALIAS, id=self.projects[1].id)['_source']['title'],
+                         'Project 1')
+
+
+class ConsistencyTests(TestCase):
+    def setUp(self):
+        reset_client()
+        utils.reset_index_ready()
+        self.u1 = User.objects.create_user('demo@mail.com', 'John Doe', 'demo')
+        self.industry = Industry.objects.create(title='Fintech')
+        self.projects = [Project.objects.create(title=f'Project {i}', description='', author=self.u1)
+                         for i in range(3)]
+        get_search_backend().index_projects([project.id for project in self.projects], refresh=True)
+
+    def tearDown(self):
+        reset_client()
+
+    def get_document(self, project):
+        return utils.es.get(index=utils.WRITE_ALIAS, id=project.id)['_source']
+
+    def test_drift_is_reported_and_repaired(self):
+        # changes which are not indexed, signals index documents on commit only
+        Project.objects.filter(id=self.projects[0].id).update(is_private=False)
+        self.projects[1].industries.add(self.industry)
+        deleted_id = self.projects[2].id
+        self.projects[2].delete()
+        missing = Project.objects.create(title='Missing', description='', author=self.u1)
+
+        drifts = []
+        report = check_index_consistency(chunk_size=2, report=drifts.append)
+        self.assertEqual((report.projects, report.documents), (3, 3))
+        self.assertEqual([(drift.project_id, drift.kind, drift.fields) for drift in drifts], [
+            (self.projects[0].id, 'different', ['is_private']),
+            # saved in the same transaction, the relation change does not move `updated_at` again
+            (self.projects[1].id, 'different', ['industries']),
+            (deleted_id, 'orphaned', []),
+            (missing.id, 'missing', ['updated_at', 'is_private', 'industries', 'technologies']),
+        ])
+
+        report = check_index_consistency(chunk_size=2, repair=True)
+        self.assertEqual(report.repaired, 4)
+        self.assertEqual(check_index_consistency().different, 0)
+        self.assertFalse(self.get_document(self.projects[0])['is_private'])
+        self.assertEqual(self.get_document(self.projects[1])['industry_list'], [{'id': self.industry.id,
+                                                                                 'title': 'Fintech'}])
+
+    def test_repair_skips_documents_written_since_check(self):
+        project = self.projects[0]
+        Project.objects.filter(id=project.id).update(is_private=False)
+        project.refresh_from_db()
+        drift = next(iter_drift(iter([(project.id, project.get_elasticsearch_source())]), iter_index_hits()))
+        self.assertEqual(drift.fields, ['is_private'])
+        # the document is written again after it was read by the check
+        document = {**self.get_document(project), 'title': 'Renamed'}
+        utils.es.index(index=utils.WRITE_ALIAS, id=project.id, document=document)
+        repair_drift([drift])
+        self.assertEqual(self.get_document(project)['title'], 'Renamed')
+        self.assertTrue(self.get_document(project)['is_private'])
+
+
+class MemoryElasticsearchTests(TestCase):
+    def setUp(self):
+        self.es = MemoryElasticsearch()
+        self.es.indices.create(index='projects_v1', body={
+            'mappings': {'properties': {
+                'title': {'type': 'text'},
+                'project_id': {'type': 'long'},
+                'is_private': {'type': 'boolean'},
+                'industries': {'type': 'keyword'},
+            }},
+            'aliases': {'projects_read': {}},
+        })
+        for project_id, title, industries, is_private in ((1, 'Payment portal', [1], False),
+                                                          (2, 'Web shop', [1, 2], False),
+                                                          (3, 'Web portal', [2], True)):
+            self.es.index(index='projects_v1', id=project_id, document={
+                'title': title, 'project_id': project_id, 'industries': industries, 'is_private': is_private})
+
+    def search(self, **query):
+        return self.es.search(index='projects_read', body={'sort': [{'project_id': {'order': 'desc'}}], **query})
+
+    def test_bool_query_with_phrase_prefix(self):
+        result = self.search(query={'bool': {'must': [
+            {'term': {'is_private': False}},
+            {'match_phrase_prefix': {'title': 'web sh'}},
+        ]}})
+        self.assertEqual([hit['_id'] for hit in result['hits']['hits']], ['2'])
+
+    def test_aggregations_ignore_post_filter(self):
+        result = self.search(post_filter={'terms': {'industries': [2]}}, aggs={
+            'public': {'filter': {'term': {'is_private': False}},
+                       'aggs': {'industries': {'terms': {'field': 'industries'}}}},
+        })
+        self.assertEqual(result['hits']['total']['value'], 2)
+        self.assertEqual(result['aggregations']['public']['industries']['buckets'],
+                         [{'key': '1', 'doc_count': 2}, {'key': '2', 'doc_count': 1}])
+
+    def test_search_after(self):
+        result = self.search(size=1, search_after=[3])
+        self.assertEqual([hit['sort'] for hit in result['hits']['hits']], [[2]])
+        self.assertEqual(result['hits']['total']['value'], 3)
+
+    def test_older_external_version_is_rejected(self):
+        self.es.index(index='projects_v1', id=1, version=5, version_type='external_gte',
+                      document={'title': 'New', 'project_id': 1})
+        response = self.es.bulk(body=[{'index': {'_index': 'projects_v1', '_id': 1, 'version': 4,
+                                                 'version_type': 'external_gte'}}, {'title': 'Old', 'project_id': 1}])
+        self.assertEqual(response['items'][0]['index']['status'], 409)
+        self.assertEqual(self.es.get(index='projects_read', id=1)['_source']['title'], 'New')
+
+    def test_writes_reuse_ordinals(self):
+        memory_index = self.es.indices_by_name['projects_v1']
+        for _ in range(3):
+            self.es.index(index='projects_v1', id=2, document={'title': 'Web shop', 'project_id': 2})
+        self.es.delete(index='projects_v1', id=1)
+        self.es.index(index='projects_v1', id=4, document={'title': 'Web app', 'project_id': 4})
+        self.assertEqual(memory_index.live.bit_length(), 3)
+        result = self.search(query={'match_phrase_prefix': {'title': 'web'}})
+        self.assertEqual([hit['_id'] for hit in result['hits']['hits']], ['4', '3', '2'])
@@ -1,13 +1,22 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+projects_view = views.projects_async if settings.PROJECTS_ASYNC_LISTING else views.projects
+
 urlpatterns = [
-    path('projects/', views.projects, name='projects'),
+    path('projects/', projects_view, name='projects'),
     path('projects/create/', views.project_create, name='project_create'),
     path('projects/delete/', views.projects_delete, name='projects_delete'),
     path('projects/<int:project_id>/edit/', views.project_edit, name='project_edit'),
     path('projects/<int:project_id>/delete/', views.project_delete, name='project_delete'),
-    path('projects/public/', views.projects, name='projects_public'),
+    path('projects/more/', views.projects_more, name='projects_more'),
+    path('projects/suggest/', views.projects_suggest, name='projects_suggest'),
+    path('projects/facets/', views.projects_facets, name='projects_facets'),
+    path('projects/public/', projects_view, name='projects_public'),
+    path('projects/public/more/', views.projects_more, name='projects_public_more'),
+    path('projects/public/suggest/', views.projects_suggest, name='projects_public_suggest'),
+    path('projects/public/facets/', views.projects_facets, name='projects_public_facets'),
     path('projects/upload-csv/', views.upload_csv, name='upload_csv'),
     path('project/upload-csv/confirm/', views.confirm_upload_csv, name='confirm_upload_csv'),
     path('mysets/', views.mysets, name='mysets'),
@@ -1,60 +1,463 @@
+import logging
+import re
+from collections import namedtuple
+from datetime import timedelta
+from time import perf_counter
+from django.utils import timezone
+from .client import LazyClient, get_async_client
+from .documents import dump_source, get_bulk_body, iter_document_sources
 from .models import Project
-from elasticsearch import Elasticsearch
+from .singleflight import coalesce_search, acoalesce_search
+from elasticsearch.exceptions import NotFoundError, RequestError
+from elasticsearch.helpers import BulkIndexError, streaming_bulk, parallel_bulk, scan
 from django.conf import settings
 
 
-es = Elasticsearch(hosts=settings.ELASTICSEARCH_URLS)
+es = LazyClient()
+logger = logging.getLogger(__name__)
 
+PROJECTS_INDEX = settings.ELASTICSEARCH_PROJECTS_INDEX
+# the only, unversioned, index of deployments made before the aliases were introduced
+LEGACY_INDEX = PROJECTS_INDEX
+READ_ALIAS = f'{PROJECTS_INDEX}_read'
+WRITE_ALIAS = f'{PROJECTS_INDEX}_write'
+# version of `get_index_mapping`, stored in `_meta` of indices
+MAPPING_VERSION = 3
+# writes committed shortly before the rebuild had started may have older `updated_at`
+REINDEX_REPLAY_MARGIN = timedelta(minutes=1)
+# time units of ElasticSearch, in seconds. A number without unit is milliseconds
+TIME_UNITS = {'d': 86400, 'h': 3600, 'm': 60, 's': 1, 'ms': 0.001, 'micros': 0.000001, 'nanos': 0.000000001}
+REFRESH_INTERVAL_RE = re.compile(r'^(?P<value>\d+(\.\d+)?)(?P<unit>d|h|m|s|ms|micros|nanos)?$')
+# counts of the rebuilt index are compared this many times, changes made meanwhile are replayed before each next one
+REBUILD_CHECK_ATTEMPTS = 3
 
-def create_index(index_name='projects'):
-    mapping = {
-        "mappings": {
-            "properties": {
-                "title": {"type": "text"},
-                "description": {"type": "text"},
-                "author": {"type": "keyword"},
-                "project_id": {"type": "long"},
-                "is_private": {"type": "boolean"},
-                "industries": {"type": "keyword"},
-                "technologies": {"type": "keyword"}
-            }
-        }
+# whether the write alias is known to exist in this process, see `ensure_index`
+_index_ready = False
+
+BulkIndexStats = namedtuple('BulkIndexStats', ['indexed', 'failed', 'seconds', 'errors'])
+
+
+class IndexRebuildError(Exception):
+    """The rebuilt index is incomplete, aliases were left pointing to the previous index"""
+
+    def __init__(self, message, index_name):
+        super().__init__(message)
+        self.index_name = index_name
+
+
+def get_indexable_projects():
+    """Copies of projects made for sets are not original and are never put into the index"""
+    return Project.objects.filter(is_original=True)
+
+
+def get_versioned_index_name(version: int) -> str:
+    return f'{PROJECTS_INDEX}_v{version}'
+
+
+def get_latest_index_version() -> int:
+    versions = []
+    for index_name in es.indices.get(index=f'{PROJECTS_INDEX}_v*'):
+        version = index_name.rsplit('_v', 1)[-1]
+        if version.isdigit():
+            versions.append(int(version))
+    return max(versions, default=0)
+
+
+def get_alias_indices(alias: str) -> list[str]:
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return list(es.indices.get_alias(name=alias))
+
+
+def is_aliased(index_name: str) -> bool:
+    """Whether an alias points to the index, so it is searched or written by users"""
+    return any(info['aliases'] for info in es.indices.get(index=index_name).values())
+
+
+def get_refresh_param(read_your_writes=False):
+    """Value of `refresh` parameter of write requests according to ELASTICSEARCH_REFRESH_POLICY"""
+    if read_your_writes and settings.ELASTICSEARCH_REFRESH_POLICY == 'wait_for':
+        return 'wait_for'
+    return False
+
+
+def get_index_refresh_interval():
+    """Refresh interval of new indices. `None` keeps the default interval of ElasticSearch"""
+    if settings.ELASTICSEARCH_REFRESH_POLICY == 'interval':
+        return settings.ELASTICSEARCH_REFRESH_INTERVAL
+    return None
+
+
+def get_refresh_delay() -> float:
+    """
+    Seconds until documents written without waiting for refresh become searchable, with a margin.
+    SEARCH_CACHE_TIMEOUT if periodic refresh is disabled (`-1`) or the interval is not understood
+    """
+    interval = get_index_refresh_interval() or '1s'
+    if match := REFRESH_INTERVAL_RE.match(str(interval).strip()):
+        return float(match['value']) * TIME_UNITS[match['unit'] or 'ms'] + 1
+    return settings.SEARCH_CACHE_TIMEOUT
+
+
+def get_index_mapping() -> dict:
+    """
+    Mapping of MAPPING_VERSION, indices created before have an older one until the index is rebuilt.
+
+    `title` and `description` index prefixes of terms, which `match_phrase_prefix` uses instead of
+    expanding the last word of the search text into all terms with that prefix.
+    Global ordinals of the aggregated facet fields are built on refresh instead of by the first search after it.
+    `project_id` is the sort field, it is a long with doc values.
+    `updated_at` is only read from `_source` by the consistency check and is not indexed.
+    Unknown fields are rejected, new fields are added to older indices by `add_missing_properties`.
+    `_source` is kept whole: projects of the listing are rendered from it and partial updates of documents need it
+    """
+    text_field = {"type": "text", "index_prefixes": {"min_chars": 1, "max_chars": 10}}
+    facet_field = {"type": "keyword", "eager_global_ordinals": True}
+    return {
+        "dynamic": "strict",
+        "_source": {"enabled": True},
+        "_meta": {"mapping_version": MAPPING_VERSION},
+        "properties": {
+            "doc_version": {"type": "integer"},
+            "title": text_field,
+            "description": text_field,
+            "author": {"type": "keyword"},
+            "project_id": {"type": "long", "doc_values": True},
+            "is_private": {"type": "boolean"},
+            "url": {"type": "keyword", "index": False, "doc_values": False},
+            "url_is_active": {"type": "boolean", "index": False, "doc_values": False},
+            "updated_at": {"type": "date", "index": False, "doc_values": False},
+            "industries": {"type": "keyword"},
+            "technologies": {"type": "keyword"},
+            "industry_list": {"type": "object", "enabled": False},
+            "technology_list": {"type": "object", "enabled": False},
+            "industries_facet": facet_field,
+            "technologies_facet": facet_field,
+        },
     }
-    es.indices.create(index=index_name, body=mapping)
 
 
-def search_docs(query, index_name='projects'):
-    return es.search(index=index_name, body=query)
+def create_index(index_name, aliases=(), mappings=None):
+    body = {
+        "mappings": mappings or get_index_mapping(),
+        "aliases": {alias: {} for alias in aliases}
+    }
+    if refresh_interval := get_index_refresh_interval():
+        body["settings"] = {"index": {"refresh_interval": refresh_interval}}
+    es.indices.create(index=index_name, body=body)
+
+
+def alias_legacy_index():
+    """Puts the unversioned index behind the aliases, its documents are served until the index is rebuilt"""
+    logger.warning('Index %s is not versioned, it is used until rebuild_elasticsearch_index builds a new one',
+                   LEGACY_INDEX)
+    es.indices.update_aliases(body={"actions": [
+        {"add": {"index": LEGACY_INDEX, "alias": READ_ALIAS}},
+        {"add": {"index": LEGACY_INDEX, "alias": WRITE_ALIAS}},
+    ]})
+    add_missing_properties()
+
+
+def ensure_index():
+    """
+    Creates the first versioned index behind the read and write aliases if there is no write alias yet.
+    An unversioned index of an earlier deployment is put behind the aliases instead, so the listing is not empty
+    until `rebuild_elasticsearch_index` builds a versioned index. Workers which start at once may try
+    to create the same index, the ones which lose check the alias again.
+    The alias is checked once per process, until an index not found error resets the check
+    """
+    global _index_ready
+    if _index_ready:
+        return
+    if es.indices.exists_alias(name=WRITE_ALIAS):
+        add_missing_properties()
+    elif es.indices.exists(index=LEGACY_INDEX):
+        alias_legacy_index()
+    else:
+        index_name = get_versioned_index_name(get_latest_index_version() + 1)
+        try:
+            create_index(index_name, aliases=(READ_ALIAS, WRITE_ALIAS))
+        except RequestError as error:
+            # the index is created together with its aliases by another worker
+            if error.error != 'resource_already_exists_exception' or not es.indices.exists_alias(name=WRITE_ALIAS):
+                raise
+    _index_ready = True
+
+
+def reset_index_ready():
+    global _index_ready
+    _index_ready = False
+
+
+def is_index_not_found(error: dict) -> bool:
+    return error.get('type') == 'index_not_found_exception'
+
+
+def swap_aliases(index_name):
+    """Atomically points both read and write aliases to `index_name`"""
+    actions = [
+        {"remove": {"index": old_index, "alias": alias}}
+        for alias in (READ_ALIAS, WRITE_ALIAS)
+        for old_index in get_alias_indices(alias)
+    ]
+    actions += [
+        {"add": {"index": index_name, "alias": READ_ALIAS}},
+        {"add": {"index": index_name, "alias": WRITE_ALIAS}},
+    ]
+    es.indices.update_aliases(body={"actions": actions})
+
+
+def search_docs(query, index_name=READ_ALIAS):
+    """Identical concurrent searches are sent once and share the response, see `apps.projects.singleflight`"""
+    def search():
+        return es.search(index=index_name, body=query, request_timeout=settings.ELASTICSEARCH_SEARCH_TIMEOUT)
+
+    try:
+        return coalesce_search(index_name, query, search)
+    except NotFoundError:
+        reset_index_ready()
+        raise
 
 
-def refresh_elastic_index(index_name='projects'):
-    if es.indices.exists(index=index_name):
-        es.indices.refresh(index=index_name)
+async def async_search_docs(query, index_name=READ_ALIAS):
+    def search():
+        return get_async_client().search(index=index_name, body=query,
+                                         request_timeout=settings.ELASTICSEARCH_SEARCH_TIMEOUT)
 
+    try:
+        return await acoalesce_search(index_name, query, search)
+    except NotFoundError:
+        reset_index_ready()
+        raise
 
-def update_elastic_document(obj, index_name='projects', refresh_index=True):
-    if not es.indices.exists(index=index_name):
-        create_index(index_name)
+
+def refresh_elastic_index(index_name=WRITE_ALIAS):
+    es.indices.refresh(index=index_name, allow_no_indices=True, ignore_unavailable=True)
+
+
+def update_elastic_document(obj, index_name=WRITE_ALIAS, refresh=False):
+    ensure_index()
     project_doc = obj.get_elasticsearch_document()
-    es.index(index=index_name, id=obj.id, document=project_doc)
-    if refresh_index:
+    try:
+        es.index(index=index_name, id=obj.id, document=project_doc, refresh=refresh,
+                 require_alias=index_name == WRITE_ALIAS)
+    except NotFoundError:
+        reset_index_ready()
+        raise
+
+
+def delete_elastic_document(obj, index_name=WRITE_ALIAS, refresh=False):
+    es.delete(index=index_name, id=obj.id, refresh=refresh, ignore=[400, 404])
+
+
+def bulk_update_elastic_documents(project_ids, index_name=WRITE_ALIAS, refresh=False, versions=None):
+    """
+    Updates documents of given projects with one bulk request. Documents of projects which do not exist
+    anymore or which are not original are deleted.
+    If `versions` are given, documents are written with external versions and writes older than
+    the indexed version are skipped
+    """
+    ensure_index()
+    body = get_bulk_body(get_indexable_projects().filter(id__in=project_ids), index_name,
+                         project_ids=project_ids, versions=versions)
+    errors = send_bulk_body(body, index_name=index_name, refresh=refresh)
+    if errors and all(is_index_not_found(error) for error in errors):
+        # the alias was removed after it had been checked, create it again and resend documents
+        reset_index_ready()
+        ensure_index()
+        errors = send_bulk_body(body, index_name=index_name, refresh=refresh)
+    if errors:
+        raise BulkIndexError(f'{len(errors)} document(s) failed to index.', errors)
+
+
+def get_bulk_item_error(item: dict):
+    result = next(iter(item.values()))
+    # status 404 without error - deleted document did not exist,
+    # 409 - newer version of the document is already indexed
+    if 'error' not in result or result['status'] == 409:
+        return None
+    return result['error']
+
+
+def send_bulk_body(body: bytes, index_name=WRITE_ALIAS, refresh=False) -> list[dict]:
+    """Sends a serialized bulk request built by `get_bulk_body`. Returns errors of failed actions"""
+    response = es.bulk(body=body, refresh=refresh, require_alias=index_name == WRITE_ALIAS,
+                       request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT)
+    if not response['errors']:
+        return []
+    return [error for error in map(get_bulk_item_error, response['items']) if error]
+
+
+def send_bulk_actions(actions, index_name=WRITE_ALIAS, refresh=False) -> list[dict]:
+    """
+    Sends actions with the bulk API. Writes to the write alias are rejected if there is no such alias,
+    instead of creating an index with the alias name. Returns errors of failed actions
+    """
+    errors = []
+    results = streaming_bulk(es, actions, raise_on_error=False, refresh=refresh,
+                             require_alias=index_name == WRITE_ALIAS,
+                             request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT)
+    for ok, item in results:
+        if not ok and (error := get_bulk_item_error(item)):
+            errors.append(error)
+    return errors
+
+
+def add_missing_properties(index_name=WRITE_ALIAS):
+    """
+    Adds fields of `get_index_mapping` to mappings of indices created before these fields were introduced,
+    so documents with them are not rejected by the strict mapping. Changed fields need a rebuild of the index
+    """
+    properties = get_index_mapping()['properties']
+    for name, mapping in es.indices.get_mapping(index=index_name).items():
+        existing = mapping['mappings'].get('properties', {})
+        missing = {field: field_mapping for field, field_mapping in properties.items() if field not in existing}
+        if missing:
+            es.indices.put_mapping(index=name, body={"properties": missing})
+
+
+def update_elastic_index(index_name=WRITE_ALIAS):
+    ensure_index()
+    add_missing_properties(index_name)
+    for project in get_indexable_projects():
+        update_elastic_document(project, index_name=index_name)
+    refresh_elastic_index(index_name)
+
+
+def get_bulk_index_actions(queryset, index_name=WRITE_ALIAS, chunk_size=500):
+    """Documents are serialized once here, the bulk helpers send JSON strings as they are"""
+    for project_id, source in iter_document_sources(queryset, chunk_size):
+        yield {
+            '_index': index_name,
+            '_id': project_id,
+            '_source': dump_source(source),
+        }
+
+
+def bulk_update_elastic_index(index_name=WRITE_ALIAS, queryset=None, chunk_size=500, thread_count=1,
+                              max_errors=10) -> BulkIndexStats:
+    """
+    Reindexes projects with the bulk API. Projects are streamed from the database in chunks of `chunk_size`
+    and sent with `streaming_bulk` or, if `thread_count` is greater than 1, with `parallel_bulk`.
+    Periodic refresh of a new index, which no alias points to yet, is disabled while documents are sent.
+    A live index keeps its refresh interval, so changes of users stay searchable and writes waiting for refresh
+    are not blocked. The index is refreshed once at the end.
+    Returns number of indexed and failed documents, elapsed time and first `max_errors` errors
+    """
+    if queryset is None:
+        queryset = get_indexable_projects()
+    if index_name == WRITE_ALIAS:
+        ensure_index()
+    add_missing_properties(index_name)
+
+    actions = get_bulk_index_actions(queryset, index_name=index_name, chunk_size=chunk_size)
+    if thread_count > 1:
+        results = parallel_bulk(es, actions, thread_count=thread_count, chunk_size=chunk_size,
+                                raise_on_error=False, request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT)
+    else:
+        results = streaming_bulk(es, actions, chunk_size=chunk_size, raise_on_error=False, max_retries=3,
+                                 request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT)
+
+    indexed, failed, errors = 0, 0, []
+    started_at = perf_counter()
+    disable_refresh = not is_aliased(index_name)
+    if disable_refresh:
+        es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": "-1"}})
+    try:
+        for ok, item in results:
+            if ok:
+                indexed += 1
+                continue
+            failed += 1
+            if len(errors) < max_errors:
+                errors.append(item)
+    finally:
+        if disable_refresh:
+            refresh_interval = get_index_refresh_interval()
+            es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": refresh_interval}})
         refresh_elastic_index(index_name)
+    return BulkIndexStats(indexed=indexed, failed=failed, seconds=perf_counter() - started_at, errors=errors)
+
+
+def delete_missing_documents(index_name=WRITE_ALIAS, chunk_size=1000) -> int:
+    """Deletes documents of projects which are not in the database anymore. Returns number of deleted documents"""
+    def delete_actions():
+        doc_ids = scan(es, index=index_name, query={"_source": False, "sort": ["_doc"]}, size=chunk_size)
+        chunk = []
+        for doc in doc_ids:
+            chunk.append(int(doc['_id']))
+            if len(chunk) == chunk_size:
+                yield from get_missing_ids_actions(chunk)
+                chunk = []
+        yield from get_missing_ids_actions(chunk)
+
+    def get_missing_ids_actions(ids):
+        existing_ids = set(get_indexable_projects().filter(id__in=ids).values_list('id', flat=True))
+        for project_id in ids:
+            if project_id not in existing_ids:
+                yield {'_op_type': 'delete', '_index': index_name, '_id': project_id}
 
+    deleted = 0
+    for ok, _ in streaming_bulk(es, delete_actions(), chunk_size=chunk_size, raise_on_error=False,
+                                request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT):
+        deleted += ok
+    return deleted
 
-def delete_elastic_document(obj, index_name='projects', refresh_index=True):
-    es.delete(index=index_name, id=obj.id, ignore=[400, 404])
-    if refresh_index:
+
+def replay_changes(index_name, since, chunk_size=500) -> BulkIndexStats:
+    """Reindexes projects changed since `since` and deletes documents of deleted projects"""
+    stats = bulk_update_elastic_index(index_name=index_name, queryset=get_indexable_projects().filter(
+        updated_at__gte=since - REINDEX_REPLAY_MARGIN), chunk_size=chunk_size)
+    delete_missing_documents(index_name)
+    return stats
+
+
+def check_rebuilt_index(index_name, failed: int, replay_started_at, chunk_size=500):
+    """
+    Raises IndexRebuildError if projects failed to index or the index has not a document of each project.
+    Projects created or deleted after the replay started are written to the current index only, a difference
+    they explain is gone after they are replayed too. Returns the start of the last replay
+    """
+    if failed:
+        raise IndexRebuildError(f'{failed} project(s) failed to index into {index_name}', index_name)
+    for attempt in range(REBUILD_CHECK_ATTEMPTS):
         refresh_elastic_index(index_name)
+        document_count = es.count(index=index_name)['count']
+        project_count = get_indexable_projects().count()
+        if document_count == project_count:
+            return replay_started_at
+        if attempt < REBUILD_CHECK_ATTEMPTS - 1:
+            started_at = timezone.now()
+            stats = replay_changes(index_name, replay_started_at, chunk_size)
+            if stats.failed:
+                raise IndexRebuildError(f'{stats.failed} project(s) failed to index into {index_name}', index_name)
+            replay_started_at = started_at
+    raise IndexRebuildError(f'{index_name} has {document_count} documents of {project_count} projects', index_name)
 
 
-def update_elastic_index(index_name='projects'):
-    if 'project_id' not in es.indices.get_mapping(index=index_name)[index_name]['mappings']['properties']:
-        additional_properties = {
-            "properties": {
-                "project_id": {"type": "long"}
-            }
-        }
-        es.indices.put_mapping(index=index_name, body=additional_properties)
-    for project in Project.objects.all():
-        update_elastic_document(project, index_name=index_name, refresh_index=False)
-    refresh_elastic_index(index_name)
+def rebuild_elastic_index(chunk_size=500, thread_count=1):
+    """
+    Builds a new versioned index while the aliases still point to the current one, so searches and writes
+    are not affected by the rebuild. Writes made during the build go to the current index and are
+    replayed into the new index from the database before and right after aliases are swapped.
+    Aliases are not swapped if the new index is incomplete, IndexRebuildError is raised and the new index
+    is kept for inspection. Returns the new index name and stats of the bulk load
+    """
+    index_name = get_versioned_index_name(get_latest_index_version() + 1)
+    create_index(index_name)
+
+    build_started_at = timezone.now()
+    stats = bulk_update_elastic_index(index_name=index_name, chunk_size=chunk_size, thread_count=thread_count)
+
+    replay_started_at = timezone.now()
+    replay_stats = replay_changes(index_name, build_started_at, chunk_size)
+    replay_started_at = check_rebuilt_index(index_name, stats.failed + replay_stats.failed, replay_started_at,
+                                            chunk_size)
+    swap_aliases(index_name)
+
+    # writes made between the last replay and the alias swap went to the previous index only
+    replay_changes(index_name, replay_started_at, chunk_size)
+
+    from .delta import set_watermark
+    set_watermark(replay_started_at, index_name)
+    return index_name, stats
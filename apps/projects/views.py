@@ -1,20 +1,35 @@
 from typing import Union
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from django.db.models.fields.files import FieldFile
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotAllowed
+from django.http import (
+    HttpResponse, HttpResponseRedirect, HttpResponseNotAllowed, HttpResponseBadRequest, JsonResponse,
+)
+from django.template.loader import render_to_string
 from django.urls import reverse
 from hashlib import md5
 from import_export.results import Result
 from uuid import uuid4
-from .models import Project, Industry, Technology, CSVFile, Set, SetSharedLink
-from .utils import search_docs
+from .models import Project, CSVFile, Set, SetSharedLink
+from .executor import get_request_executor
+from .facets import FACET_SIZE, Facet, limit_facet_values
+from .pagination import decode_cursor
+from .search import ProjectSearch, get_search_backend
+from .loaders import load_project_relations
+from .cache import (
+    normalize_search_params, get_private_search_key, get_public_search_key, cached_search, acached_search,
+)
 from tablib import import_set
 from .admin import ProjectResource, process_before_import_row
 from .forms import ProjectForm, SetForm
+from .indexing import read_your_writes
 from .tasks import send_email_to_user
 
 
@@ -40,49 +55,6 @@ def import_csv_file(file: Union[InMemoryUploadedFile, FieldFile], dry_run: bool,
     return project_resource.import_data(dataset, dry_run=dry_run, user_id=user_id)
 
 
-def set_exact_objects_order(elastic_objs_ids: list, model: Union[Project, Industry, Technology]) -> list:
-    """Returns list of objects in the exact order of returned elastic's sorted projects"""
-    objs_dict = {x.id: x for x in model.objects.filter(id__in=elastic_objs_ids)}
-    objects = [objs_dict[i] for i in elastic_objs_ids if i in objs_dict]
-    return objects
-
-
-def transform_aggregation(aggregation: dict, model: Union[Industry, Technology]) -> list[
-    list[Union[Industry, Technology, int]]]:
-    """
-    Retrieves objects' indices and doc_counts from aggregation and
-    returns list of lists with postgres object and object's doc_count from aggregation
-    """
-    ids = [int(bucket.get('key')) for bucket in aggregation]
-    doc_counts = [bucket.get('doc_count') for bucket in aggregation]
-    objs = set_exact_objects_order(ids, model)
-    return [[objs[i], doc_counts[i]] for i in range(len(objs))]
-
-
-def get_additional_filters(unfiltered_agg: dict, filtered_agg: dict, selected_ids: list[int],
-                           model: Union[Industry, Technology]) -> list:
-    """Subtracts filtered doc_count from unfiltered doc_dount in corresponding aggregations
-    in order to get additional filters' count"""
-    unfiltered_list = transform_aggregation(unfiltered_agg, model)
-    filtered_list = transform_aggregation(filtered_agg, model)
-
-    for i, (unfiltered_obj, doc_count) in enumerate(unfiltered_list):
-        # skip selected objects
-        if unfiltered_obj.id in selected_ids:
-            continue
-        if unfiltered_obj in [sublist[0] for sublist in filtered_list]:
-            # find index of sublist with unfiltered_obj in filtered_list
-            for sublist_index in range(len(filtered_list)):
-                if filtered_list[sublist_index][0] == unfiltered_obj:
-                    # subtract filtered from unfiltered doc_count
-                    unfiltered_list[i][1] = unfiltered_list[i][1] - filtered_list[sublist_index][1]
-                    break
-
-    # sort filters: at the top are selected ones and then additional filters in descending order
-    unfiltered_list = sorted(unfiltered_list, key=lambda x: (x[0].id in selected_ids, x[1]), reverse=True)
-    return unfiltered_list
-
-
 def get_projects_ids_from_cookies(cookies: dict) -> list:
     project_ids = cookies.get('project_ids')
     return [int(x) for x in project_ids.split('|')] if project_ids else []
@@ -102,10 +74,9 @@ def clone_project(project: Project):
     old_industries = project.industries.all()
     old_technologies = project.technologies.all()
     project.pk = None
-    # do not put the copied project into elastic index
-    project.save(refresh_index=False, dry_index_update=True)
+    # copied project is not original, so it is not put into elastic index
     project.is_original = False
-    project.save(refresh_index=False, dry_index_update=True)
+    project.save()
     project.industries.set(old_industries)
     project.technologies.set(old_technologies)
     return project
@@ -120,168 +91,186 @@ def get_client_ip(request) -> str:
     return ip
 
 
-@login_required
-def projects(request):
+def get_project_facets(request, size=FACET_SIZE) -> list[Facet]:
+    return [
+        Facet('industries', 'industries', sorted(set(map(int, request.GET.getlist('industries')))), size),
+        Facet('technologies', 'technologies', sorted(set(map(int, request.GET.getlist('technologies')))), size),
+    ]
+
+
+def get_load_more_url(request, public: bool, cursor: str) -> str:
+    params = request.GET.copy()
+    params.pop('page', None)
+    params['cursor'] = cursor
+    return f"{reverse('projects_public_more' if public else 'projects_more')}?{params.urlencode()}"
+
+
+def get_projects_search(request) -> tuple[ProjectSearch, dict]:
+    """Search of the projects listing by parameters of the request and context of the selected filters"""
     context = {}
-    selected_industries_ids = list(map(int, request.GET.getlist('industries')))
-    selected_technologies_ids = list(map(int, request.GET.getlist('technologies')))
+    facets = get_project_facets(request)
+    selected_industries_ids, selected_technologies_ids = (facet.selected_ids for facet in facets)
     project_search_text = request.GET.get("search")
-    public_projects_filter = False
-
-    if request.path == reverse('projects'):
-        context.update(current_tab='private')
-    elif request.path == reverse('projects_public'):
-        context.update(current_tab='public')
-        public_projects_filter = {"term": {"is_private": False}}
-
-    # ElasticSearch query
-    author_filter = {"terms": {"author": [request.user.id]}}
-    public_or_author_filter = [public_projects_filter or author_filter]
-    query = {
-        "from": (int(request.GET.get('page', 1)) - 1) * settings.PAGE_SIZE,
-        "size": settings.PAGE_SIZE,
-        "sort": [
-            {"project_id": {"order": "desc"}}
-        ],
-        "query": {
-            "bool": {
-                "must": public_or_author_filter
-            }
-        },
-        "aggs": {
-            "industries": {
-                "terms": {
-                    "field": "industries",
-                    "size": 1000
-                }
-            },
-            "technologies": {
-                "terms": {
-                    "field": "technologies",
-                    "size": 1000
-                }
-            },
-            "unfiltered_industries": {
-                "global": {},
-                "aggs": {
-                    "all_industries": {
-                        "aggs": {
-                            "industries": {
-                                "terms": {"field": "industries", "size": 1000}
-                            }
-                        },
-                        "filter": {
-                            "bool": {
-                                "must": public_or_author_filter
-                            }
-                        }
-                    }
-                }
-            },
-            "unfiltered_technologies": {
-                "global": {},
-                "aggs": {
-                    "all_technologies": {
-                        "aggs": {
-                            "technologies": {
-                                "terms": {"field": "technologies", "size": 1000}
-                            }
-                        },
-                        "filter": {
-                            "bool": {
-                                "must": public_or_author_filter
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    }
-
+    # pages after the numbered ones are requested by cursor
+    page = max(min(int(request.GET.get('page', 1)), settings.PROJECTS_NUMBERED_PAGES), 1)
+    search_after = decode_cursor(request.GET['cursor']) if 'cursor' in request.GET else None
+    public = request.path == reverse('projects_public')
+    context.update(current_tab='public' if public else 'private')
+
+    # facets are loaded by `projects_facets` after the page
+    search = ProjectSearch(public=public, author_id=request.user.id, facets=facets, search_text=project_search_text,
+                           page=page, search_after=search_after, with_facets=False)
     if selected_industries_ids:
         context.update(selected_industries=selected_industries_ids)
-        # add industries to query
-        query['query']['bool']['must'].append({"terms": {"industries": selected_industries_ids}})
-        # aggregation if no industries were checked
-        if selected_technologies_ids:
-            query['aggs']['unfiltered_industries']['aggs']['all_industries']['filter']['bool']['must'].append(
-                {"terms": {"technologies": selected_technologies_ids}}
-            )
-
     if selected_technologies_ids:
         context.update(selected_technologies=selected_technologies_ids)
-        # add technologies to query
-        query['query']['bool']['must'].append({"terms": {"technologies": selected_technologies_ids}})
-        # aggregation if no technologies were checked
-        if selected_industries_ids:
-            query['aggs']['unfiltered_technologies']['aggs']['all_technologies']['filter']['bool']['must'].append(
-                {"terms": {"industries": selected_industries_ids}}
-            )
-
     if project_search_text:
         context.update(search_value=project_search_text)
-        search_text_query = {
-            "bool": {
-                "should": [
-                    {"match_phrase_prefix": {"title": project_search_text}},
-                    {"match_phrase_prefix": {"description": project_search_text}}
-                ]
-            }
-        }
-        # add search fields to query
-        query['query']['bool']['must'].append(search_text_query)
-        # add search fields to unfiltered aggregations
-        query['aggs']['unfiltered_industries']['aggs']['all_industries']['filter']['bool']['must'].append(
-            search_text_query)
-        query['aggs']['unfiltered_technologies']['aggs']['all_technologies']['filter']['bool']['must'].append(
-            search_text_query)
-
-    # process elastic query
-    result = search_docs(query)
-    project_count = result['hits']['total']['value']
-    context.update(project_count=project_count)
+    return search, context
+
+
+def get_projects_search_key(request, search: ProjectSearch, context: dict) -> str:
+    selected_industries_ids, selected_technologies_ids = (facet.selected_ids for facet in search.facets)
+    search_params = normalize_search_params(context['current_tab'], search.page, selected_industries_ids,
+                                            selected_technologies_ids, search.search_text, search.search_after)
+    if search.public:
+        return get_public_search_key(search_params)
+    return get_private_search_key(request.user.id, search_params)
+
+
+def update_projects_context(request, context: dict, search: ProjectSearch, result):
+    context.update(project_count=result.total)
     context.update(page_size=settings.PAGE_SIZE)
 
-    project_list = []
-    if result['hits']['hits']:
-        proj_ids = [int(doc.get('_id')) for doc in result['hits']['hits']]
-        project_list = set_exact_objects_order(proj_ids, Project)
-    elif Project.objects.count() != 0:  # pass `no_search_result` to the template if there is any project in database
-        context.update(no_search_result=True)
-    context.update(projects=project_list)
+    next_cursor = result.next_cursor
+    context.update(page=search.page, cursor_page=search.search_after is not None,
+                   numbered_pages=settings.PROJECTS_NUMBERED_PAGES)
+    if next_cursor:
+        if search.search_after is None and search.page < settings.PROJECTS_NUMBERED_PAGES:
+            context.update(next_page=search.page + 1)
+        context.update(next_cursor=next_cursor, load_more_url=get_load_more_url(request, search.public, next_cursor))
 
-    # process elastic unfiltered_industries aggregation
-    if selected_industries_ids:
-        # get additional industry filters
-        industries = get_additional_filters(
-            unfiltered_agg=result['aggregations']['unfiltered_industries']['all_industries']['industries'][
-                'buckets'],
-            filtered_agg=result['aggregations']['industries']['buckets'],
-            selected_ids=selected_industries_ids,
-            model=Industry
-        )
-    else:
-        industries = transform_aggregation(result['aggregations']['industries']['buckets'], Industry)
+    context.update(projects=result.projects)
 
-    # process elastic unfiltered_technologies aggregation
-    if selected_technologies_ids:
-        # get additional technology filters
-        technologies = get_additional_filters(
-            unfiltered_agg=
-            result['aggregations']['unfiltered_technologies']['all_technologies']['technologies'][
-                'buckets'],
-            filtered_agg=result['aggregations']['technologies']['buckets'],
-            selected_ids=selected_technologies_ids,
-            model=Technology
-        )
-    else:
-        technologies = transform_aggregation(result['aggregations']['technologies']['buckets'], Technology)
 
-    context.update(industries=industries)
-    context.update(technologies=technologies)
+@login_required
+def projects(request):
+    executor = get_request_executor()
+    search, context = get_projects_search(request)
+    backend = get_search_backend()
+    search_key = executor.run('cache-key', get_projects_search_key, request, search, context)
+    result = executor.run('search', cached_search, search_key, lambda: backend.search(search))
+    update_projects_context(request, context, search, result)
+    if not result.projects and Project.objects.count() != 0:
+        # pass `no_search_result` to the template if there is any project in database
+        context.update(no_search_result=True)
     return render(request, 'projects/projects_list.html', context)
 
 
+def get_authenticated_user(request):
+    return request.user if request.user.is_authenticated else None
+
+
+async def projects_async(request):
+    """
+    `projects` for the ASGI deployment, used instead of it if PROJECTS_ASYNC_LISTING is set.
+    The worker is not blocked while the search runs, so one worker serves many slow searches at once.
+    Session, cache and database are used through `sync_to_async`
+    """
+    if await sync_to_async(get_authenticated_user)(request) is None:
+        return redirect_to_login(request.get_full_path())
+    executor = get_request_executor()
+    search, context = get_projects_search(request)
+    backend = get_search_backend()
+    with executor.timed('cache-key'):
+        search_key = await sync_to_async(get_projects_search_key)(request, search, context)
+    with executor.timed('search'):
+        result = await acached_search(search_key, lambda: backend.asearch(search))
+    update_projects_context(request, context, search, result)
+    if not result.projects and await sync_to_async(Project.objects.exists)():
+        # pass `no_search_result` to the template if there is any project in database
+        context.update(no_search_result=True)
+    return await sync_to_async(render)(request, 'projects/projects_list.html', context)
+
+
+@login_required
+def projects_more(request):
+    """Next projects after the cursor for the "load more" button, as rendered html and url of the next ones"""
+    search_after = decode_cursor(request.GET.get('cursor', ''))
+    if search_after is None:
+        return HttpResponseBadRequest('Invalid cursor')
+    public = request.path == reverse('projects_public_more')
+    search = ProjectSearch(public=public, author_id=request.user.id, facets=get_project_facets(request),
+                           search_text=request.GET.get('search'), search_after=search_after, with_facets=False)
+    result = get_search_backend().search(search)
+    html = render_to_string('projects/project_list_items.html', {'projects': result.projects}, request=request)
+    return JsonResponse({
+        'html': html,
+        'next_url': get_load_more_url(request, public, result.next_cursor) if result.next_cursor else None,
+    })
+
+
+def get_facet_more_url(request, public: bool, name: str) -> str:
+    params = request.GET.copy()
+    params['facet'] = name
+    return f"{reverse('projects_public_facets' if public else 'projects_facets')}?{params.urlencode()}"
+
+
+@login_required
+def projects_facets(request):
+    """
+    Values of the facets of the listing with numbers of projects, as rendered html of each facet, loaded after
+    the projects. Top PROJECTS_FACET_SIZE values are returned, `more_url` returns all values of the facet
+    """
+    public = request.path == reverse('projects_public_facets')
+    name = request.GET.get('facet')
+    facets = get_project_facets(request, size=FACET_SIZE if name else settings.PROJECTS_FACET_SIZE)
+    names = [facet.name for facet in facets]
+    if name is not None:
+        if name not in names:
+            return HttpResponseBadRequest('Invalid facet')
+        names = [name]
+    search = ProjectSearch(public=public, author_id=request.user.id, facets=facets,
+                           search_text=request.GET.get('search'))
+    selected_industries_ids, selected_technologies_ids = (facet.selected_ids for facet in facets)
+    params = normalize_search_params('public' if public else 'private', 1, selected_industries_ids,
+                                     selected_technologies_ids, search.search_text)
+    params.update(facets=names, facet_size=facets[0].size)
+    key = get_public_search_key(params) if public else get_private_search_key(request.user.id, params)
+    facet_counts = cached_search(key, lambda: get_search_backend().search_facets(search, names))
+
+    response = {}
+    for facet in facets:
+        if facet.name in names:
+            values, has_more = limit_facet_values(facet, facet_counts[facet.name])
+            html = render_to_string('projects/facet_values.html', {'facet': facet, 'values': values},
+                                    request=request)
+            response[facet.name] = {
+                'html': html,
+                'more_url': get_facet_more_url(request, public, facet.name) if has_more else None,
+            }
+    return JsonResponse(response)
+
+
+@login_required
+def projects_suggest(request):
+    """
+    Titles of projects of the tab for the type-ahead of the search box, as JSON. Suggestions of each prefix
+    are cached under the version of the searched projects, so typing does not run the listing search
+    """
+    prefix = ' '.join(request.GET.get('search', '').lower().split())[:100]
+    if not prefix:
+        return JsonResponse({'suggestions': []})
+    public = request.path == reverse('projects_public_suggest')
+    search = ProjectSearch(public=public, author_id=request.user.id, search_text=prefix,
+                           page_size=settings.PROJECTS_SUGGEST_SIZE, with_facets=False)
+    params = {'suggest': prefix, 'size': search.page_size}
+    key = get_public_search_key(params) if public else get_private_search_key(request.user.id, params)
+    suggestions = cached_search(key, lambda: get_search_backend().suggest(search),
+                                timeout=settings.SUGGEST_CACHE_TIMEOUT)
+    return JsonResponse({'suggestions': suggestions})
+
+
 @login_required
 def upload_csv(request):
     if request.method == 'POST':
@@ -304,6 +293,7 @@ def upload_csv(request):
 
 
 @login_required
+@read_your_writes
 def confirm_upload_csv(request):
     file_id = request.POST.get('file_id')
     file_obj = get_object_or_404(CSVFile, id=file_id)
@@ -313,6 +303,7 @@ def confirm_upload_csv(request):
 
 
 @login_required
+@read_your_writes
 def project_edit(request, project_id):
     project = get_object_or_404(Project, id=project_id, author=request.user)
     if request.method == 'POST':
@@ -326,6 +317,7 @@ def project_edit(request, project_id):
 
 
 @login_required
+@read_your_writes
 def project_delete(request, project_id):
     project = get_object_or_404(Project, id=project_id, author=request.user)
     project.delete()
@@ -333,6 +325,7 @@ def project_delete(request, project_id):
 
 
 @login_required
+@read_your_writes
 def project_create(request):
     if request.method == 'POST':
         form = ProjectForm(request.POST)
@@ -348,6 +341,7 @@ def project_create(request):
 
 
 @login_required
+@read_your_writes
 def projects_delete(request):
     Project.objects.filter(author=request.user).delete()
     return redirect('projects')
@@ -355,7 +349,9 @@ def projects_delete(request):
 
 @login_required
 def mysets(request):
-    context = {'sets': Set.objects.filter(author=request.user), 'current_tab': 'mysets'}
+    sets = list(Set.objects.filter(author=request.user).prefetch_related('projects'))
+    load_project_relations([project for set_obj in sets for project in set_obj.projects.all()])
+    context = {'sets': sets, 'current_tab': 'mysets'}
     return render(request, 'projects/mysets.html', context)
 
 
@@ -419,6 +415,7 @@ def myset_rename(request, set_id):
 
 
 @login_required
+@transaction.atomic
 def myset_copy(request, set_id):
     set_obj = get_object_or_404(Set, id=set_id, author=request.user)
     new_set_name = f'Copy of {set_obj.name}'
@@ -452,6 +449,7 @@ def myset_delete(request, set_id):
 
 
 @login_required
+@transaction.atomic
 def myset_project_edit(request, set_id, project_id):
     from .forms import InSetEditProjectForm
     set_obj = get_object_or_404(Set, id=set_id, author=request.user)
@@ -470,7 +468,7 @@ def myset_project_edit(request, set_id, project_id):
         form = InSetEditProjectForm(request.POST, instance=project)
         if form.is_valid():
             edited_project = form.save(commit=False)
-            edited_project.save(refresh_index=False, dry_index_update=True)
+            edited_project.save()
             form.save_m2m()  # save related industries and technologies
             return redirect('mysets')
     else:  # need this 'else' in order to return form object with errors if form was invalid
@@ -479,6 +477,7 @@ def myset_project_edit(request, set_id, project_id):
 
 
 @login_required
+@transaction.atomic
 def myset_project_delete(request, set_id, project_id):
     set_obj = get_object_or_404(Set, id=set_id, author=request.user)
     project = get_object_or_404(Project, id=project_id)
@@ -526,5 +525,8 @@ def myset_shared_link(request, token: str):
         plain_message = f'Somebody has just opened the shared link of your portfolio set: ' \
                         f'"{set_shared_link_obj.set.name}"'
         send_email_to_user.delay(mail_subject, plain_message, send_to=[set_shared_link_obj.set.author.email])
-    return render(request, 'projects/shared_set.html', {'set': set_shared_link_obj.set,
+    set_obj = set_shared_link_obj.set
+    prefetch_related_objects([set_obj], 'projects')
+    load_project_relations(set_obj.projects.all())
+    return render(request, 'projects/shared_set.html', {'set': set_obj,
                                                         'company': request.user.founder_company})
@@ -0,0 +1,78 @@
+"""
+Load test of the projects listing served by the WSGI deployment with the sync view and by the ASGI
+deployment with the async view (PROJECTS_ASYNC_LISTING=YES). Both servers are started beforehand with
+the same number of workers, e.g.:
+
+    gunicorn myset.wsgi -w 2 -b 127.0.0.1:8000
+    PROJECTS_ASYNC_LISTING=YES gunicorn myset.asgi -w 2 -k uvicorn.workers.UvicornWorker -b 127.0.0.1:8001
+
+and requested with the session cookie of a logged in user by `--concurrency` clients at once.
+Searches are varied by text, so they miss the search cache:
+
+    python -m benchmarks.async_listing --session <sessionid> \\
+        --url http://127.0.0.1:8000/projects/public/ --url http://127.0.0.1:8001/projects/public/
+"""
+import argparse
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from time import perf_counter
+import requests
+
+WORDS = ['web', 'portal', 'payment', 'mobile', 'platform', 'shop', 'analytics', 'health', 'bank', 'data']
+
+
+def run_client(url, session_id, requests_count, numbers, timings, errors):
+    session = requests.Session()
+    session.cookies.set('sessionid', session_id)
+    for _ in range(requests_count):
+        number = next(numbers)
+        params = {'search': f'{WORDS[number % len(WORDS)]} {number}'}
+        start = perf_counter()
+        try:
+            response = session.get(url, params=params, allow_redirects=False, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException:
+            errors.append(number)
+            continue
+        timings.append((perf_counter() - start) * 1000)
+
+
+def load_test(url, session_id, concurrency, requests_count):
+    """Returns latencies of successful requests in milliseconds, number of failed ones and requests per second"""
+    numbers, timings, errors = count(), [], []
+    lock = threading.Lock()
+
+    def next_number():
+        with lock:
+            return next(numbers)
+
+    started_at = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(run_client, url, session_id, requests_count, iter(next_number, None), timings, errors)
+    elapsed = perf_counter() - started_at
+    return timings, len(errors), (len(timings) + len(errors)) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', action='append', required=True, help='Listing URL of a deployment to compare')
+    parser.add_argument('--session', required=True, help='`sessionid` cookie of a logged in user')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=20, help='Number of requests sent by each client')
+    args = parser.parse_args()
+
+    for url in args.url:
+        timings, failed, throughput = load_test(url, args.session, args.concurrency, args.requests)
+        print(url)
+        if timings:
+            percentiles = statistics.quantiles(timings, n=100)
+            print(f'  {throughput:.1f} requests/s, median {statistics.median(timings):.0f} ms, '
+                  f'p95 {percentiles[94]:.0f} ms, max {max(timings):.0f} ms')
+        print(f'  {failed} failed requests')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Compares the mapping of indices created before MAPPING_VERSION 2 with the current one on generated documents:
+latency of prefix searches, of the first facet aggregation after a refresh and size of the index.
+
+Needs an ElasticSearch cluster configured in the environment, the same as `manage.py`: the in-process engine
+of a `memory://` URL neither builds prefix indices and global ordinals nor stores segments. Two indices named
+`<ELASTICSEARCH_PROJECTS_INDEX>_benchmark_<mapping>` are created and deleted at the end:
+
+    python -m benchmarks.index_mapping --projects 200000 --repeat 20
+"""
+import argparse
+import random
+import statistics
+from time import perf_counter
+from benchmarks.memory_search import generate_documents
+from benchmarks.utils import setup_django
+
+# mapping of `create_index` before MAPPING_VERSION 2
+LEGACY_MAPPING = {
+    "properties": {
+        "doc_version": {"type": "integer"},
+        "title": {"type": "text"},
+        "description": {"type": "text"},
+        "author": {"type": "keyword"},
+        "project_id": {"type": "long"},
+        "is_private": {"type": "boolean"},
+        "url": {"type": "keyword", "index": False},
+        "url_is_active": {"type": "boolean", "index": False},
+        "industries": {"type": "keyword"},
+        "technologies": {"type": "keyword"},
+        "industry_list": {"type": "object", "enabled": False},
+        "technology_list": {"type": "object", "enabled": False},
+        "industries_facet": {"type": "keyword"},
+        "technologies_facet": {"type": "keyword"}
+    }
+}
+
+PREFIXES = ['w', 'pa', 'pla', 'web p', 'mobile an', 'shop d']
+
+
+def timed(fn, repeat) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        timings.append((perf_counter() - start) * 1000)
+    return timings
+
+
+def measure(index_name, args) -> dict:
+    from apps.projects import utils
+    from apps.projects.facets import Facet
+    from apps.projects.search import ProjectSearch
+    from apps.projects.search.elastic import ElasticsearchBackend
+    facets = [Facet('industries', 'industries', []), Facet('technologies', 'technologies', [])]
+    backend = ElasticsearchBackend()
+
+    def search(search_text=None, with_facets=False):
+        query = backend.get_query(ProjectSearch(public=True, facets=facets, search_text=search_text,
+                                                with_facets=with_facets))
+        # the request cache would answer repeated searches without running them
+        utils.es.search(index=index_name, body=query, request_cache=False)
+
+    prefix_timings = []
+    for prefix in PREFIXES:
+        prefix_timings += timed(lambda: search(prefix), args.repeat)
+
+    def facets_after_refresh():
+        # a new segment makes global ordinals of the previous refresh outdated
+        document = next(generate_documents(1, args.industries, args.technologies))
+        utils.es.index(index=index_name, id=random.randint(1, args.projects), document=document['_source'])
+        utils.es.indices.refresh(index=index_name)
+        start = perf_counter()
+        search(with_facets=True)
+        return (perf_counter() - start) * 1000
+
+    facet_timings = [facets_after_refresh() for _ in range(args.repeat)]
+    stats = utils.es.indices.stats(index=index_name, metric='store')
+    return {
+        'prefix search': prefix_timings,
+        'first facets after refresh': facet_timings,
+        'size': stats['indices'][index_name]['total']['store']['size_in_bytes'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--projects', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    setup_django()
+    from django.conf import settings
+    from elasticsearch.helpers import streaming_bulk
+    from apps.projects import utils
+    if settings.ELASTICSEARCH_URLS[0].startswith('memory://'):
+        parser.error('the memory:// engine does not model what the mappings change, an ElasticSearch cluster is needed')
+
+    random.seed(0)
+    args.industries = [(obj_id, f'Industry {obj_id}') for obj_id in range(1, 41)]
+    args.technologies = [(obj_id, f'Technology {obj_id}') for obj_id in range(1, 201)]
+    mappings = {'legacy': LEGACY_MAPPING, f'v{utils.MAPPING_VERSION}': utils.get_index_mapping()}
+    for name, mapping in mappings.items():
+        index_name = f'{utils.PROJECTS_INDEX}_benchmark_{name}'
+        utils.es.indices.delete(index=index_name, ignore=[404])
+        utils.create_index(index_name, mappings=mapping)
+        try:
+            start = perf_counter()
+            documents = generate_documents(args.projects, args.industries, args.technologies)
+            for _ in streaming_bulk(utils.es, documents, index=index_name, chunk_size=1000):
+                pass
+            utils.es.indices.refresh(index=index_name)
+            print(f'{name}: indexed {args.projects} projects in {perf_counter() - start:.1f}s')
+            results = measure(index_name, args)
+        finally:
+            utils.es.indices.delete(index=index_name, ignore=[404])
+        for metric in ('prefix search', 'first facets after refresh'):
+            timings = results[metric]
+            print(f'  {metric}: median {statistics.median(timings):.1f} ms, max {max(timings):.1f} ms')
+        print(f'  index size: {results["size"] / 2 ** 20:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
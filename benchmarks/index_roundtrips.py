@@ -0,0 +1,75 @@
+"""
+Counts ElasticSearch round trips made while projects are imported, when existence of the index
+is cached per process and when it is checked before every write.
+
+Needs the database and ElasticSearch configured in the environment, the same as `manage.py`.
+With a `memory://` URL calls of the in-process engine are counted, one per request of the real client:
+
+    python -m benchmarks.index_roundtrips --rows 200
+"""
+import argparse
+from benchmarks.utils import setup_django, count_requests
+
+
+def import_rows_one_by_one(rows, author, industry, technology):
+    """Each row is saved in its own transaction, like admin import without transactions"""
+    from apps.projects.models import Project
+    for i in range(rows):
+        project = Project.objects.create(title=f'Benchmark project {i}', description='Benchmark', author=author)
+        project.industries.add(industry)
+        project.technologies.add(technology)
+
+
+def import_csv(rows, author, industry, technology):
+    """All rows are saved in one transaction, like the .csv upload"""
+    from tablib import Dataset
+    from apps.projects.views import ProjectResourceFrontEnd
+    dataset = Dataset(headers=['title', 'url', 'technologies', 'description', 'industries', 'deactivate_url'])
+    for i in range(rows):
+        dataset.append([f'Benchmark project {i}', '', technology.title, 'Benchmark', industry.title, ''])
+    ProjectResourceFrontEnd().import_data(dataset, dry_run=False, user_id=author.id)
+
+
+def run(scenario, rows, check_every_write):
+    from unittest.mock import patch
+    from django.test import override_settings
+    from apps.accounts.models import User
+    from apps.projects import utils
+    from apps.projects.models import Industry, Technology
+
+    author, _ = User.objects.get_or_create(email='benchmark@example.com', defaults={'name': 'Benchmark'})
+    industry, _ = Industry.objects.get_or_create(title='Benchmark')
+    technology, _ = Technology.objects.get_or_create(title='Benchmark')
+    ensure_index = utils.ensure_index
+
+    def ensure_index_uncached():
+        utils.reset_index_ready()
+        ensure_index()
+
+    utils.ensure_index()
+    with override_settings(ELASTICSEARCH_ASYNC_INDEXING=False):
+        with patch.object(utils, 'ensure_index', ensure_index_uncached if check_every_write else ensure_index):
+            with count_requests(utils.es) as counter:
+                scenario(rows, author, industry, technology)
+        author.author_projects.all().delete()
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200)
+    args = parser.parse_args()
+    setup_django()
+
+    for scenario in (import_rows_one_by_one, import_csv):
+        print(f'{scenario.__name__} ({args.rows} rows)')
+        for check_every_write in (True, False):
+            counter = run(scenario, args.rows, check_every_write)
+            label = 'checked before every write' if check_every_write else 'cached per process'
+            print(f'  index existence {label}: {sum(counter.values())} requests')
+            for request, count in sorted(counter.items()):
+                print(f'    {request}: {count}')
+
+
+if __name__ == '__main__':
+    main()
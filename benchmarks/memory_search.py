@@ -0,0 +1,88 @@
+"""
+Measures the projects search on the in-process engine with generated documents, without the database
+or an ElasticSearch cluster. Queries are built by the ElasticSearch search backend, the same as in the views:
+
+    DJANGO_SETTINGS_MODULE=myset.settings.testing python -m benchmarks.memory_search --projects 20000
+"""
+import argparse
+import random
+import statistics
+from time import perf_counter
+from benchmarks.utils import setup_django
+
+
+def generate_documents(count, industries, technologies):
+    from apps.projects.models import DOCUMENT_VERSION
+    words = ['web', 'portal', 'payment', 'mobile', 'platform', 'shop', 'analytics', 'health', 'bank', 'data']
+    for project_id in range(1, count + 1):
+        project_industries = random.sample(industries, random.randint(1, 3))
+        project_technologies = random.sample(technologies, random.randint(1, 5))
+        yield {
+            '_id': project_id,
+            '_source': {
+                'doc_version': DOCUMENT_VERSION,
+                'title': ' '.join(random.sample(words, 3)),
+                'description': ' '.join(random.choices(words, k=30)),
+                'author': random.randint(1, 50),
+                'project_id': project_id,
+                'is_private': random.random() < 0.3,
+                'url': None,
+                'url_is_active': False,
+                'industries': [obj_id for obj_id, _ in project_industries],
+                'technologies': [obj_id for obj_id, _ in project_technologies],
+                'industry_list': [{'id': obj_id, 'title': title} for obj_id, title in project_industries],
+                'technology_list': [{'id': obj_id, 'title': title} for obj_id, title in project_technologies],
+                'industries_facet': [f'{obj_id}|{title}' for obj_id, title in project_industries],
+                'technologies_facet': [f'{obj_id}|{title}' for obj_id, title in project_technologies],
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--projects', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    setup_django()
+    from elasticsearch.helpers import streaming_bulk
+    from apps.projects.facets import Facet
+    from apps.projects.search import ProjectSearch
+    from apps.projects.search.elastic import ElasticsearchBackend
+    from apps.projects.search.memory import MemoryElasticsearch
+    from apps.projects import utils
+
+    random.seed(0)
+    industries = [(obj_id, f'Industry {obj_id}') for obj_id in range(1, 41)]
+    technologies = [(obj_id, f'Technology {obj_id}') for obj_id in range(1, 201)]
+    utils.es = MemoryElasticsearch()
+    utils.reset_index_ready()
+    utils.ensure_index()
+
+    start = perf_counter()
+    documents = generate_documents(args.projects, industries, technologies)
+    for _ in streaming_bulk(utils.es, documents, index=utils.WRITE_ALIAS, chunk_size=1000):
+        pass
+    print(f'Indexed {args.projects} projects in {perf_counter() - start:.1f}s')
+
+    def facets(industry_ids=(), technology_ids=()):
+        return [Facet('industries', 'industries', list(industry_ids)),
+                Facet('technologies', 'technologies', list(technology_ids))]
+
+    backend = ElasticsearchBackend()
+    searches = {
+        'first page': ProjectSearch(public=True, facets=facets()),
+        'facet filters': ProjectSearch(public=True, facets=facets([1, 2], [3])),
+        'text search': ProjectSearch(public=True, facets=facets(), search_text='web por'),
+        'page 5': ProjectSearch(public=True, facets=facets(), page=5),
+    }
+    for name, search in searches.items():
+        timings = []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            backend.search(search)
+            timings.append((perf_counter() - start) * 1000)
+        print(f'{name}: median {statistics.median(timings):.1f} ms, max {max(timings):.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
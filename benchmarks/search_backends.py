@@ -0,0 +1,85 @@
+"""
+Compares latency of the ElasticSearch and PostgreSQL search backends on the same projects.
+
+Needs the database and ElasticSearch configured in the environment, the same as `manage.py`.
+Projects can be generated first, the ElasticSearch index is rebuilt from the database before measuring:
+
+    python -m benchmarks.search_backends --generate 5000 --repeat 50
+
+With `memory://` as the ElasticSearch url the in-process test engine is measured instead of a cluster.
+"""
+import argparse
+import statistics
+from time import perf_counter
+from benchmarks.utils import setup_django
+
+BACKENDS = {
+    'elasticsearch': 'apps.projects.search.elastic.ElasticsearchBackend',
+    'postgres': 'apps.projects.search.postgres.PostgresBackend',
+}
+
+
+def get_author_id():
+    """Author with the most projects, generated projects are private ones of the first user"""
+    from django.db.models import Count
+    from apps.projects.models import Project
+    return Project.objects.values('author_id').annotate(count=Count('id')).order_by('-count')[0]['author_id']
+
+
+def get_searches(author_id):
+    """Searches of the author's tab: the first page, filtered by facets, by text and a deep page"""
+    from apps.projects.facets import Facet
+    from apps.projects.models import Industry, Technology
+    from apps.projects.search import ProjectSearch
+    industry_ids = list(Industry.objects.values_list('id', flat=True)[:2])
+    technology_ids = list(Technology.objects.values_list('id', flat=True)[:1])
+
+    def facets(industries=(), technologies=()):
+        return [Facet('industries', 'industries', list(industries)),
+                Facet('technologies', 'technologies', list(technologies))]
+
+    return {
+        'first page': ProjectSearch(author_id=author_id, facets=facets()),
+        'facet filters': ProjectSearch(author_id=author_id, facets=facets(industry_ids, technology_ids)),
+        'text search': ProjectSearch(author_id=author_id, facets=facets(), search_text='data'),
+        'page 5': ProjectSearch(author_id=author_id, facets=facets(), page=5),
+    }
+
+
+def measure(backend, search, repeat) -> list[float]:
+    backend.search(search)  # warm up connections and caches
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        backend.search(search)
+        timings.append((perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--generate', type=int, default=0, help='Number of fake projects to generate first')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    setup_django()
+    from apps.projects.models import Project
+    from apps.projects.search import load_search_backend
+    from apps.projects.services import generate_fake_projects
+    from apps.projects.utils import rebuild_elastic_index
+
+    if args.generate:
+        generate_fake_projects(args.generate)
+    rebuild_elastic_index()
+    author_id = get_author_id()
+    print(f'{Project.objects.filter(author_id=author_id).count()} projects of the author')
+
+    for name, search in get_searches(author_id).items():
+        print(name)
+        for backend_name, path in BACKENDS.items():
+            timings = measure(load_search_backend(path), search, args.repeat)
+            print(f'  {backend_name}: median {statistics.median(timings):.1f} ms, '
+                  f'max {max(timings):.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
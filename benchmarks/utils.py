@@ -0,0 +1,70 @@
+import os
+from collections import Counter
+from contextlib import contextmanager
+
+
+def setup_django():
+    """Configures Django the same way as `manage.py` does"""
+    from decouple import config
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', config('DJANGO_SETTINGS_MODULE'))
+    import django
+    django.setup()
+
+
+MEMORY_ENGINE_METHODS = ('index', 'delete', 'get', 'bulk', 'search', 'count', 'scroll', 'clear_scroll')
+MEMORY_INDICES_METHODS = ('create', 'delete', 'exists', 'exists_alias', 'get_alias', 'get', 'update_aliases',
+                          'refresh', 'get_mapping', 'put_mapping', 'get_settings', 'put_settings')
+
+
+@contextmanager
+def count_requests(client):
+    """
+    Counts requests sent by the ElasticSearch client, grouped by method and endpoint.
+    Calls of the in-process engine of a `memory://` URL are counted by API method instead,
+    each of them is one request of the real client
+    """
+    from apps.projects.client import LazyClient, get_client
+    from apps.projects.search.memory import MemoryElasticsearch
+    if isinstance(client, LazyClient):
+        client = get_client()
+    if isinstance(client, MemoryElasticsearch):
+        with count_memory_engine_calls(client) as counter:
+            yield counter
+        return
+
+    counter = Counter()
+    perform_request = client.transport.perform_request
+
+    def counting_perform_request(method, url, *args, **kwargs):
+        endpoint = '/'.join(part for part in url.split('/') if part.startswith('_')) or 'document'
+        counter[f'{method} {endpoint}'] += 1
+        return perform_request(method, url, *args, **kwargs)
+
+    client.transport.perform_request = counting_perform_request
+    try:
+        yield counter
+    finally:
+        client.transport.perform_request = perform_request
+
+
+@contextmanager
+def count_memory_engine_calls(engine):
+    counter = Counter()
+
+    def counting(target, name, label):
+        method = getattr(target, name)
+
+        def counting_method(*args, **kwargs):
+            counter[label] += 1
+            return method(*args, **kwargs)
+        return counting_method
+
+    targets = [(engine, name, name) for name in MEMORY_ENGINE_METHODS]
+    targets += [(engine.indices, name, f'indices.{name}') for name in MEMORY_INDICES_METHODS]
+    for target, name, label in targets:
+        setattr(target, name, counting(target, name, label))
+    try:
+        yield counter
+    finally:
+        for target, name, _ in targets:
+            delattr(target, name)
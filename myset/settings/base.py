@@ -26,6 +26,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'django_extensions',
 
@@ -56,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.projects.middleware.ServerTimingMiddleware',
 ]
 
 
@@ -94,7 +96,11 @@ WSGI_APPLICATION = '%s.wsgi.application' % PROJECT_NAME
 
 # Database
 DATABASES = {
-    'default': dj_database_url.config(default=config('DATABASE_URL')),
+    # seconds connections are kept open, also by threads running lookups of requests in parallel.
+    # Threads of PROJECTS_QUERY_THREADS reuse their connections, each process keeps up to that many more open,
+    # with 0 every parallel lookup would open and close its own connection
+    'default': dj_database_url.config(default=config('DATABASE_URL'),
+                                      conn_max_age=config('DATABASE_CONN_MAX_AGE', default=60, cast=int)),
 }
 
 # Password validation
@@ -191,8 +197,48 @@ USE_HTTPS = False
 # Google integration
 GOOGLE_TAG_MANAGER = os.environ.get('GOOGLE_TAG_MANAGER', '')
 
+# `apps.projects.search.elastic.ElasticsearchBackend` or `apps.projects.search.postgres.PostgresBackend`
+# for deployments without an ElasticSearch cluster
+PROJECTS_SEARCH_BACKEND = config('PROJECTS_SEARCH_BACKEND',
+                                 default='apps.projects.search.elastic.ElasticsearchBackend')
+# Serve the projects listing with the async view, for the ASGI deployment of `myset.asgi`
+PROJECTS_ASYNC_LISTING = config('PROJECTS_ASYNC_LISTING', default='NO') == 'YES'
+# `memory://` runs the in-process engine of `apps.projects.search.memory` instead of connecting to a cluster,
+# for tests and benchmarks only: its indices live in one process and ELASTICSEARCH_ASYNC_INDEXING must be off
 ELASTICSEARCH_URLS = config('ELASTICSEARCH_URLS', default='http://localhost:9200').split(',')
+# Discover other nodes of the cluster from ELASTICSEARCH_URLS
+ELASTICSEARCH_SNIFF = config('ELASTICSEARCH_SNIFF', default='NO') == 'YES'
+# Connections kept per node by each process, the number of threads sending requests in one worker is enough
+ELASTICSEARCH_MAXSIZE = config('ELASTICSEARCH_MAXSIZE', default=4, cast=int)
+# Seconds to wait for a response: searches of web requests fail fast, bulk requests may take longer.
+# Timed out requests are retried on another node up to ELASTICSEARCH_MAX_RETRIES times
+ELASTICSEARCH_TIMEOUT = config('ELASTICSEARCH_TIMEOUT', default=10, cast=int)
+ELASTICSEARCH_SEARCH_TIMEOUT = config('ELASTICSEARCH_SEARCH_TIMEOUT', default=3, cast=int)
+ELASTICSEARCH_BULK_TIMEOUT = config('ELASTICSEARCH_BULK_TIMEOUT', default=60, cast=int)
+ELASTICSEARCH_MAX_RETRIES = config('ELASTICSEARCH_MAX_RETRIES', default=2, cast=int)
+# Gzip request bodies, mostly bulk requests with documents
+ELASTICSEARCH_HTTP_COMPRESS = config('ELASTICSEARCH_HTTP_COMPRESS', default='YES') == 'YES'
 # ELASTICSEARCH_INDICES_PREFIX = config('ELASTICSEARCH_INDICES_PREFIX', default=PROJECT_NAME)
+# Projects are stored in versioned indices (`projects_v1`, `projects_v2`, ...) behind
+# `projects_read` and `projects_write` aliases. The unversioned `projects` index of earlier deployments
+# is put behind the aliases on first use, run `rebuild_elasticsearch_index --delete-previous` after the deploy
+# to replace it with a versioned index of current documents
+ELASTICSEARCH_PROJECTS_INDEX = config('ELASTICSEARCH_PROJECTS_INDEX', default='projects')
+# When written documents become visible to search:
+# `none` - on the next scheduled refresh of the index,
+# `wait_for` - requests which show the changed projects right away wait for the next refresh,
+# `interval` - on the next refresh, which runs every ELASTICSEARCH_REFRESH_INTERVAL
+ELASTICSEARCH_REFRESH_POLICY = config('ELASTICSEARCH_REFRESH_POLICY', default='wait_for')
+ELASTICSEARCH_REFRESH_INTERVAL = config('ELASTICSEARCH_REFRESH_INTERVAL', default='30s')
+# Send changes of projects to ElasticSearch from the Celery worker instead of the web request
+ELASTICSEARCH_ASYNC_INDEXING = config('ELASTICSEARCH_ASYNC_INDEXING', default='YES') == 'YES'
+ELASTICSEARCH_OUTBOX_BATCH_SIZE = 500
+# seconds the oldest outbox entry may wait before the lag is reported as an error
+ELASTICSEARCH_OUTBOX_LAG_ALERT = config('ELASTICSEARCH_OUTBOX_LAG_ALERT', default=5 * 60, cast=int)
+# Width of ranges of project ids, which numbers of projects and documents are compared by the delta synchronization
+ELASTICSEARCH_DELTA_RANGE_SIZE = config('ELASTICSEARCH_DELTA_RANGE_SIZE', default=10000, cast=int)
+# seconds after which a delta synchronization which did not finish is not considered running anymore
+ELASTICSEARCH_DELTA_SYNC_LOCK_TIMEOUT = 30 * 60
 
 SITE_URL = config('SITE_URL', default='')
 
@@ -225,7 +271,36 @@ SOCIAL_AUTH_PIPELINE = (
 
 IMPORT_EXPORT_USE_TRANSACTIONS = True
 
+CELERY_BEAT_SCHEDULE = {
+    # picks up outbox entries which were not scheduled for processing, e.g. if the broker was not available
+    'process-index-outbox': {
+        'task': 'apps.projects.tasks.process_index_outbox_task',
+        'schedule': 60,
+    },
+    'monitor-index-outbox': {
+        'task': 'apps.projects.tasks.monitor_index_outbox',
+        'schedule': 60,
+    },
+    # repairs documents of changes the outbox has missed
+    'sync-index-delta': {
+        'task': 'apps.projects.tasks.sync_index_delta_task',
+        'schedule': 5 * 60,
+    },
+}
+
 PAGE_SIZE = 25
+# titles suggested while the search text is typed, suggestions of a prefix are cached for SUGGEST_CACHE_TIMEOUT
+PROJECTS_SUGGEST_SIZE = 8
+# values of each facet shown in the sidebar of the projects list before "Show more"
+PROJECTS_FACET_SIZE = config('PROJECTS_FACET_SIZE', default=20, cast=int)
+SUGGEST_CACHE_TIMEOUT = config('SUGGEST_CACHE_TIMEOUT', default=10 * 60, cast=int)
+# pages of the projects list available by number, next ones are loaded by cursor
+PROJECTS_NUMBERED_PAGES = 5
+# Threads of each process running independent database lookups of requests, 0 runs them one after another.
+# One request runs at most PROJECTS_REQUEST_PARALLEL_QUERIES of them at once, see `apps.projects.executor`.
+# Each thread keeps its own database connection for DATABASE_CONN_MAX_AGE seconds
+PROJECTS_QUERY_THREADS = config('PROJECTS_QUERY_THREADS', default=4, cast=int)
+PROJECTS_REQUEST_PARALLEL_QUERIES = config('PROJECTS_REQUEST_PARALLEL_QUERIES', default=3, cast=int)
 
 # Messages
 from django.contrib.messages import constants as messages
@@ -244,3 +319,18 @@ CACHES = {
 }
 # Tell select2 which cache configuration to use:
 SELECT2_CACHE_BACKEND = "select2"
+
+# Cache of project search results, see `apps.projects.cache`
+CACHES["search"] = {
+    "BACKEND": "django_redis.cache.RedisCache",
+    "LOCATION": config('SEARCH_CACHE_URL', default="redis://127.0.0.1:6379/3"),
+    "OPTIONS": {
+        "CLIENT_CLASS": "django_redis.client.DefaultClient",
+    }
+}
+SEARCH_CACHE_TIMEOUT = config('SEARCH_CACHE_TIMEOUT', default=5 * 60, cast=int)
+# seconds requests wait for the same search, which is already running after a cache miss
+SEARCH_CACHE_LOCK_TIMEOUT = 5
+# Identical searches running at the same time in different processes are sent to ElasticSearch once,
+# within a process they are coalesced always, see `apps.projects.singleflight`
+SEARCH_SINGLE_FLIGHT_ACROSS_PROCESSES = config('SEARCH_SINGLE_FLIGHT_ACROSS_PROCESSES', default='NO') == 'YES'
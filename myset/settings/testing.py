@@ -5,6 +5,9 @@ DEBUG = False
 CELERY_BROKER_URL = 'redis://'
 CELERY_RESULT_BACKEND = 'redis://'
 
+ELASTICSEARCH_URLS = ['memory://']
+ELASTICSEARCH_ASYNC_INDEXING = False
+
 PASSWORD_HASHERS = [
     'django.contrib.auth.hashers.MD5PasswordHasher',
 ]
@@ -12,7 +15,10 @@ PASSWORD_HASHERS = [
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-    }
+    },
+    'search': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
 }
 
 EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'